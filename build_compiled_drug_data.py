@@ -4,8 +4,27 @@ import json
 import os
 import time
 import gzip
+import codecs
+import argparse
+import hashlib
+import multiprocessing
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 import sys
+from restriction_classifier import RestrictionClassifier
+from drug_columnar import write_columnar
+from drug_search_index import build_search_index
+from build_metrics import BuildMetrics, PROFILERS
+
+# Optional compressors for the static-host side outputs
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 # Enable debugging based on environment variable
 DEBUG = os.getenv("DEBUG") == "true"
@@ -15,11 +34,21 @@ def log_debug(message):
         print(f"[DEBUG] {message}")
         
 # --- Configuration ---
-HC_API_BASE_URI = 'https://health-products.canada.ca/api/drug'
+HC_API_BASE_URI = os.getenv('HC_API_BASE_URI', 'https://health-products.canada.ca/api/drug')
 OUTPUT_FILENAME = 'compiled_drug_data.json'
 COMPRESSED_OUTPUT_FILENAME = 'compiled_drug_data.json.gz'
+COLUMNAR_OUTPUT_FILENAME = 'compiled_drug_data.bin' # Memory-mappable form, see drug_columnar.py
+SEARCH_INDEX_FILENAME = 'compiled_drug_data.search.json.gz' # Autocomplete index, see drug_search_index.py
 RESTRICTED_JSON = 'restricted_drugs.json'
+STATE_FILENAME = 'compiled_drug_data.state.json' # Per-drug_code hashes of the last snapshot, for incremental builds
+DELTA_FILENAME = 'compiled_drug_data.delta.json' # Changes since the previous snapshot
+DELTA_FORMAT_VERSION = 1
+COMBINE_CHUNK_SIZE = 2000 # Products per task when compiling with --workers
+JSON_WRITE_BATCH = 500 # Entries encoded per chunk when writing JSON outputs
 REQUEST_TIMEOUT = 60 # Slightly increased timeout for potentially larger datasets
+STREAM_CHUNK_SIZE = 64 * 1024 # Bytes read from the socket per chunk in streaming mode
+CACHE_DIRNAME = '.hc_cache' # Default --cache-dir, relative to the script directory
+USER_AGENT = 'DrugDataCompiler/1.1 (Python Script; +https://github.com/YourRepo/YourProject)'
 ENDPOINTS = {
     "schedule": "/schedule/?lang=en&type=json",
     "drugproduct": "/drugproduct/?lang=en&type=json",
@@ -60,22 +89,125 @@ ALWAYS_RESTRICTED_INGREDIENTS = {
 }
 
 # --- Helper Functions ---
-def fetch_data(name, path):
-    """Fetches data from the Health Canada API endpoint."""
+def create_session(pool_size=None):
+    """Creates a keep-alive HTTP session whose connection pool is shared by all endpoint fetches."""
+    pool_size = pool_size or len(ENDPOINTS)
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers.update({'User-Agent': USER_AGENT})
+    return session
+
+class ResponseCache:
+    """On-disk cache of raw endpoint payloads and their ETag/Last-Modified validators.
+
+    Each endpoint is stored as <name>.json with a <name>.meta.json sidecar. Payloads
+    are written to a temp file and renamed into place, so an interrupted run never
+    leaves a truncated payload behind.
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def body_path(self, name):
+        return os.path.join(self.cache_dir, f"{name}.json")
+
+    def meta_path(self, name):
+        return os.path.join(self.cache_dir, f"{name}.meta.json")
+
+    def load_meta(self, name):
+        """Returns the stored metadata for an endpoint, or None if it is not cached."""
+        try:
+            with open(self.meta_path(name), 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        return meta if os.path.exists(self.body_path(name)) else None
+
+    def conditional_headers(self, name):
+        """Builds If-None-Match/If-Modified-Since headers from the stored validators."""
+        meta = self.load_meta(name) or {}
+        headers = {}
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+        return headers
+
+    def read_body(self, name):
+        with open(self.body_path(name), 'rb') as f:
+            return f.read()
+
+    def open_writer(self, name):
+        """Opens a temp file for a new payload; pass it to commit() once fully written."""
+        return open(self.body_path(name) + '.tmp', 'wb')
+
+    def discard(self, writer):
+        """Closes and removes an uncommitted payload."""
+        writer.close()
+        if os.path.exists(writer.name):
+            os.remove(writer.name)
+
+    def commit(self, name, writer, url, response_headers):
+        """Moves a fully written payload into place and records its validators."""
+        writer.close()
+        os.replace(writer.name, self.body_path(name))
+        meta = {
+            'url': url,
+            'etag': response_headers.get('ETag'),
+            'last_modified': response_headers.get('Last-Modified'),
+            'fetched_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'bytes': os.path.getsize(self.body_path(name)),
+        }
+        with open(self.meta_path(name) + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        os.replace(self.meta_path(name) + '.tmp', self.meta_path(name))
+
+    def store(self, name, url, content, response_headers):
+        writer = self.open_writer(name)
+        writer.write(content)
+        self.commit(name, writer, url, response_headers)
+
+def fetch_data(name, path, session=None, stats=None, cache=None):
+    """Fetches data from the Health Canada API endpoint.
+
+    If a session is given its pooled connections are reused; if a stats dict is
+    given it is filled with the elapsed seconds and response size in bytes. If a
+    ResponseCache is given the request is conditional and a 304 Not Modified is
+    served from the cached payload.
+    """
     url = HC_API_BASE_URI + path
     print(f"\n🔗 Fetching {name} from {url}")
-    # Use a more descriptive user agent if possible
-    headers = {'User-Agent': 'DrugDataCompiler/1.1 (Python Script; +https://github.com/YourRepo/YourProject)'}
+    http = session or requests
+    headers = {'User-Agent': USER_AGENT}
+    if cache is not None:
+        headers.update(cache.conditional_headers(name))
+    start = time.time()
     try:
-        response = requests.get(url, timeout=REQUEST_TIMEOUT, headers=headers)
-        response.raise_for_status()
+        response = http.get(url, timeout=REQUEST_TIMEOUT, headers=headers)
+        if cache is not None and response.status_code == 304:
+            print(f"  ✓ {name} not modified, using cached copy")
+            content = cache.read_body(name)
+        else:
+            response.raise_for_status()
+            content = response.content
+            if cache is not None:
+                cache.store(name, url, content, response.headers)
+        if stats is not None:
+            stats['bytes'] = len(response.content)
+            stats['seconds'] = time.time() - start
+            stats['cached'] = response.status_code == 304
         # Handle empty response body before JSON decoding
-        if not response.content:
+        if not content:
             print(f"  ✓ Retrieved 0 records for {name} (API returned empty response)")
             return []
-        data = response.json()
+        data = json.loads(content)
         if isinstance(data, list):
             print(f"  ✓ Retrieved {len(data):,} records for {name}")
+            if stats is not None:
+                stats['records'] = len(data)
             return data
         elif data is None: # Explicitly check for null returned by API
             print(f"  ✓ Retrieved 0 records for {name} (API returned null)")
@@ -98,93 +230,402 @@ def fetch_data(name, path):
         print(f"  ❌ JSON Decode Error fetching {name}: {e}")
         print(f"     Response status: {response.status_code}")
         # Avoid printing large non-JSON responses fully
-        print(f"     Response text (first 200 chars): {response.text[:200]}...")
+        print(f"     Response text (first 200 chars): {content[:200].decode('utf-8', 'replace')}...")
         return None # Indicate critical failure
     except Exception as e:
         # Catch any other unexpected exceptions during fetch/processing
         print(f"  ❌ Unexpected Error during fetch/decode for {name}: {type(e).__name__} - {e}")
         return None # Indicate critical failure
 
+def iter_text(byte_chunks, encoding='utf-8'):
+    """Decodes an iterable of byte chunks into text chunks, handling split multi-byte characters."""
+    decoder = codecs.getincrementaldecoder(encoding)()
+    for chunk in byte_chunks:
+        text = decoder.decode(chunk)
+        if text:
+            yield text
+    tail = decoder.decode(b'', final=True)
+    if tail:
+        yield tail
+
+def iter_json_array(text_chunks):
+    """Yields the elements of a top-level JSON array one at a time.
+
+    Only the current element and one chunk of input are held in memory. A top-level
+    null or an empty body yields nothing; any other non-array value raises ValueError.
+    Malformed arrays (missing or extra commas, data after the closing bracket) raise
+    json.JSONDecodeError, as json.loads() would.
+    """
+    decoder = json.JSONDecoder()
+    chunks = iter(text_chunks)
+    buf, pos, eof = '', 0, False
+    expect = 'open' # then 'first' (value or ']'), 'value', 'separator' (',' or ']'), 'end'
+    while True:
+        while pos < len(buf) and buf[pos] in ' \t\r\n':
+            pos += 1
+        if pos < len(buf):
+            char = buf[pos]
+            if expect == 'open':
+                if char == '[':
+                    expect = 'first'
+                    pos += 1
+                    continue
+                # Not an array: decode the remainder whole (it is null in practice)
+                value = json.loads(buf[pos:] + ''.join(chunks))
+                if value is None:
+                    return
+                raise ValueError(f"Expected a JSON array, got {type(value).__name__}")
+            if expect == 'end':
+                raise json.JSONDecodeError("Extra data", buf, pos)
+            if expect in ('first', 'separator') and char == ']':
+                expect = 'end'
+                pos += 1
+                continue
+            if expect == 'separator':
+                if char != ',':
+                    raise json.JSONDecodeError("Expecting ',' delimiter", buf, pos)
+                expect = 'value'
+                pos += 1
+                continue
+            if char in ',]':
+                raise json.JSONDecodeError("Expecting value", buf, pos)
+            try:
+                value, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            else:
+                # A number cut off by the chunk edge (e.g. "1" of "1e5") decodes too early;
+                # only accept a value once the character after it is in the buffer
+                if eof or (end < len(buf) and buf[end] in ' \t\r\n,]'):
+                    yield value
+                    expect = 'separator'
+                    pos = end
+                    continue
+        elif eof:
+            if expect not in ('open', 'end'):
+                raise json.JSONDecodeError("Unterminated JSON array", buf, pos)
+            return
+        chunk = next(chunks, None)
+        if chunk is None:
+            eof = True
+        else:
+            buf = buf[pos:] + chunk
+            pos = 0
+
+def iter_json_file(file_path):
+    """Yields the records of a JSON array stored on disk without loading the whole file."""
+    with open(file_path, 'r', encoding='utf-8') as f:
+        yield from iter_json_array(iter(lambda: f.read(STREAM_CHUNK_SIZE), ''))
+
+def fetch_stream(name, path, consumer, session=None, stats=None, cache=None):
+    """Streams a Health Canada endpoint record by record into consumer.
+
+    consumer receives a generator of records and its return value is returned.
+    The response body is never held in memory as a whole. Returns None on a
+    critical failure, like fetch_data(). With a ResponseCache the request is
+    conditional: a 304 streams the cached payload from disk, and a fresh payload
+    is written to the cache as it is parsed.
+    """
+    url = HC_API_BASE_URI + path
+    print(f"\n🔗 Streaming {name} from {url}")
+    http = session or requests
+    headers = {'User-Agent': USER_AGENT}
+    if cache is not None:
+        headers.update(cache.conditional_headers(name))
+    counts = {'bytes': 0, 'records': 0}
+    start = time.time()
+    writer = None
+
+    def counted_bytes(response):
+        for chunk in response.iter_content(chunk_size=STREAM_CHUNK_SIZE):
+            counts['bytes'] += len(chunk)
+            if writer is not None:
+                writer.write(chunk)
+            yield chunk
+
+    def counted_records(records):
+        for record in records:
+            counts['records'] += 1
+            yield record
+
+    try:
+        with http.get(url, timeout=REQUEST_TIMEOUT, headers=headers, stream=True) as response:
+            if cache is not None and response.status_code == 304:
+                print(f"  ✓ {name} not modified, streaming cached copy")
+                counts['cached'] = True
+                result = consumer(counted_records(iter_json_file(cache.body_path(name))))
+            else:
+                response.raise_for_status()
+                if cache is not None:
+                    writer = cache.open_writer(name)
+                byte_chunks = counted_bytes(response)
+                result = consumer(counted_records(iter_json_array(iter_text(byte_chunks))))
+                if writer is not None:
+                    for _ in byte_chunks: # Drain anything after the closing bracket into the cache
+                        pass
+                    cache.commit(name, writer, url, response.headers)
+                    writer = None
+        print(f"  ✓ Streamed {counts['records']:,} records for {name}")
+        return result
+    except requests.exceptions.Timeout:
+        print(f"  ❌ Timeout Error streaming {name} after {REQUEST_TIMEOUT} seconds.")
+        return None
+    except requests.exceptions.HTTPError as e:
+        print(f"  ❌ HTTP Error streaming {name}: {e.response.status_code} {e.response.reason}")
+        print(f"     URL: {url}")
+        return None
+    except requests.exceptions.RequestException as e:
+        print(f"  ❌ Network/Request Error streaming {name}: {e}")
+        return None
+    except ValueError as e: # Includes json.JSONDecodeError
+        print(f"  ❌ JSON Decode Error streaming {name} after {counts['records']:,} records: {e}")
+        return None
+    except Exception as e:
+        print(f"  ❌ Unexpected Error during stream/decode for {name}: {type(e).__name__} - {e}")
+        return None
+    finally:
+        if writer is not None:
+            cache.discard(writer)
+        if stats is not None:
+            stats.update(counts, seconds=time.time() - start)
+
+def fetch_cached(name, cache, consumer=None, stats=None):
+    """Replays a cached endpoint payload without touching the network (--from-cache).
+
+    Without a consumer the records are returned as a list, like fetch_data(); with
+    one they are streamed from disk into it, like fetch_stream(). Returns None if
+    the endpoint is not cached or the payload cannot be decoded.
+    """
+    body_path = cache.body_path(name)
+    print(f"\n💾 Loading {name} from {body_path}")
+    if cache.load_meta(name) is None:
+        print(f"  ❌ No cached payload for {name}. Run once without --from-cache to populate the cache.")
+        return None
+    counts = {'bytes': os.path.getsize(body_path), 'records': 0, 'cached': True}
+    start = time.time()
+    try:
+        if consumer is None:
+            body = cache.read_body(name)
+            result = json.loads(body) if body.strip() else []
+            if not isinstance(result, list):
+                print(f"  ⚠️ Cached payload for {name} is not a list: {type(result)}. Treating as empty.")
+                result = []
+            counts['records'] = len(result)
+        else:
+            def counted_records():
+                for record in iter_json_file(body_path):
+                    counts['records'] += 1
+                    yield record
+            result = consumer(counted_records())
+        print(f"  ✓ Loaded {counts['records']:,} cached records for {name}")
+        return result
+    except ValueError as e: # Includes json.JSONDecodeError
+        print(f"  ❌ JSON Decode Error in cached {name} payload: {e}")
+        return None
+    finally:
+        if stats is not None:
+            stats.update(counts, seconds=time.time() - start)
+
+def build_ingredients_lookup(records):
+    """Groups active ingredient records by drug_code."""
+    ingredients_by_code = defaultdict(list)
+    for item in records:
+        drug_code = item.get('drug_code')
+        if drug_code:
+            ingredients_by_code[drug_code].append({
+                "name": item.get('ingredient_name', '').strip(),
+                "strength": item.get('strength', '').strip(),
+                "unit": item.get('strength_unit', '').strip()
+            })
+    return ingredients_by_code
+
+def build_forms_lookup(records):
+    """Groups pharmaceutical form names by drug_code."""
+    forms_by_code = defaultdict(list)
+    for item in records:
+        drug_code = item.get('drug_code')
+        if drug_code:
+            form_name = item.get('pharmaceutical_form_name', '').strip()
+            if form_name:
+                forms_by_code[drug_code].append(form_name)
+    return forms_by_code
+
+def build_schedule_lookup(records):
+    """Maps drug_code to its schedule name."""
+    schedule_by_code = {}
+    for item in records:
+        drug_code = item.get('drug_code')
+        if drug_code:
+            # Assuming one primary schedule per drug code from this endpoint
+            schedule_name = item.get('schedule_name', '').strip()
+            if schedule_name:
+                schedule_by_code[drug_code] = schedule_name
+    return schedule_by_code
+
+# Endpoints that are only needed as drug_code lookup tables, with their builders
+LOOKUP_BUILDERS = {
+    'activeingredient': build_ingredients_lookup,
+    'form': build_forms_lookup,
+    'schedule': build_schedule_lookup,
+}
+
+def fetch_all(endpoints=None, session=None, max_workers=None, stream=False, cache=None, offline=False):
+    """Fetches all endpoints concurrently over one pooled session.
+
+    Returns (all_data, fetch_stats). all_data maps endpoint name to its record
+    list, or None on a critical failure; fetch_stats maps endpoint name to its
+    elapsed seconds, byte count, record count and whether the cache was used.
+
+    With stream=True the lookup endpoints are parsed record by record straight
+    into their LOOKUP_BUILDERS tables, so all_data holds the built lookups for
+    those endpoints instead of record lists. With a ResponseCache requests are
+    conditional; with offline=True the cached payloads are replayed and the
+    network is not used at all.
+    """
+    endpoints = endpoints or ENDPOINTS
+    owns_session = session is None and not offline
+    if owns_session:
+        session = create_session(len(endpoints))
+    fetch_stats = {name: {'seconds': 0.0, 'bytes': 0, 'records': 0, 'cached': False} for name in endpoints}
+
+    def fetch_one(name, path):
+        consumer = LOOKUP_BUILDERS.get(name, list) if stream else None
+        if offline:
+            return fetch_cached(name, cache, consumer, fetch_stats[name])
+        if stream:
+            return fetch_stream(name, path, consumer, session, fetch_stats[name], cache)
+        return fetch_data(name, path, session, fetch_stats[name], cache)
+
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers or len(endpoints)) as executor:
+            futures = {name: executor.submit(fetch_one, name, path) for name, path in endpoints.items()}
+            all_data = {name: future.result() for name, future in futures.items()}
+    finally:
+        if owns_session:
+            session.close()
+    return all_data, fetch_stats
+
+def print_fetch_stats(fetch_stats):
+    """Prints per-endpoint timing and transfer size."""
+    for name, stats in fetch_stats.items():
+        mb = stats['bytes'] / 1024 / 1024
+        rate = mb / stats['seconds'] if stats['seconds'] else 0.0
+        source = " from cache" if stats.get('cached') else ""
+        print(f"  • {name:<18} {stats['seconds']:7.2f}s {mb:9.2f} MB ({rate:.2f} MB/s){source}")
+
 def normalize_text(txt):
     """Converts text to lowercase and strips whitespace."""
     return str(txt).strip().lower() if txt is not None else ""
 
-def save_compressed_json(data, output_file):
-    """Save JSON data to a compressed .gz file."""
-    try:
-        with gzip.open(output_file, 'wt', encoding='utf-8') as gz_file:
-            # Use indent=None and separators for smallest file size
-            json.dump(data, gz_file, ensure_ascii=False, separators=(',', ':'))
-        print(f"✅ Compressed JSON saved to {output_file} ({os.path.getsize(output_file)/1024/1024:.2f} MB)")
-    except IOError as e:
-        print(f"  ❌ ERROR: Could not write compressed file '{output_file}'. Error: {e}")
-    except Exception as e:
-        print(f"  ❌ ERROR: Unexpected error saving compressed file '{output_file}'. Error: {e}")
+class _BrotliWriter:
+    """Minimal binary file wrapper around a brotli.Compressor, so it can be used as an output sink."""
 
+    def __init__(self, path, quality):
+        self._file = open(path, 'wb')
+        self._compressor = brotli.Compressor(quality=quality)
 
-# --- Main Data Building Function ---
-def build_compiled_data():
-    """Fetches, processes, and combines Health Canada drug data."""
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    print(f"Script running in directory: {script_dir}")
-    print(f"Python version: {sys.version}")
+    def write(self, data):
+        self._file.write(self._compressor.process(data))
 
-    # --- Fetch data ---
-    print("\n--- Starting Data Fetch ---")
-    all_data = {}
-    fetch_failed = False
-    start_fetch = time.time()
-    for name, path in ENDPOINTS.items():
-        data = fetch_data(name, path)
-        if data is None: # Check for critical fetch failure indicated by None
-            print(f"  ❌ CRITICAL FAILURE fetching '{name}'. Cannot proceed reliably.")
-            fetch_failed = True
-            # Decide whether to stop immediately or try fetching others
-            # For this script, let's assume we need all core parts, especially drugproduct
-            if name == 'drugproduct':
-                 print("  🛑 Aborting due to failure fetching essential 'drugproduct' data.")
-                 sys.exit(1) # Exit if primary data fails
-            all_data[name] = [] # Store empty list to avoid KeyError later, but note failure
+    def close(self):
+        self._file.write(self._compressor.finish())
+        self._file.close()
+
+def iter_json_chunks(entries, batch_size=JSON_WRITE_BATCH):
+    """Yields the compact JSON encoding of a list as UTF-8 byte chunks, encoding each entry once.
+
+    The bytes are identical to json.dump(entries, ensure_ascii=False, separators=(',', ':')).
+    """
+    encoder = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+    yield b'['
+    for start in range(0, len(entries), batch_size):
+        text = ','.join(map(encoder.encode, entries[start:start + batch_size]))
+        yield (',' + text if start else text).encode('utf-8')
+    yield b']'
+
+def save_json_outputs(entries, out_path, compressed_out_path, compression_level=9,
+                      zstd_level=None, brotli_quality=None, digest=None):
+    """Encodes entries to JSON once and streams the bytes to every output file at the same time.
+
+    Writes the plain and gzip files, plus .zst/.br side outputs of out_path when
+    a zstd level or brotli quality is given and the module is installed. A hashlib
+    digest, if given, is fed the plain JSON bytes as they are written.
+    Returns a dict of written path -> size in bytes.
+    """
+    sinks = {
+        out_path: lambda path: open(path, 'wb'),
+        compressed_out_path: lambda path: gzip.open(path, 'wb', compresslevel=compression_level),
+    }
+    if zstd_level is not None:
+        if zstandard is None:
+            print("  ⚠️ zstandard is not installed. Skipping .zst output.")
         else:
-            all_data[name] = data
-        time.sleep(0.2) # Keep small delay between requests
+            sinks[out_path + '.zst'] = lambda path: zstandard.ZstdCompressor(level=zstd_level).stream_writer(open(path, 'wb'))
+    if brotli_quality is not None:
+        if brotli is None:
+            print("  ⚠️ brotli is not installed. Skipping .br output.")
+        else:
+            sinks[out_path + '.br'] = lambda path: _BrotliWriter(path, brotli_quality)
 
-    print(f"--- Data Fetch finished in {time.time() - start_fetch:.2f}s ---")
+    sizes = {}
+    open_files = []
+    try:
+        for path, opener in sinks.items():
+            open_files.append(opener(path))
+        for chunk in iter_json_chunks(entries):
+            for sink in open_files:
+                sink.write(chunk)
+            if digest is not None:
+                digest.update(chunk)
+    except IOError as e:
+        print(f"  ❌ ERROR: Could not write JSON outputs. Error: {e}")
+        return sizes
+    except Exception as e:
+        print(f"  ❌ ERROR: Unexpected error saving JSON outputs. Error: {e}")
+        return sizes
+    finally:
+        for sink in open_files:
+            sink.close()
+    for path in sinks:
+        sizes[path] = os.path.getsize(path)
+        print(f"✅ JSON saved to {path} ({sizes[path]/1024/1024:.2f} MB)")
+    return sizes
 
-    if fetch_failed:
-        print("\n⚠️ WARNING: One or more data fetches failed. Output data may be incomplete.")
 
-    # --- Load restricted drug list ---
-    print("\n--- Loading Restricted Drug List ---")
+def load_restricted_names(restricted_json_path):
+    """Loads normalized restricted drug names and aliases from the restricted drugs JSON file.
+
+    Returns (restricted_names, restricted_aliases); both are empty if the file is missing or malformed.
+    """
     restricted_names = set()
     restricted_aliases = set()
-    restricted_json_path = os.path.join(script_dir, RESTRICTED_JSON)
-    
+
     try:
         with open(restricted_json_path, 'r', encoding='utf-8') as f:
             restricted_data = json.load(f)
-            
+
             # Handle the structure where each drug has a name and aliases array
             if isinstance(restricted_data, list) and all(isinstance(item, dict) for item in restricted_data):
                 for drug in restricted_data:
                     # Add the main name
                     if drug.get('name'):
                         restricted_names.add(normalize_text(drug['name']))
-                    
+
                     # Add all aliases
                     for alias in drug.get('aliases', []):
                         if alias:
                             restricted_aliases.add(normalize_text(alias))
-                
+
                 print(f"  ✓ Loaded {len(restricted_data)} restricted drugs with {len(restricted_names)} names and {len(restricted_aliases)} aliases")
-            
+
             # Handle simple list format (backward compatibility)
             elif isinstance(restricted_data, list):
                 for item in restricted_data:
                     if isinstance(item, str):
                         restricted_names.add(normalize_text(item))
                 print(f"  ✓ Loaded {len(restricted_names)} restricted drug names (simple list format)")
-            
+
             # Handle dictionary format 
             elif isinstance(restricted_data, dict):
                 product_names = restricted_data.get('products', [])
@@ -194,7 +635,7 @@ def build_compiled_data():
                 for item in ingredient_names:
                     restricted_names.add(normalize_text(item))
                 print(f"  ✓ Loaded {len(restricted_names)} restricted drug names from products/ingredients dict")
-            
+
             else:
                 print(f"  ⚠️ Unexpected format in {RESTRICTED_JSON}. Expected list of drugs with names/aliases or simple list.")
 
@@ -207,50 +648,259 @@ def build_compiled_data():
     except Exception as e:
         print(f"  ❌ ERROR: Unexpected error loading restricted drugs: {e}")
 
+    return restricted_names, restricted_aliases
+
+# --- Combine Helpers ---
+def compile_entry(product, ingredients_by_code, forms_by_code, schedule_by_code, classifier):
+    """Combines one drug product with its lookups and classifies whether it is restricted."""
+    drug_code = product.get('drug_code')
+    brand_name = product.get('brand_name', '').strip()
+
+    # Get related data using pre-processed lookups
+    active_ingredients = ingredients_by_code.get(drug_code, [])
+    forms = forms_by_code.get(drug_code, [])
+    schedule = schedule_by_code.get(drug_code, '')
+
+    # Determine if restricted: schedule, product name, ingredient names, then
+    # known controlled ingredients, stopping at the first match
+    restriction_reason = classifier.classify(
+        brand_name, schedule, [ingredient_info.get("name", "") for ingredient_info in active_ingredients])
+    is_restricted = bool(restriction_reason)
+
+    # Add debugging output for schedules that aren't being detected properly
+    if DEBUG:
+        normalized_schedule = normalize_text(schedule)
+        if normalized_schedule and any(term in normalized_schedule for term in ["cdsa", "controlled", "narcotic"]) and not is_restricted:
+            log_debug(f"Potential missed controlled substance: '{brand_name}' with schedule '{schedule}'")
+
+    entry = {
+        "drug_code": drug_code,
+        "brand_name": brand_name,
+        "descriptor": product.get('descriptor', '').strip(),
+        "active_ingredients": active_ingredients,
+        "forms": forms,
+        "schedule": schedule,
+        "is_restricted": is_restricted,
+        "restriction_reason": ", ".join(restriction_reason) if restriction_reason else "",  # Include for debugging
+        "status": product.get('status', '').strip(),
+        "history_date": product.get('history_date', '').strip(),
+    }
+
+    return entry
+
+# Read-only lookups installed once per pool worker by _init_combine_worker
+_worker_context = None
+
+def _init_combine_worker(ingredients_by_code, forms_by_code, schedule_by_code, classifier):
+    """Pool initializer: receives the lookup tables and classifier once per worker process."""
+    global _worker_context
+    _worker_context = (ingredients_by_code, forms_by_code, schedule_by_code, classifier)
+
+def _compile_chunk(products):
+    """Pool task: compiles one chunk of products against the worker's lookups."""
+    return [compile_entry(product, *_worker_context) for product in products]
+
+def _chunked(items, size):
+    """Splits a list into consecutive slices of at most size items."""
+    return (items[i:i + size] for i in range(0, len(items), size))
+
+def compile_products(products, ingredients_by_code, forms_by_code, schedule_by_code, classifier, workers=1):
+    """Yields a compiled entry for each product, in input order.
+
+    With workers > 1 the products are split into chunks and compiled in a
+    process pool; each worker receives the lookups once at pool start.
+    """
+    if workers <= 1 or len(products) <= COMBINE_CHUNK_SIZE:
+        for product in products:
+            yield compile_entry(product, ingredients_by_code, forms_by_code, schedule_by_code, classifier)
+        return
+    with multiprocessing.Pool(workers, initializer=_init_combine_worker,
+                              initargs=(ingredients_by_code, forms_by_code, schedule_by_code, classifier)) as pool:
+        # imap preserves chunk order, so the output matches the serial path exactly
+        for entries in pool.imap(_compile_chunk, _chunked(products, COMBINE_CHUNK_SIZE)):
+            yield from entries
+
+# --- Incremental Build Helpers ---
+def source_hash(product, active_ingredients, forms, schedule):
+    """Hashes every input that contributes to a product's compiled entry."""
+    payload = json.dumps([product, active_ingredients, forms, schedule],
+                         sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    # 64 bits is ample to detect changes across ~50k products and halves the state file
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()[:16]
+
+def rules_hash(restricted_names, restricted_aliases):
+    """Hashes the restriction rules; if they change every entry has to be recompiled."""
+    payload = json.dumps([sorted(restricted_names), sorted(restricted_aliases),
+                          CONTROLLED_SCHEDULE_PREFIXES, sorted(ALWAYS_RESTRICTED_INGREDIENTS)])
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+def snapshot_version(state):
+    """Derives a snapshot version from the per-entry hashes without re-encoding the output."""
+    digest = hashlib.sha1(state['rules_hash'].encode('utf-8'))
+    for code_key, info in state['entries'].items():
+        digest.update(f"{code_key}:{info['hash']}\n".encode('utf-8'))
+    return digest.hexdigest()[:16]
+
+def load_previous_build(script_dir):
+    """Loads the previous state file and compiled snapshot for an incremental build.
+
+    Returns (state, entries_by_code), or (None, {}) if either is missing or unreadable,
+    or if the snapshot is not the one the state was saved with (e.g. the JSON was
+    rewritten by a build that failed before saving its state).
+    """
+    state_path = os.path.join(script_dir, STATE_FILENAME)
+    out_path = os.path.join(script_dir, OUTPUT_FILENAME)
+    try:
+        with open(state_path, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+        with open(out_path, 'rb') as f:
+            snapshot = f.read()
+        if state.get('snapshot_sha256') != hashlib.sha256(snapshot).hexdigest():
+            print(f"  ⚠️ {OUTPUT_FILENAME} does not match {STATE_FILENAME}. Performing a full build.")
+            return None, {}
+        entries_by_code = {str(entry['drug_code']): entry for entry in json.loads(snapshot)}
+        print(f"  ✓ Loaded previous snapshot {state.get('version')} with {len(entries_by_code):,} entries")
+        return state, entries_by_code
+    except FileNotFoundError:
+        print("  ℹ️ No previous snapshot found. Performing a full build.")
+    except (json.JSONDecodeError, KeyError, TypeError) as e:
+        print(f"  ⚠️ Previous snapshot is unreadable ({e}). Performing a full build.")
+    return None, {}
+
+def save_state_outputs(script_dir, state, delta):
+    """Writes the delta against the previous snapshot (or removes a stale one), then the new state file.
+
+    The state is only saved once the delta is written (or a stale one removed), so a
+    failed write leaves the previous state in place and the next run rebuilds the
+    delta from it. Returns the number of bytes written.
+    """
+    bytes_written = 0
+    for filename, payload in ((DELTA_FILENAME, delta), (STATE_FILENAME, state)):
+        path = os.path.join(script_dir, filename)
+        try:
+            if payload is None:
+                # A delta left over from an older base would no longer apply
+                if os.path.exists(path):
+                    os.remove(path)
+                continue
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(payload, f, ensure_ascii=False, separators=(',', ':'))
+            bytes_written += os.path.getsize(path)
+            print(f"✅ Saved {path} ({os.path.getsize(path)/1024:.1f} KB)")
+        except IOError as e:
+            print(f"  ❌ ERROR: Could not write '{path}'. Error: {e}")
+            if filename == DELTA_FILENAME:
+                print(f"  ⚠️ Keeping the previous {STATE_FILENAME}.")
+            break
+    return bytes_written
+
+# --- Main Data Building Function ---
+def build_compiled_data(stream=False, incremental=False, workers=1, compression_level=9,
+                        zstd_level=None, brotli_quality=None, cache_dir=None, from_cache=False,
+                        metrics=None):
+    """Fetches, processes, and combines Health Canada drug data.
+
+    With stream=True endpoint payloads are parsed incrementally off the socket
+    instead of being buffered and decoded whole. With incremental=True only
+    products whose inputs changed since the previous run are recompiled, and a
+    delta file is written next to the full snapshot. Every build saves the state
+    file (per-entry hashes and the snapshot's sha256) that the next incremental
+    run starts from. With workers > 1 products
+    are compiled in a process pool; the output is identical to the serial path.
+    The JSON is encoded once and written to the plain, gzip and any requested
+    zstd/brotli outputs together. With cache_dir raw payloads are cached on disk
+    and re-fetched only when the server reports a change; from_cache replays
+    the cache without any network access.
+
+    Every stage is recorded in metrics (a BuildMetrics), so the caller can emit
+    a machine-readable report even if the build exits early.
+    """
+    metrics = metrics if metrics is not None else BuildMetrics()
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    print(f"Script running in directory: {script_dir}")
+    print(f"Python version: {sys.version}")
+
+    # --- Fetch data ---
+    print("\n--- Starting Data Fetch ---")
+    fetch_failed = False
+    start_fetch = time.time()
+    stage = metrics.start_stage('fetch')
+    cache = None
+    if cache_dir or from_cache:
+        cache = ResponseCache(cache_dir or os.path.join(script_dir, CACHE_DIRNAME))
+        print(f"  Using response cache {cache.cache_dir}{' (offline)' if from_cache else ''}")
+    all_data, fetch_stats = fetch_all(stream=stream, cache=cache, offline=from_cache)
+    for name, data in all_data.items():
+        if data is None: # Check for critical fetch failure indicated by None
+            print(f"  ❌ CRITICAL FAILURE fetching '{name}'. Cannot proceed reliably.")
+            fetch_failed = True
+            # For this script, let's assume we need all core parts, especially drugproduct
+            if name == 'drugproduct':
+                 print("  🛑 Aborting due to failure fetching essential 'drugproduct' data.")
+                 metrics.end_stage(stage, failed_endpoint=name, endpoints=fetch_stats)
+                 sys.exit(1) # Exit if primary data fails
+            # Store an empty list (or lookup) to avoid KeyError later, but note failure
+            all_data[name] = LOOKUP_BUILDERS[name]([]) if stream and name in LOOKUP_BUILDERS else []
+
+    print_fetch_stats(fetch_stats)
+    metrics.end_stage(stage, records_out=sum(stats['records'] for stats in fetch_stats.values()),
+                      bytes_read=sum(stats['bytes'] for stats in fetch_stats.values()), endpoints=fetch_stats)
+    print(f"--- Data Fetch finished in {time.time() - start_fetch:.2f}s ---")
+
+    if fetch_failed:
+        print("\n⚠️ WARNING: One or more data fetches failed. Output data may be incomplete.")
+
+    # --- Load restricted drug list ---
+    print("\n--- Loading Restricted Drug List ---")
+    stage = metrics.start_stage('load_restrictions')
+    restricted_names, restricted_aliases = load_restricted_names(os.path.join(script_dir, RESTRICTED_JSON))
+    classifier = RestrictionClassifier(CONTROLLED_SCHEDULE_PREFIXES, restricted_names | restricted_aliases,
+                                       ALWAYS_RESTRICTED_INGREDIENTS)
+    metrics.end_stage(stage, records_out=len(classifier.restricted_names))
+
     # --- Pre-process supporting data for efficient lookup ---
     print("\n--- Pre-processing Supporting Data ---")
     start_preprocess = time.time()
+    stage = metrics.start_stage('preprocess', records_in=sum(
+        fetch_stats[name]['records'] for name in LOOKUP_BUILDERS if name in fetch_stats))
 
-    ingredients_by_code = defaultdict(list)
-    if all_data.get('activeingredient'):
-        for item in all_data['activeingredient']:
-            drug_code = item.get('drug_code')
-            if drug_code:
-                ingredients_by_code[drug_code].append({
-                    "name": item.get('ingredient_name', '').strip(),
-                    "strength": item.get('strength', '').strip(),
-                    "unit": item.get('strength_unit', '').strip()
-                })
-    print(f"  ✓ Processed {len(all_data.get('activeingredient', []))} active ingredients into lookup table.")
-
-    forms_by_code = defaultdict(list)
-    if all_data.get('form'):
-        for item in all_data['form']:
-            drug_code = item.get('drug_code')
-            if drug_code:
-                form_name = item.get('pharmaceutical_form_name', '').strip()
-                if form_name:
-                    forms_by_code[drug_code].append(form_name)
-    print(f"  ✓ Processed {len(all_data.get('form', []))} forms into lookup table.")
-
-    schedule_by_code = {}
-    if all_data.get('schedule'):
-        for item in all_data['schedule']:
-            drug_code = item.get('drug_code')
-            if drug_code:
-                # Assuming one primary schedule per drug code from this endpoint
-                schedule_name = item.get('schedule_name', '').strip()
-                if schedule_name:
-                     schedule_by_code[drug_code] = schedule_name
-    print(f"  ✓ Processed {len(all_data.get('schedule', []))} schedules into lookup table.")
+    lookups = {}
+    for name, builder in LOOKUP_BUILDERS.items():
+        # In streaming mode the lookups were already built while the data was fetched
+        lookups[name] = all_data.get(name) if stream else builder(all_data.get(name, []))
+        all_data.pop(name, None) # Release the raw records once the lookup exists
+        print(f"  ✓ Processed {fetch_stats[name]['records']:,} {name} records into lookup table.")
+    ingredients_by_code = lookups['activeingredient']
+    forms_by_code = lookups['form']
+    schedule_by_code = lookups['schedule']
+    metrics.end_stage(stage, records_out=sum(len(lookup) for lookup in lookups.values()))
 
     print(f"--- Pre-processing finished in {time.time() - start_preprocess:.2f}s ---")
 
+    # --- Load previous build for incremental mode ---
+    # Every build records per-entry hashes, so the next incremental run can start from it
+    previous_state, previous_entries = {'version': None, 'entries': {}}, {}
+    current_rules_hash = rules_hash(restricted_names, restricted_aliases)
+    new_state = {'rules_hash': current_rules_hash, 'entries': {}}
+    changed_entries = []
+    reused_count = 0
+    if incremental:
+        print("\n--- Loading Previous Build ---")
+        stage = metrics.start_stage('load_previous_build')
+        previous_state, previous_entries = load_previous_build(script_dir)
+        if previous_state is not None and previous_state.get('rules_hash') != current_rules_hash:
+            print("  ℹ️ Restriction rules changed since the previous build. Recompiling every entry.")
+            previous_state['entries'] = {}
+        if previous_state is None:
+            previous_state = {'version': None, 'entries': {}}
+        metrics.end_stage(stage, records_out=len(previous_entries))
+
     # --- Combine data ---
     print("\n--- Combining Data ---")
     start_combine = time.time()
     compiled = []
     drug_products = all_data.get('drugproduct', [])
+    stage = metrics.start_stage('combine', records_in=len(drug_products))
 
     if not drug_products:
         print("  ⚠️ No drug products found or fetched. Output will be empty.")
@@ -259,109 +909,135 @@ def build_compiled_data():
         processed_count = 0
         restricted_count = 0
         
+        # Pick the products to compile. In incremental mode unchanged products keep
+        # their previous entry; None marks a slot still to be compiled.
+        pending = []
         for product in drug_products:
             drug_code = product.get('drug_code')
             if not drug_code:
                 continue # Skip products without a drug code
 
-            brand_name = product.get('brand_name', '').strip()
-            normalized_brand_name = normalize_text(brand_name)
-
-            # Get related data using pre-processed lookups
-            active_ingredients = ingredients_by_code.get(drug_code, [])
-            forms = forms_by_code.get(drug_code, [])
-            schedule = schedule_by_code.get(drug_code, '')
-            normalized_schedule = normalize_text(schedule)
-
-            # Determine if restricted
-            is_restricted = False
-            restriction_reason = []
-
-            # 1. Check schedule against controlled prefixes
-            if schedule:
-                for prefix in CONTROLLED_SCHEDULE_PREFIXES:
-                    if prefix in normalized_schedule:  # Use 'in' instead of 'startswith'
-                        is_restricted = True
-                        restriction_reason.append(f"Schedule ({schedule})")
-                        break
-
-            # 2. Check product name against restricted names and aliases
-            if not is_restricted:
-                if normalized_brand_name in restricted_names or normalized_brand_name in restricted_aliases:
-                    is_restricted = True
-                    restriction_reason.append("Restricted Product Name")
-
-            # 3. Check each active ingredient name against restricted lists
-            if not is_restricted:
-                for ingredient_info in active_ingredients:
-                    ingredient_name = normalize_text(ingredient_info.get("name", ""))
-                    if ingredient_name in restricted_names or ingredient_name in restricted_aliases:
-                        is_restricted = True
-                        restriction_reason.append(f"Restricted Ingredient ({ingredient_info.get('name')})")
-                        break
-
-            # 4. Check for specific known controlled ingredients that might be missed
-            if not is_restricted:
-                for ingredient_info in active_ingredients:
-                    ingredient_name = normalize_text(ingredient_info.get("name", ""))
-                    # Check if any of the always-restricted ingredients appear in the name
-                    for restricted_ingredient in ALWAYS_RESTRICTED_INGREDIENTS:
-                        if restricted_ingredient in ingredient_name:
-                            is_restricted = True
-                            restriction_reason.append(f"Common Controlled Ingredient ({ingredient_info.get('name')})")
-                            break
-                    if is_restricted:
-                        break
-
-            # Add debugging output for schedules that aren't being detected properly
-            if DEBUG:
-                if normalized_schedule and any(term in normalized_schedule for term in ["cdsa", "controlled", "narcotic"]) and not is_restricted:
-                    log_debug(f"Potential missed controlled substance: '{brand_name}' with schedule '{schedule}'")
-
-            entry = {
-                "drug_code": drug_code,
-                "brand_name": brand_name,
-                "descriptor": product.get('descriptor', '').strip(),
-                "active_ingredients": active_ingredients,
-                "forms": forms,
-                "schedule": schedule,
-                "is_restricted": is_restricted,
-                "restriction_reason": ", ".join(restriction_reason) if restriction_reason else "",  # Include for debugging
-                "status": product.get('status', '').strip(),
+            entry = None
+            code_key = str(drug_code)
+            digest = source_hash(product, ingredients_by_code.get(drug_code, []),
+                                 forms_by_code.get(drug_code, []), schedule_by_code.get(drug_code, ''))
+            new_state['entries'][code_key] = {
+                "hash": digest,
                 "history_date": product.get('history_date', '').strip(),
             }
-            
+            # Reuse the previous entry when none of the product's inputs changed
+            previous = previous_state['entries'].get(code_key)
+            if previous and previous['hash'] == digest and code_key in previous_entries:
+                entry = previous_entries[code_key]
+                reused_count += 1
+
             compiled.append(entry)
+            if entry is None:
+                pending.append(product)
+
+        start_compile = time.time()
+        compiled_entries = compile_products(pending, ingredients_by_code, forms_by_code, schedule_by_code,
+                                            classifier, workers=workers)
+        for index, entry in enumerate(compiled):
+            if entry is None:
+                entry = compiled[index] = next(compiled_entries)
+                if incremental:
+                    changed_entries.append(entry)
+
             processed_count += 1
-            if is_restricted:
+            if entry["is_restricted"]:
                 restricted_count += 1
                 
             # Print progress periodically for large datasets
             if processed_count % 10000 == 0:
                 print(f"    Processed {processed_count:,}/{len(drug_products):,} products...")
+        compile_seconds = time.time() - start_compile
 
         print(f"\n  ✓ Processed {processed_count:,} product entries.")
         print(f"  ✓ Identified {restricted_count:,} restricted medications.")
         print(f"  ✓ Built {len(compiled):,} final entries for JSON output.")
+        rate = len(pending) / compile_seconds if compile_seconds else 0.0
+        print(f"  ✓ Compiled {len(pending):,} products in {compile_seconds:.2f}s "
+              f"({rate:,.0f} products/s, {workers} worker{'s' if workers != 1 else ''}).")
+        if incremental:
+            print(f"  ✓ Reused {reused_count:,} unchanged entries, recompiled {len(changed_entries):,}.")
+    metrics.end_stage(stage, records_out=len(compiled), workers=workers,
+                      reused=reused_count if incremental else None)
     
     print(f"--- Combining finished in {time.time() - start_combine:.2f}s ---")
 
-    # --- Save uncompressed JSON ---
+    new_state['version'] = snapshot_version(new_state)
+    new_state['generated_at'] = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+    delta = None # A full build starts a new base; any older delta is removed with the new state
+    if incremental:
+        removed_codes = [previous_entries[code_key]['drug_code'] for code_key in previous_entries
+                         if code_key not in new_state['entries']]
+        if previous_state['version'] == new_state['version']:
+            print("\n--- Saving Output Files ---")
+            print(f"✅ Snapshot {new_state['version']} is unchanged. Skipping output files.")
+            return
+        if previous_state['version'] is not None:
+            delta = {
+                "format": DELTA_FORMAT_VERSION,
+                "base_version": previous_state['version'],
+                "version": new_state['version'],
+                "generated_at": new_state['generated_at'],
+                "upserted": changed_entries,
+                "removed": removed_codes,
+            }
+            print(f"\n  ✓ Delta {delta['base_version']} → {delta['version']}: "
+                  f"{len(changed_entries):,} upserted, {len(removed_codes):,} removed.")
+
+    # --- Save plain and compressed JSON in a single encoding pass ---
     print("\n--- Saving Output Files ---")
     out_path = os.path.join(script_dir, OUTPUT_FILENAME)
+    compressed_out_path = os.path.join(script_dir, COMPRESSED_OUTPUT_FILENAME)
+    stage = metrics.start_stage('save_json', records_in=len(compiled))
+    snapshot_digest = hashlib.sha256()
+    sizes = save_json_outputs(compiled, out_path, compressed_out_path, compression_level=compression_level,
+                              zstd_level=zstd_level, brotli_quality=brotli_quality, digest=snapshot_digest)
+    new_state['snapshot_sha256'] = snapshot_digest.hexdigest()
+    metrics.end_stage(stage, records_out=len(compiled) if sizes else 0,
+                      bytes_written=sum(sizes.values()), files=sizes)
+
+    # --- Save columnar binary ---
+    columnar_out_path = os.path.join(script_dir, COLUMNAR_OUTPUT_FILENAME)
+    stage = metrics.start_stage('save_columnar', records_in=len(compiled))
+    size = 0
     try:
-        with open(out_path, 'w', encoding='utf-8') as f:
-            # Use separators for smaller file, indent=None for no pretty-printing
-            json.dump(compiled, f, ensure_ascii=False, separators=(',', ':'))
-        print(f"✅ Uncompressed JSON saved to {out_path} ({os.path.getsize(out_path)/1024/1024:.2f} MB)")
+        size = write_columnar(compiled, columnar_out_path)
+        print(f"✅ Columnar data saved to {columnar_out_path} ({size/1024/1024:.2f} MB)")
     except IOError as e:
-        print(f"  ❌ ERROR: Could not write uncompressed file '{out_path}'. Error: {e}")
+        print(f"  ❌ ERROR: Could not write columnar file '{columnar_out_path}'. Error: {e}")
     except Exception as e:
-        print(f"  ❌ ERROR: Unexpected error saving uncompressed file '{out_path}'. Error: {e}")
+        print(f"  ❌ ERROR: Unexpected error saving columnar file '{columnar_out_path}'. Error: {e}")
+    metrics.end_stage(stage, records_out=len(compiled) if size else 0, bytes_written=size)
 
-    # --- Save compressed JSON ---
-    compressed_out_path = os.path.join(script_dir, COMPRESSED_OUTPUT_FILENAME)
-    save_compressed_json(compiled, compressed_out_path)
+    # --- Save search index ---
+    search_index_path = os.path.join(script_dir, SEARCH_INDEX_FILENAME)
+    stage = metrics.start_stage('save_search_index', records_in=len(compiled))
+    size = 0
+    search_index = None
+    try:
+        search_index = build_search_index(compiled)
+        search_index.save(search_index_path)
+        size = os.path.getsize(search_index_path)
+        print(f"✅ Search index saved to {search_index_path} ({size/1024/1024:.2f} MB)")
+    except IOError as e:
+        print(f"  ❌ ERROR: Could not write search index '{search_index_path}'. Error: {e}")
+    except Exception as e:
+        print(f"  ❌ ERROR: Unexpected error saving search index '{search_index_path}'. Error: {e}")
+    metrics.end_stage(stage, records_out=len(search_index.names) if search_index else 0, bytes_written=size)
+
+    # --- Save state and delta ---
+    # Saved by full builds too, so the state always describes the snapshot on disk
+    stage = metrics.start_stage('save_state', records_in=len(changed_entries) if incremental else len(compiled))
+    if not sizes:
+        # The state would describe a snapshot that was never written
+        print(f"  ⚠️ JSON outputs were not written. Keeping the previous {STATE_FILENAME}.")
+        metrics.end_stage(stage, bytes_written=0, skipped=True)
+        return
+    metrics.end_stage(stage, bytes_written=save_state_outputs(script_dir, new_state, delta))
 
 
 # --- Main Execution Block ---
@@ -369,8 +1045,44 @@ if __name__ == "__main__":
     print("=====================================")
     print(" Health Canada Drug Data Compiler ")
     print("=====================================")
+    parser = argparse.ArgumentParser(description="Compile Health Canada drug product data.")
+    parser.add_argument('--stream', action='store_true',
+                        help="Parse endpoint payloads incrementally instead of buffering whole responses")
+    parser.add_argument('--incremental', action='store_true',
+                        help=f"Recompile only changed products and write {DELTA_FILENAME}")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="Compile products in a pool of N processes (default: 1, serial)")
+    parser.add_argument('--compression-level', type=int, default=9, choices=range(1, 10), metavar='1-9',
+                        help="gzip compression level for the .json.gz output (default: 9)")
+    parser.add_argument('--zstd', type=int, nargs='?', const=19, metavar='LEVEL',
+                        help="Also write a .json.zst (requires zstandard; default level 19)")
+    parser.add_argument('--brotli', type=int, nargs='?', const=11, metavar='QUALITY',
+                        help="Also write a .json.br (requires brotli; default quality 11)")
+    parser.add_argument('--cache-dir', metavar='DIR',
+                        help="Cache raw payloads in DIR and only re-download changed endpoints")
+    parser.add_argument('--from-cache', action='store_true',
+                        help=f"Replay cached payloads without network access (default DIR: {CACHE_DIRNAME})")
+    parser.add_argument('--metrics-report', metavar='PATH',
+                        help="Write per-stage wall/CPU time, peak RSS, record counts and bytes written as JSON")
+    parser.add_argument('--profile', choices=PROFILERS,
+                        help="Profile every stage with cProfile or pyinstrument")
+    parser.add_argument('--profile-dir', default='profiles', metavar='DIR',
+                        help="Where --profile writes one file per stage (default: profiles)")
+    args = parser.parse_args()
     main_start_time = time.time()
-    build_compiled_data()
+    metrics = BuildMetrics(profiler=args.profile, profile_dir=args.profile_dir)
+    try:
+        build_compiled_data(stream=args.stream, incremental=args.incremental, workers=max(1, args.workers),
+                            compression_level=args.compression_level, zstd_level=args.zstd,
+                            brotli_quality=args.brotli, cache_dir=args.cache_dir, from_cache=args.from_cache,
+                            metrics=metrics)
+    finally:
+        # Also report on early exits, such as a failed drugproduct fetch
+        metrics.end_open_stages()
+        print("\n--- Stage Metrics ---")
+        metrics.print_summary()
+        if args.metrics_report:
+            metrics.save(args.metrics_report, **vars(args))
     main_end_time = time.time()
     print("\n=====================================")
     print(f"🏁 Script finished in {main_end_time - main_start_time:.2f} seconds.")
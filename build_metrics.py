@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+"""
+Build Metrics
+Per-stage instrumentation for the drug data compiler: wall time, CPU time (including
+pool worker processes), memory (the process's peak RSS and how much the stage raised
+it), records in/out and bytes written, emitted as a
+machine-readable JSON report. Stages can optionally be profiled with cProfile or
+pyinstrument.
+"""
+import json
+import os
+import platform
+import sys
+import time
+
+try:
+    import resource
+except ImportError: # Not available on Windows
+    resource = None
+
+try:
+    import pyinstrument
+except ImportError:
+    pyinstrument = None
+
+REPORT_FORMAT_VERSION = 2
+PROFILERS = ('cprofile', 'pyinstrument')
+
+
+def cpu_seconds():
+    """CPU time of this process and its reaped children (e.g. --workers pool processes)."""
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process so far, in MB, or None if unavailable."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    return peak / 1024 / 1024 if sys.platform == 'darwin' else peak / 1024
+
+
+class _StageProfiler:
+    """Wraps cProfile or pyinstrument for one stage and writes its output on stop."""
+
+    def __init__(self, kind, output_base):
+        self.kind = kind
+        self.output_base = output_base
+        if kind == 'pyinstrument':
+            self._profiler = pyinstrument.Profiler()
+        else:
+            import cProfile
+            self._profiler = cProfile.Profile()
+
+    def start(self):
+        if self.kind == 'pyinstrument':
+            self._profiler.start()
+        else:
+            self._profiler.enable()
+
+    def stop(self):
+        """Stops profiling and returns the path of the written profile."""
+        if self.kind == 'pyinstrument':
+            self._profiler.stop()
+            path = self.output_base + '.html'
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(self._profiler.output_html())
+        else:
+            self._profiler.disable()
+            path = self.output_base + '.prof'
+            self._profiler.dump_stats(path)
+        return path
+
+
+class BuildMetrics:
+    """
+    Records metrics for each stage of a compiler run
+
+    Usage:
+        stage = metrics.start_stage('combine', records_in=len(products))
+        ...
+        metrics.end_stage(stage, records_out=len(compiled))
+
+    Args:
+        profiler: None, 'cprofile' or 'pyinstrument' to profile every stage
+        profile_dir: Directory for per-stage profiles (required with a profiler)
+    """
+
+    def __init__(self, profiler=None, profile_dir=None):
+        if profiler and profiler not in PROFILERS:
+            raise ValueError(f"Unknown profiler {profiler!r}; expected one of {PROFILERS}")
+        if profiler == 'pyinstrument' and pyinstrument is None:
+            print("  ⚠️ pyinstrument is not installed. Falling back to cProfile.")
+            profiler = 'cprofile'
+        self.profiler = profiler
+        self.profile_dir = profile_dir
+        if profiler:
+            os.makedirs(profile_dir, exist_ok=True)
+        self.stages = []
+        self._open = []
+        self.started_at = time.time()
+        self._start_wall = time.perf_counter()
+
+    def start_stage(self, name, records_in=None):
+        """Starts timing a stage and returns its record, to be passed to end_stage()."""
+        stage = {
+            'name': name,
+            'records_in': records_in,
+            'records_out': None,
+            'bytes_written': 0,
+        }
+        if self.profiler:
+            stage['_profiler'] = _StageProfiler(self.profiler, os.path.join(self.profile_dir, name))
+            stage['_profiler'].start()
+        stage['_wall'] = time.perf_counter()
+        stage['_cpu'] = cpu_seconds()
+        stage['_peak'] = peak_rss_mb()
+        self._open.append(stage)
+        return stage
+
+    def end_stage(self, stage, records_out=None, bytes_written=None, **details):
+        """Finishes a stage; extra keyword arguments are stored under the stage's details."""
+        stage['wall_seconds'] = round(time.perf_counter() - stage.pop('_wall'), 4)
+        stage['cpu_seconds'] = round(cpu_seconds() - stage.pop('_cpu'), 4)
+        # ru_maxrss is a process-wide high-water mark: report it as such, plus how far
+        # this stage pushed it (0 if an earlier stage had already peaked higher)
+        peak_before, peak = stage.pop('_peak'), peak_rss_mb()
+        stage['process_peak_rss_mb'] = peak
+        stage['peak_rss_growth_mb'] = round(peak - peak_before, 2) if peak is not None else None
+        profiler = stage.pop('_profiler', None)
+        if profiler is not None:
+            stage['profile'] = profiler.stop()
+        if records_out is not None:
+            stage['records_out'] = records_out
+        if bytes_written is not None:
+            stage['bytes_written'] = bytes_written
+        if details:
+            stage['details'] = details
+        self._open.remove(stage)
+        self.stages.append(stage)
+        return stage
+
+    def end_open_stages(self):
+        """Ends (and stops profiling) any stage left open by an early exit, marked aborted."""
+        for stage in list(self._open):
+            self.end_stage(stage, aborted=True)
+
+    def report(self, **run_info):
+        """Builds the JSON-serializable report; run_info (e.g. CLI options) is included as-is."""
+        return {
+            'format': REPORT_FORMAT_VERSION,
+            'started_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(self.started_at)),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'run': run_info,
+            'total_wall_seconds': round(time.perf_counter() - self._start_wall, 4),
+            'process_peak_rss_mb': peak_rss_mb(),
+            'bytes_written': sum(stage['bytes_written'] for stage in self.stages),
+            'stages': self.stages,
+        }
+
+    def save(self, path, **run_info):
+        """Writes the report to path as JSON."""
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.report(**run_info), f, indent=2)
+        print(f"📊 Metrics report saved to {path}")
+
+    def print_summary(self):
+        """Prints a one-line-per-stage table of the recorded metrics."""
+        print(f"  {'stage':<22} {'wall s':>8} {'cpu s':>8} {'peak MB':>8} {'+MB':>6} {'in':>9} {'out':>9} "
+              f"{'written MB':>11}")
+        for stage in self.stages:
+            peak = f"{stage['process_peak_rss_mb']:.0f}" if stage['process_peak_rss_mb'] is not None else '-'
+            growth = f"{stage['peak_rss_growth_mb']:.0f}" if stage['peak_rss_growth_mb'] is not None else '-'
+            records_in = f"{stage['records_in']:,}" if stage['records_in'] is not None else '-'
+            records_out = f"{stage['records_out']:,}" if stage['records_out'] is not None else '-'
+            name = stage['name'] + (' (aborted)' if stage.get('details', {}).get('aborted') else '')
+            print(f"  {name:<22} {stage['wall_seconds']:8.2f} {stage['cpu_seconds']:8.2f} {peak:>8} {growth:>6} "
+                  f"{records_in:>9} {records_out:>9} {stage['bytes_written'] / 1024 / 1024:11.2f}")
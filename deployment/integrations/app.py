@@ -7,11 +7,12 @@ All configuration loaded from database - no hardcoded credentials
 
 import os
 import sys
+import json
+import hashlib
 import time
 import logging
-import schedule
 import mysql.connector
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request
 from datetime import datetime
 import threading
 
@@ -21,6 +22,10 @@ from integrations.ocean_service import OceanService
 from integrations.fax_processor import FaxProcessor
 from integrations.sms_sender import SMSSender
 from integrations.expedius_service import ExpediusService
+from integrations.db_pool import ConnectionPool
+from integrations.job_runner import JobRunner
+from integrations.leader import DatabaseLock, FileLock, LeaderElection
+from integrations import dispatch, metrics
 
 # Setup logging
 logging.basicConfig(
@@ -40,6 +45,25 @@ db_config = {
     'autocommit': True
 }
 
+# One pool for the whole process; services get it injected instead of connecting per call
+db_pool = ConnectionPool(
+    db_config,
+    max_size=int(os.getenv('DB_POOL_SIZE', '10')),
+    borrow_timeout=float(os.getenv('DB_POOL_TIMEOUT', '30')),
+    health_check_interval=float(os.getenv('DB_POOL_HEALTH_CHECK_INTERVAL', '30'))
+)
+
+# Exactly one process (across gunicorn workers and containers) runs the scheduled
+# jobs; SCHEDULER_LOCK is 'db' (MySQL named lock) or the path of a lock file
+scheduler_lock = os.getenv('SCHEDULER_LOCK', 'db')
+leader = LeaderElection(
+    DatabaseLock(db_config) if scheduler_lock == 'db' else FileLock(scheduler_lock),
+    interval=float(os.getenv('SCHEDULER_LEADER_INTERVAL', '15'))
+)
+
+# Set once start_service() has loaded the services; /ready reports it
+service_started = threading.Event()
+
 # Global services (loaded from DB)
 services = {
     'ringcentral': None,
@@ -50,11 +74,11 @@ services = {
 }
 
 def get_db_connection():
-    """Get database connection with retry"""
+    """Borrow a pooled database connection with retry"""
     max_retries = 5
     for i in range(max_retries):
         try:
-            return mysql.connector.connect(**db_config)
+            return db_pool.get_connection()
         except mysql.connector.Error as err:
             if i < max_retries - 1:
                 logger.warning(f"Database connection failed (attempt {i+1}/{max_retries}): {err}")
@@ -63,126 +87,240 @@ def get_db_connection():
                 logger.error(f"Failed to connect to database after {max_retries} attempts")
                 raise
 
-def load_integration_config(integration_name):
-    """Load configuration for an integration from database"""
+# Integrations whose config is loaded from integration_config
+INTEGRATIONS = ('ringcentral', 'ocean', 'labs')
+
+# Checksum of the config each integration's services were last built from
+config_versions = {}
+reload_stats = {
+    'reloads': 0,
+    'rebuilds': {name: 0 for name in INTEGRATIONS},
+    'last_reload_at': None,
+    'last_reload_seconds': None,
+    'total_reload_seconds': 0.0,
+    'last_changed': []
+}
+# Serializes reloads (scheduled job and /api/reload)
+reload_lock = threading.Lock()
+
+def load_integration_configs():
+    """Load configuration for all integrations from database in one query"""
     try:
         db = get_db_connection()
         cursor = db.cursor(dictionary=True)
 
         cursor.execute("""
-            SELECT config_key, config_value, encrypted
+            SELECT integration_name, config_key, config_value, encrypted
             FROM integration_config
-            WHERE integration_name = %s AND enabled = TRUE
-        """, (integration_name,))
+            WHERE integration_name IN (%s, %s, %s) AND enabled = TRUE
+        """, INTEGRATIONS)
 
-        config = {}
+        configs = {name: {} for name in INTEGRATIONS}
         for row in cursor.fetchall():
             value = row['config_value']
             # TODO: Decrypt if row['encrypted'] is True
-            config[row['config_key']] = value
+            configs[row['integration_name']][row['config_key']] = value
 
         cursor.close()
         db.close()
 
-        return config if config else None
+        return {name: config or None for name, config in configs.items()}
     except Exception as e:
-        logger.error(f"Error loading config for {integration_name}: {e}")
+        logger.error(f"Error loading integration config: {e}")
         return None
 
-def initialize_services():
-    """Initialize all integration services from database config"""
-    logger.info("Initializing integration services...")
+def config_checksum(config):
+    """Stable checksum of an integration's config, None if it has none"""
+    if not config:
+        return None
+    return hashlib.sha256(json.dumps(config, sort_keys=True).encode('utf-8')).hexdigest()
 
-    # RingCentral
-    rc_config = load_integration_config('ringcentral')
-    if rc_config and rc_config.get('enabled') == 'true':
-        try:
-            services['ringcentral'] = RingCentralService(rc_config)
-            services['fax'] = FaxProcessor(services['ringcentral'], db_config)
-            services['sms'] = SMSSender(services['ringcentral'], db_config)
-            logger.info("✅ RingCentral service initialized")
-        except Exception as e:
-            logger.error(f"❌ Failed to initialize RingCentral: {e}")
+def build_ringcentral(config):
+    if config.get('enabled') != 'true':
+        return None
+    ringcentral = RingCentralService(config)
+    return {
+        'ringcentral': ringcentral,
+        'fax': FaxProcessor(ringcentral, db_pool),
+        'sms': SMSSender(ringcentral, db_pool)
+    }
 
-    # OceanMD
-    ocean_config = load_integration_config('ocean')
-    if ocean_config and ocean_config.get('enabled') == 'true':
-        try:
-            services['ocean'] = OceanService(ocean_config, db_config)
-            logger.info("✅ Ocean eReferral service initialized")
-        except Exception as e:
-            logger.error(f"❌ Failed to initialize Ocean: {e}")
+def build_ocean(config):
+    if config.get('enabled') != 'true':
+        return None
+    return {'ocean': OceanService(config, db_pool)}
 
-    # Expedius (BC Labs)
-    labs_config = load_integration_config('labs')
-    if labs_config and labs_config.get('enabled') == 'true' and labs_config.get('provider') == 'excelleris':
-        try:
-            services['expedius'] = ExpediusService(labs_config, db_config)
-            logger.info("✅ Expedius lab service initialized")
-        except Exception as e:
-            logger.error(f"❌ Failed to initialize Expedius: {e}")
+def build_labs(config):
+    if config.get('enabled') != 'true' or config.get('provider') != 'excelleris':
+        return None
+    return {'expedius': ExpediusService(config, db_pool)}
+
+# integration name -> (builder, services it provides, display name)
+SERVICE_BUILDERS = {
+    'ringcentral': (build_ringcentral, ('ringcentral', 'fax', 'sms'), 'RingCentral'),
+    'ocean': (build_ocean, ('ocean',), 'Ocean eReferral'),
+    'labs': (build_labs, ('expedius',), 'Expedius lab')
+}
+
+def initialize_services(force=False):
+    """
+    Initialize integration services from database config
 
-    logger.info("Service initialization complete")
+    Only integrations whose config checksum changed since the last build are rebuilt
+    (all of them on the first call or with force=True). New services are built first
+    and then swapped into `services` in one update, so requests never see a
+    half-reloaded set. If a rebuild fails the previous service stays in place and is
+    retried on the next reload.
 
-def reload_services():
-    """Hot-reload services if configuration changed"""
+    Returns:
+        Names of the integrations that were rebuilt
+    """
+    with reload_lock:
+        start = time.monotonic()
+        logger.info("Initializing integration services...")
+
+        configs = load_integration_configs()
+        if configs is None:
+            logger.warning("Keeping current services; integration config could not be loaded")
+            return []
+
+        updates = {}
+        changed = []
+        for name, (builder, provides, label) in SERVICE_BUILDERS.items():
+            config = configs[name]
+            checksum = config_checksum(config)
+            if not force and name in config_versions and config_versions[name] == checksum:
+                continue
+            try:
+                built = builder(config) if config else None
+                for key in provides:
+                    updates[key] = built[key] if built else None
+                config_versions[name] = checksum
+                changed.append(name)
+                if built:
+                    logger.info(f"✅ {label} service initialized")
+                else:
+                    logger.info(f"{label} service disabled")
+            except Exception as e:
+                logger.error(f"❌ Failed to initialize {label}: {e}")
+
+        services.update(updates)
+
+        elapsed = time.monotonic() - start
+        reload_stats['reloads'] += 1
+        for name in changed:
+            reload_stats['rebuilds'][name] += 1
+        reload_stats['last_reload_at'] = datetime.now().isoformat()
+        reload_stats['last_reload_seconds'] = round(elapsed, 3)
+        reload_stats['total_reload_seconds'] = round(reload_stats['total_reload_seconds'] + elapsed, 3)
+        reload_stats['last_changed'] = changed
+
+    logger.info(f"Service initialization complete ({', '.join(changed) or 'no changes'}, {elapsed:.2f}s)")
+    return changed
+
+def reload_services(force=False):
+    """Hot-reload services whose configuration changed"""
     logger.info("Reloading services...")
-    initialize_services()
+    return initialize_services(force=force)
 
 # ===== Scheduled Jobs =====
+# Exceptions propagate to the job runner, which logs them and records the run as failed
 
 def poll_inbound_faxes():
     """Poll for inbound faxes from RingCentral"""
     if services['fax']:
-        try:
-            services['fax'].poll_inbound()
-        except Exception as e:
-            logger.error(f"Error polling faxes: {e}")
+        services['fax'].poll_inbound()
 
 def process_outbound_fax_queue():
     """Process queued outbound faxes"""
     if services['fax']:
-        try:
-            services['fax'].process_queue()
-        except Exception as e:
-            logger.error(f"Error processing fax queue: {e}")
+        services['fax'].process_queue()
 
 def process_sms_queue():
     """Process queued SMS messages"""
     if services['sms']:
-        try:
-            services['sms'].process_queue()
-        except Exception as e:
-            logger.error(f"Error processing SMS queue: {e}")
+        services['sms'].process_queue()
 
 def poll_lab_results():
     """Poll for new lab results from Expedius"""
     if services['expedius']:
-        try:
-            services['expedius'].process_labs()
-        except Exception as e:
-            logger.error(f"Error polling lab results: {e}")
-
-# Schedule jobs
-schedule.every(5).minutes.do(poll_inbound_faxes)
-schedule.every(1).minutes.do(process_outbound_fax_queue)
-schedule.every(1).minutes.do(process_sms_queue)
-schedule.every(15).minutes.do(poll_lab_results)  # Poll labs every 15 minutes
-schedule.every(10).minutes.do(reload_services)  # Hot reload config
+        services['expedius'].process_labs()
+
+# Schedule jobs; each runs on the worker pool so a slow SFTP poll or fax download
+# does not hold up the queues. Polls run only in the scheduler leader; config reload
+# runs in every process, since each has its own services
+job_runner = JobRunner(max_workers=int(os.getenv('JOB_WORKERS', '4')))
+job_runner.every(5 * 60, poll_inbound_faxes, jitter=10, slow_after=4 * 60, leader_only=True)
+job_runner.every(60, process_outbound_fax_queue, jitter=5, slow_after=5 * 60, leader_only=True)
+job_runner.every(60, process_sms_queue, jitter=5, slow_after=5 * 60, leader_only=True)
+job_runner.every(15 * 60, poll_lab_results, jitter=30, slow_after=10 * 60, leader_only=True)  # Poll labs every 15 minutes
+job_runner.every(10 * 60, reload_services, jitter=30, slow_after=2 * 60)  # Hot reload config
+
+# Enqueues from the API wake the senders immediately, in whichever process took the
+# request (queue leases make that safe); the one-minute runs above are the catch-up
+# path for rows OSCAR inserts directly
+dispatch.subscribe('fax', lambda: job_runner.trigger('process_outbound_fax_queue'))
+dispatch.subscribe('sms', lambda: job_runner.trigger('process_sms_queue'))
 
 def run_scheduler():
     """Run scheduled tasks in background thread"""
-    logger.info("Starting scheduler...")
+    job_runner.run_forever(is_leader=lambda: leader.is_leader)
+
+def check_database():
+    """Readiness probe: can we borrow a connection and read the integration tables?"""
+    db = db_pool.get_connection()
+    try:
+        cursor = db.cursor()
+        cursor.execute("SELECT 1 FROM integration_config LIMIT 1")
+        cursor.fetchall()
+        cursor.close()
+    finally:
+        db.close()
+
+def wait_for_database(timeout=float(os.getenv('DB_STARTUP_TIMEOUT', '120'))):
+    """Poll the readiness probe until the database answers (returns False on timeout)"""
+    logger.info("Waiting for database...")
+    deadline = time.monotonic() + timeout
+    delay = 0.5
     while True:
-        schedule.run_pending()
-        time.sleep(1)
+        try:
+            check_database()
+            logger.info("✅ Database is ready")
+            return True
+        except Exception as e:
+            if time.monotonic() + delay > deadline:
+                logger.error(f"❌ Database not ready after {timeout:.0f}s: {e}")
+                return False
+            logger.info(f"Database not ready yet ({e}); retrying in {delay:.1f}s")
+            time.sleep(delay)
+            delay = min(delay * 2, 5)
 
-# ===== Flask API Endpoints =====
+def start_service():
+    """Wait for the database, load services and start the scheduler (shared by app.py, asgi.py and gunicorn)"""
+    wait_for_database()
 
-@app.route('/health', methods=['GET'])
-def health():
-    """Health check endpoint"""
-    status = {
+    # Initialize services
+    initialize_services()
+    service_started.set()
+
+    # Start leader election and the scheduler in background
+    leader.start()
+    scheduler_thread = threading.Thread(target=run_scheduler, daemon=True)
+    scheduler_thread.start()
+
+def readiness_status():
+    """Readiness shared by the Flask and ASGI servers: (ready, details)"""
+    if not service_started.is_set():
+        return False, {'ready': False, 'reason': 'starting'}
+    try:
+        check_database()
+    except Exception as e:
+        return False, {'ready': False, 'reason': f'database: {e}'}
+    return True, {'ready': True, 'scheduler': leader.status()}
+
+def health_status():
+    """Health status shared by the Flask and ASGI servers"""
+    return {
         'status': 'healthy',
         'services': {
             'ringcentral': services['ringcentral'] is not None,
@@ -191,9 +329,73 @@ def health():
             'sms': services['sms'] is not None,
             'expedius': services['expedius'] is not None
         },
+        'database': db_pool.stats(),
+        'scheduler': leader.status(),
+        'config': {
+            'versions': {name: checksum[:12] if checksum else None for name, checksum in config_versions.items()},
+            'reload': reload_stats
+        },
         'timestamp': datetime.now().isoformat()
     }
-    return jsonify(status)
+
+def job_status(history=10):
+    """Scheduled job statistics shared by the Flask and ASGI servers"""
+    return {
+        'workers': job_runner.max_workers,
+        'scheduler': leader.status(),
+        'jobs': job_runner.stats(history=history),
+        'timestamp': datetime.now().isoformat()
+    }
+
+def collect_metrics():
+    """Refresh scrape-time gauges: outbound queue depth and DB pool usage"""
+    pool = db_pool.stats()
+    metrics.DB_POOL_CONNECTIONS.labels('in_use').set(pool['in_use'])
+    metrics.DB_POOL_CONNECTIONS.labels('idle').set(pool['idle'])
+    try:
+        db = get_db_connection()
+        cursor = db.cursor()
+        cursor.execute("""
+            SELECT 'fax_queue', COUNT(*) FROM fax_queue WHERE status = 'pending'
+            UNION ALL
+            SELECT 'sms_queue', COUNT(*) FROM sms_queue WHERE status = 'pending'
+        """)
+        for queue, depth in cursor.fetchall():
+            metrics.QUEUE_DEPTH.labels(queue).set(depth)
+        cursor.close()
+        db.close()
+    except Exception as e:
+        logger.error(f"Error collecting queue depth: {e}")
+
+metrics.add_collector(collect_metrics)
+
+# ===== Flask API Endpoints =====
+
+@app.route('/health', methods=['GET'])
+def health():
+    """Health check endpoint"""
+    return jsonify(health_status())
+
+@app.route('/ready', methods=['GET'])
+def ready():
+    """Readiness probe: 200 once services are loaded and the database answers, else 503"""
+    is_ready, status = readiness_status()
+    return jsonify(status), 200 if is_ready else 503
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Prometheus metrics endpoint (text exposition format)"""
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+@app.route('/api/jobs', methods=['GET'])
+def jobs():
+    """
+    Scheduled job statistics
+    GET /api/jobs?history=10
+    Returns per-job outcome counts, durations, lateness and the most recent runs
+    """
+    history = request.args.get('history', default=10, type=int)
+    return jsonify(job_status(history))
 
 @app.route('/api/fax/send', methods=['POST'])
 def send_fax():
@@ -205,6 +407,7 @@ def send_fax():
         "document_path": "/var/lib/OscarDocument/.../file.pdf",
         "cover_page": "Optional cover page text"
     }
+    The number is normalized to E.164; one that cannot be is rejected with 400.
     """
     if not services['fax']:
         return jsonify({'error': 'Fax service not configured'}), 503
@@ -217,10 +420,38 @@ def send_fax():
             cover_page=data.get('cover_page', '')
         )
         return jsonify(result)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
     except Exception as e:
         logger.error(f"Error sending fax: {e}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/fax/send-batch', methods=['POST'])
+def send_fax_batch():
+    """
+    Queue many faxes in one transaction
+    POST /api/fax/send-batch
+    {
+        "faxes": [
+            {"to": "+17785551234", "document_path": "/var/lib/OscarDocument/.../file.pdf",
+             "cover_page": "Optional cover page text"},
+            ...
+        ]
+    }
+    Returns the queue id of each accepted fax and the index and reason of each
+    rejected one.
+    """
+    if not services['fax']:
+        return jsonify({'error': 'Fax service not configured'}), 503
+
+    try:
+        data = request.json
+        result = services['fax'].send_fax_batch(data.get('faxes'))
+        return jsonify(result), 200 if result['success'] else 400
+    except Exception as e:
+        logger.error(f"Error queuing fax batch: {e}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/sms/send', methods=['POST'])
 def send_sms():
     """
@@ -230,6 +461,7 @@ def send_sms():
         "to": "+17785551234",
         "message": "Your appointment is tomorrow at 2pm"
     }
+    The number is normalized to E.164; one that cannot be is rejected with 400.
     """
     if not services['sms']:
         return jsonify({'error': 'SMS service not configured'}), 503
@@ -241,10 +473,38 @@ def send_sms():
             message=data['message']
         )
         return jsonify(result)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
     except Exception as e:
         logger.error(f"Error sending SMS: {e}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/sms/send-batch', methods=['POST'])
+def send_sms_batch():
+    """
+    Queue many SMS messages in one transaction
+    POST /api/sms/send-batch
+    {
+        "messages": [
+            {"to": "+17785551234", "message": "Your appointment is tomorrow at 2pm",
+             "patient_id": 123, "scheduled_for": "2024-05-01T09:00:00"},
+            ...
+        ]
+    }
+    Returns the queue id of each accepted message and the index and reason of each
+    rejected one.
+    """
+    if not services['sms']:
+        return jsonify({'error': 'SMS service not configured'}), 503
+
+    try:
+        data = request.json
+        result = services['sms'].queue_sms_batch(data.get('messages'))
+        return jsonify(result), 200 if result['success'] else 400
+    except Exception as e:
+        logger.error(f"Error queuing SMS batch: {e}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/ocean/refer', methods=['POST'])
 def create_referral():
     """
@@ -270,10 +530,17 @@ def create_referral():
 
 @app.route('/api/reload', methods=['POST'])
 def reload():
-    """Reload all services (hot-reload configuration)"""
+    """
+    Reload services whose configuration changed (hot-reload configuration)
+    POST /api/reload?force=true rebuilds every service regardless of changes
+    Under gunicorn this reloads the worker that took the request; the other workers
+    pick up changes at their next scheduled reload (every 10 minutes)
+    """
     try:
-        reload_services()
-        return jsonify({'status': 'reloaded', 'timestamp': datetime.now().isoformat()})
+        force = request.args.get('force', 'false').lower() == 'true'
+        changed = reload_services(force=force)
+        return jsonify({'status': 'reloaded', 'changed': changed, 'pid': os.getpid(),
+                        'timestamp': datetime.now().isoformat()})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -284,16 +551,7 @@ if __name__ == '__main__':
     logger.info("NextScript Integration Service")
     logger.info("=================================")
 
-    # Wait for database
-    logger.info("Waiting for database...")
-    time.sleep(10)
-
-    # Initialize services
-    initialize_services()
-
-    # Start scheduler in background
-    scheduler_thread = threading.Thread(target=run_scheduler, daemon=True)
-    scheduler_thread.start()
+    start_service()
 
     # Start Flask API
     logger.info("Starting API server on port 8080...")
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""
+NextScript Integration Service - ASGI server
+asyncio variant of the API in app.py: same endpoints, services and scheduler, but
+requests use non-blocking DB access (aiomysql) and outbound HTTP (aiohttp), so one
+process can keep hundreds of referral and SMS requests in flight.
+
+Run with:
+    uvicorn asgi:app --host 0.0.0.0 --port 8080
+or:
+    python asgi.py
+"""
+
+import asyncio
+import os
+import logging
+from contextlib import asynccontextmanager
+from datetime import datetime
+
+import aiohttp
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+
+import app as service
+from integrations import metrics
+from integrations.async_services import (
+    AsyncDatabase, AsyncFaxProcessor, AsyncOceanService, AsyncRingCentral, AsyncSMSSender
+)
+
+logger = logging.getLogger(__name__)
+
+services = service.services
+
+
+def create_app(db=None, http=None, start_background=True):
+    """
+    Build the ASGI application
+
+    Args:
+        db: AsyncDatabase to use (default: one built from app.db_config)
+        http: aiohttp.ClientSession for outbound calls (default: one created on startup)
+        start_background: Load services from the database and start the scheduler on startup
+    """
+    db = db or AsyncDatabase(service.db_config, max_size=int(os.getenv('ASYNC_DB_POOL_SIZE', '20')))
+    clients = {'http': http}
+
+    @asynccontextmanager
+    async def lifespan(_app):
+        if start_background:
+            await asyncio.to_thread(service.start_service)
+        await db.start()
+        if clients['http'] is None:
+            # The session must be created inside the running event loop
+            clients['http'] = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=int(os.getenv('HTTP_MAX_CONNECTIONS', '200'))),
+                timeout=aiohttp.ClientTimeout(total=30)
+            )
+        yield
+        await clients['http'].close()
+        await db.close()
+        service.job_runner.stop()
+        service.leader.stop()
+
+    async def health(request):
+        """Health check endpoint"""
+        status = await asyncio.to_thread(service.health_status)
+        status['async_database'] = db.stats()
+        return JSONResponse(status)
+
+    async def ready(request):
+        """Readiness probe: 200 once services are loaded and the database answers, else 503"""
+        is_ready, status = await asyncio.to_thread(service.readiness_status)
+        return JSONResponse(status, status_code=200 if is_ready else 503)
+
+    async def prometheus_metrics(request):
+        """Prometheus metrics endpoint (collectors query the DB, so render off the event loop)"""
+        body = await asyncio.to_thread(metrics.render)
+        return Response(body, headers={'Content-Type': metrics.CONTENT_TYPE})
+
+    async def jobs(request):
+        """Scheduled job statistics (GET /api/jobs?history=10)"""
+        history = int(request.query_params.get('history', 10))
+        return JSONResponse(service.job_status(history))
+
+    async def send_fax(request):
+        """Send a fax (same request body as app.py)"""
+        if not services['fax']:
+            return JSONResponse({'error': 'Fax service not configured'}, status_code=503)
+
+        try:
+            data = await request.json()
+            result = await AsyncFaxProcessor(services['fax'], db).send_fax(
+                to_number=data['to'],
+                document_path=data['document_path'],
+                cover_page=data.get('cover_page', '')
+            )
+            return JSONResponse(result)
+        except ValueError as e:
+            return JSONResponse({'success': False, 'error': str(e)}, status_code=400)
+        except Exception as e:
+            logger.error(f"Error sending fax: {e}")
+            return JSONResponse({'error': str(e)}, status_code=500)
+
+    async def send_sms(request):
+        """Send an SMS (same request body as app.py)"""
+        if not services['sms']:
+            return JSONResponse({'error': 'SMS service not configured'}, status_code=503)
+
+        try:
+            data = await request.json()
+            sms = services['sms']
+            result = await AsyncSMSSender(sms, AsyncRingCentral(sms.rc, clients['http']), db).send_sms(
+                to_number=data['to'],
+                message=data['message']
+            )
+            return JSONResponse(result)
+        except ValueError as e:
+            return JSONResponse({'success': False, 'error': str(e)}, status_code=400)
+        except Exception as e:
+            logger.error(f"Error sending SMS: {e}")
+            return JSONResponse({'error': str(e)}, status_code=500)
+
+    async def send_fax_batch(request):
+        """Queue many faxes in one transaction (same request body as app.py)"""
+        if not services['fax']:
+            return JSONResponse({'error': 'Fax service not configured'}, status_code=503)
+
+        try:
+            data = await request.json()
+            # One multi-row INSERT on the shared pool; run it off the event loop
+            result = await asyncio.to_thread(services['fax'].send_fax_batch, data.get('faxes'))
+            return JSONResponse(result, status_code=200 if result['success'] else 400)
+        except Exception as e:
+            logger.error(f"Error queuing fax batch: {e}")
+            return JSONResponse({'error': str(e)}, status_code=500)
+
+    async def send_sms_batch(request):
+        """Queue many SMS messages in one transaction (same request body as app.py)"""
+        if not services['sms']:
+            return JSONResponse({'error': 'SMS service not configured'}, status_code=503)
+
+        try:
+            data = await request.json()
+            result = await asyncio.to_thread(services['sms'].queue_sms_batch, data.get('messages'))
+            return JSONResponse(result, status_code=200 if result['success'] else 400)
+        except Exception as e:
+            logger.error(f"Error queuing SMS batch: {e}")
+            return JSONResponse({'error': str(e)}, status_code=500)
+
+    async def create_referral(request):
+        """Create an Ocean eReferral (same request body as app.py)"""
+        if not services['ocean']:
+            return JSONResponse({'error': 'Ocean service not configured'}, status_code=503)
+
+        try:
+            data = await request.json()
+            result = await AsyncOceanService(services['ocean'], db, clients['http']).create_referral(data)
+            return JSONResponse(result)
+        except Exception as e:
+            logger.error(f"Error creating referral: {e}")
+            return JSONResponse({'error': str(e)}, status_code=500)
+
+    async def reload(request):
+        """Reload services whose configuration changed (?force=true rebuilds all)"""
+        try:
+            force = request.query_params.get('force', 'false').lower() == 'true'
+            changed = await asyncio.to_thread(service.reload_services, force)
+            return JSONResponse({'status': 'reloaded', 'changed': changed, 'timestamp': datetime.now().isoformat()})
+        except Exception as e:
+            return JSONResponse({'error': str(e)}, status_code=500)
+
+    return Starlette(
+        routes=[
+            Route('/health', health, methods=['GET']),
+            Route('/ready', ready, methods=['GET']),
+            Route('/metrics', prometheus_metrics, methods=['GET']),
+            Route('/api/jobs', jobs, methods=['GET']),
+            Route('/api/fax/send', send_fax, methods=['POST']),
+            Route('/api/fax/send-batch', send_fax_batch, methods=['POST']),
+            Route('/api/sms/send', send_sms, methods=['POST']),
+            Route('/api/sms/send-batch', send_sms_batch, methods=['POST']),
+            Route('/api/ocean/refer', create_referral, methods=['POST']),
+            Route('/api/reload', reload, methods=['POST']),
+        ],
+        lifespan=lifespan
+    )
+
+
+app = create_app()
+
+
+if __name__ == '__main__':
+    import uvicorn
+
+    logger.info("=================================")
+    logger.info("NextScript Integration Service (ASGI)")
+    logger.info("=================================")
+    logger.info("Starting API server on port 8080...")
+    uvicorn.run(app, host='0.0.0.0', port=8080, log_level='info')
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+Inbound Fax Dedup Benchmark
+Times how long poll_inbound takes to find the new faxes in a page of synthetic
+RingCentral messages, comparing:
+
+- per-message: one SELECT ... WHERE external_id = %s per message (the old loop)
+- batched: FaxProcessor._filter_new_faxes with a cold recent-id set, i.e. warm-up
+  plus one IN (...) query per 500 ids
+- recent-set: the same call on the next poll, when the ids already filed are
+  answered from memory and only unseen ids reach the database
+
+fax_log is seeded with --history older inbound faxes plus --known of the
+--messages in the page; all strategies must agree on which messages are new.
+
+By default the database is a SQLite file, with --round-trip seconds added to every
+query to stand in for the network hop to MySQL. With --mysql it runs against a
+real server from the DB_* environment variables, using --database, which must be
+a scratch database (fax_log is created there and must start empty).
+
+Usage:
+    python bench_inbound_dedup.py --messages 1000
+    DB_HOST=127.0.0.1 DB_USER=root DB_PASSWORD=... python bench_inbound_dedup.py --mysql --database dedup_scratch
+"""
+
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from integrations.db_pool import ConnectionPool, insert_rows
+from integrations.fax_processor import FaxProcessor
+from verify_queue_claims import SQLiteConnection
+
+FAX_LOG = """
+    CREATE TABLE IF NOT EXISTS fax_log (
+        id INTEGER PRIMARY KEY {autoincrement},
+        external_id VARCHAR(100),
+        direction VARCHAR(10) NOT NULL,
+        from_number VARCHAR(20),
+        to_number VARCHAR(20),
+        file_path VARCHAR(500),
+        status VARCHAR(50),
+        received_date TIMESTAMP NULL,
+        created_at TIMESTAMP NULL
+    )"""
+
+
+class RoundTripConnection(SQLiteConnection):
+    """SQLite connection whose cursors wait round_trip seconds per query"""
+
+    round_trip = 0.0
+
+    def cursor(self, dictionary=False):
+        cursor = super().cursor(dictionary)
+        execute = cursor.execute
+
+        def delayed(operation, params=()):
+            time.sleep(self.round_trip)
+            execute(operation, params)
+
+        cursor.execute = delayed
+        return cursor
+
+
+class CountingPool:
+    """Pool wrapper that counts the queries run on its connections"""
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.queries = 0
+
+    def get_connection(self):
+        conn = self.pool.get_connection()
+        make_cursor = conn.cursor
+
+        def cursor(*args, **kwargs):
+            cursor = make_cursor(*args, **kwargs)
+            execute = cursor.execute
+
+            def counted(*query):
+                self.queries += 1
+                return execute(*query)
+
+            cursor.execute = counted
+            return cursor
+
+        conn.cursor = cursor
+        return conn
+
+
+class StubRingCentral:
+    def __init__(self):
+        self.config = {'fax_dir': tempfile.mkdtemp(), 'fax_number': '+17785550000'}
+
+
+def seed(pool, autoincrement, history, known_ids):
+    """Fill fax_log with older inbound faxes plus the page's already-filed messages"""
+    ids = [f"h{n}" for n in range(history)] + known_ids
+    db = pool.get_connection()
+    try:
+        cursor = db.cursor()
+        cursor.execute(FAX_LOG.format(autoincrement=autoincrement))
+        cursor.execute("CREATE INDEX idx_external ON fax_log (external_id)")
+        insert_rows(cursor, "INSERT INTO fax_log (external_id, direction, status) VALUES", "(%s, 'inbound', 'received')",
+                    [(external_id,) for external_id in ids])
+        db.commit()
+        cursor.close()
+    finally:
+        db.close()
+
+
+def per_message(pool, faxes):
+    """The pre-batching loop: one round trip per message"""
+    new = []
+    db = pool.get_connection()
+    try:
+        cursor = db.cursor()
+        for fax in faxes:
+            cursor.execute("SELECT id FROM fax_log WHERE external_id = %s", (fax['id'],))
+            if not cursor.fetchone():
+                new.append(fax)
+        cursor.close()
+    finally:
+        db.close()
+    return new
+
+
+def timed(label, fn, faxes, expected, pool):
+    pool.queries = 0
+    start = time.perf_counter()
+    new = fn(faxes)
+    elapsed = time.perf_counter() - start
+    ok = sorted(str(fax['id']) for fax in new) == expected
+    print(f"  {label:<12} {elapsed * 1000:>9.1f} ms {len(new):>8} {pool.queries:>9}  {'ok' if ok else 'MISMATCH'}")
+    return ok
+
+
+def main(args):
+    if args.mysql:
+        db_config = {
+            'host': os.getenv('DB_HOST', '127.0.0.1'),
+            'port': int(os.getenv('DB_PORT', '3306')),
+            'user': os.getenv('DB_USER', 'root'),
+            'password': os.getenv('DB_PASSWORD', ''),
+            'database': args.database,
+            'autocommit': True,
+        }
+        pool = ConnectionPool(db_config, max_size=2)
+        autoincrement = 'AUTO_INCREMENT'
+        label = f"mysql {db_config['host']}/{args.database}"
+    else:
+        RoundTripConnection.round_trip = args.round_trip
+        path = os.path.join(tempfile.mkdtemp(), 'dedup.db')
+        pool = ConnectionPool({'path': path, 'version': '10.5.23-MariaDB'}, max_size=2, connect=RoundTripConnection)
+        autoincrement = 'AUTOINCREMENT'
+        label = f"sqlite, {args.round_trip * 1000:g} ms per query"
+
+    faxes = [{'id': f"m{n}", 'from': {'phoneNumber': '+17785551234'}, 'creationTime': '2026-01-01T00:00:00Z'}
+             for n in range(args.messages)]
+    known = [fax['id'] for fax in faxes[:args.known]]
+    seed(pool, autoincrement, args.history, known)
+    expected = sorted(fax['id'] for fax in faxes[args.known:])
+
+    pool = CountingPool(pool)
+    processor = FaxProcessor(StubRingCentral(), pool)
+
+    print(f"{args.messages} messages ({args.known} already filed), {args.history} older faxes in fax_log ({label})")
+    print(f"  {'strategy':<12} {'time':>12} {'new':>8} {'queries':>9}")
+    ok = all([
+        timed('per-message', lambda page: per_message(pool, page), faxes, expected, pool),
+        timed('batched', processor._filter_new_faxes, faxes, expected, pool),
+        timed('recent-set', processor._filter_new_faxes, faxes, expected, pool),
+    ])
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark inbound fax dedup against fax_log.")
+    parser.add_argument('--messages', type=int, default=1000, help="Synthetic messages in the page")
+    parser.add_argument('--known', type=int, default=500, help="How many of them are already in fax_log")
+    parser.add_argument('--history', type=int, default=20000, help="Older inbound faxes in fax_log")
+    parser.add_argument('--round-trip', type=float, default=0.0005, help="Added seconds per SQLite query")
+    parser.add_argument('--mysql', action='store_true', help="Use a MySQL server from DB_* instead of SQLite")
+    parser.add_argument('--database', help="Scratch database for --mysql")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.CRITICAL)
+    if args.mysql and not args.database:
+        parser.error("--mysql needs --database (a scratch database)")
+    main(args)
@@ -0,0 +1,61 @@
+"""
+Gunicorn configuration - production entry point for the Flask API (app.py)
+
+    gunicorn -c gunicorn.conf.py app:app
+
+Runs WEB_CONCURRENCY pre-forked workers with GUNICORN_THREADS threads each. The
+app is imported after the fork (no preload), so every worker has its own database
+pool and services. Each worker starts the service in the background once it is up:
+it waits for the database, loads the services and joins the scheduler leader
+election, so only one process runs the scheduled polls (see integrations/leader.py).
+Until then /ready answers 503.
+
+Metrics run in prometheus_client multiprocess mode: every worker writes its samples
+under PROMETHEUS_MULTIPROC_DIR (emptied when the master starts) and /metrics, on
+whichever worker answers, reports the sum over all of them, including the jobs that
+only the leader runs.
+"""
+
+import os
+import shutil
+import threading
+
+# Must be set before the workers import prometheus_client
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', '/tmp/prometheus-multiproc')
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8080')}"
+workers = int(os.getenv('WEB_CONCURRENCY', '4'))
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', '8'))
+# Fax uploads and Ocean referrals can take a while
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '120'))
+graceful_timeout = 30
+keepalive = 5
+preload_app = False
+accesslog = '-'
+errorlog = '-'
+
+
+def on_starting(server):
+    # Samples left by a previous run would be counted again
+    metrics_dir = os.environ['PROMETHEUS_MULTIPROC_DIR']
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir)
+
+
+def post_worker_init(worker):
+    # Start in a thread: blocking here would hold up the worker's heartbeat
+    import app
+    threading.Thread(target=app.start_service, name='start-service', daemon=True).start()
+
+
+def worker_exit(server, worker):
+    import app
+    app.leader.stop()
+    app.job_runner.stop()
+
+
+def child_exit(server, worker):
+    # Drop the dead worker's live gauges (DB pool connections)
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,285 @@
+"""
+Async Services
+asyncio counterparts of the API-facing service methods, used by the ASGI server (asgi.py)
+
+Each class wraps the corresponding synchronous service and reuses its configuration,
+SQL and request building; only the I/O is different (aiomysql for the database,
+aiohttp for Ocean and RingCentral), so one process can keep hundreds of requests in
+flight without a thread per request.
+"""
+
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime
+
+import aiohttp
+import aiomysql
+
+from integrations import dispatch
+from integrations.metrics import DB_QUERY_LATENCY, EXTERNAL_LATENCY, SMS_FAILED, SMS_SENT, statement_type
+
+logger = logging.getLogger(__name__)
+
+
+class _TimedAsyncCursor:
+    """Records statement latency like db_pool.TimedCursor"""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    async def execute(self, query, args=None):
+        with DB_QUERY_LATENCY.labels(statement_type(query)).time():
+            return await self._cursor.execute(query, args)
+
+
+class AsyncDatabase:
+    """aiomysql connection pool with the same borrow metrics as db_pool.ConnectionPool"""
+
+    def __init__(self, db_config, max_size=20, pool_recycle=3600):
+        self.db_config = db_config
+        self.max_size = max_size
+        self.pool_recycle = pool_recycle
+        self._pool = None
+        self._stats = {'borrows': 0, 'wait_seconds_total': 0.0, 'wait_seconds_max': 0.0}
+
+    async def start(self):
+        self._pool = await aiomysql.create_pool(
+            host=self.db_config['host'],
+            port=int(self.db_config.get('port', 3306)),
+            user=self.db_config['user'],
+            password=self.db_config['password'] or '',
+            db=self.db_config['database'],
+            autocommit=self.db_config.get('autocommit', True),
+            minsize=1,
+            maxsize=self.max_size,
+            pool_recycle=self.pool_recycle
+        )
+
+    async def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            await self._pool.wait_closed()
+
+    @asynccontextmanager
+    async def transaction(self):
+        """Borrow a connection and yield a dict cursor; commits on success, rolls back on error"""
+        start = time.monotonic()
+        async with self._pool.acquire() as conn:
+            waited = time.monotonic() - start
+            self._stats['borrows'] += 1
+            self._stats['wait_seconds_total'] += waited
+            self._stats['wait_seconds_max'] = max(self._stats['wait_seconds_max'], waited)
+            async with conn.cursor(aiomysql.DictCursor) as cursor:
+                try:
+                    yield _TimedAsyncCursor(cursor)
+                    await conn.commit()
+                except Exception:
+                    await conn.rollback()
+                    raise
+
+    def stats(self):
+        borrows = self._stats['borrows']
+        size = self._pool.size if self._pool else 0
+        idle = self._pool.freesize if self._pool else 0
+        return {
+            'borrows': borrows,
+            'max_size': self.max_size,
+            'size': size,
+            'idle': idle,
+            'in_use': size - idle,
+            'wait_ms_avg': round(self._stats['wait_seconds_total'] / borrows * 1000, 3) if borrows else 0.0,
+            'wait_ms_max': round(self._stats['wait_seconds_max'] * 1000, 3)
+        }
+
+
+class AsyncRingCentral:
+    """Sends SMS through the RingCentral REST API with the SDK's access token"""
+
+    def __init__(self, ringcentral_service, http):
+        self.rc = ringcentral_service
+        self.http = http
+
+    async def send_sms(self, to_number, message):
+        try:
+            # Token refresh (rare) is a blocking SDK call, so keep it off the event loop
+            token = await asyncio.to_thread(self.rc.get_access_token)
+            with EXTERNAL_LATENCY.labels('ringcentral', 'send_sms').time():
+                async with self.http.post(
+                    self.rc.server_url + self.rc.SMS_PATH,
+                    json=self.rc.sms_payload(to_number, message),
+                    headers={'Authorization': f'Bearer {token}'}
+                ) as response:
+                    response.raise_for_status()
+                    message_id = (await response.json()).get('id')
+
+            logger.info(f"✅ SMS sent to {to_number}, ID: {message_id}")
+            return {
+                'success': True,
+                'message_id': message_id,
+                'status': 'sent'
+            }
+
+        except Exception as e:
+            logger.error(f"❌ Failed to send SMS: {e}")
+            return {
+                'success': False,
+                'error': str(e)
+            }
+
+
+class AsyncFaxProcessor:
+    def __init__(self, fax_processor, db):
+        self.fax = fax_processor
+        self.db = db
+
+    async def send_fax(self, to_number, document_path, cover_page=''):
+        """Queue a fax for sending (async FaxProcessor.send_fax)"""
+        to_number = self.fax.rc.normalize_number(to_number)
+
+        try:
+            async with self.db.transaction() as cursor:
+                await cursor.execute(self.fax.QUEUE_FAX_SQL, (to_number, document_path, cover_page, datetime.now()))
+                fax_id = cursor.lastrowid
+
+            logger.info(f"Queued fax {fax_id} to {to_number}")
+            dispatch.notify('fax')
+
+            return {
+                'success': True,
+                'fax_id': fax_id,
+                'status': 'queued'
+            }
+
+        except Exception as e:
+            logger.error(f"Error queuing fax: {e}")
+            return {
+                'success': False,
+                'error': str(e)
+            }
+
+
+class AsyncSMSSender:
+    def __init__(self, sms_sender, ringcentral, db):
+        self.sms = sms_sender
+        self.rc = ringcentral
+        self.db = db
+
+    async def send_sms(self, to_number, message, patient_id=None, provider_id=None):
+        """Send an SMS message (async SMSSender.send_sms)"""
+        to_number = self.sms.normalize_number(to_number)
+
+        try:
+            result = await self.rc.send_sms(to_number, message)
+
+            async with self.db.transaction() as cursor:
+                await cursor.execute(self.sms.LOG_SMS_SQL,
+                                     self.sms.log_params(result, to_number, message, patient_id, provider_id))
+
+            if result['success']:
+                SMS_SENT.inc()
+                logger.info(f"✅ SMS sent to {to_number}")
+            else:
+                SMS_FAILED.inc()
+                logger.error(f"❌ SMS failed to {to_number}: {result.get('error')}")
+
+            return result
+
+        except Exception as e:
+            logger.error(f"Error sending SMS: {e}")
+            return {
+                'success': False,
+                'error': str(e)
+            }
+
+
+class AsyncOceanService:
+    def __init__(self, ocean_service, db, http):
+        self.ocean = ocean_service
+        self.db = db
+        self.http = http
+
+    async def _make_request(self, method, endpoint, data=None):
+        """Make authenticated API request to Ocean"""
+        try:
+            with EXTERNAL_LATENCY.labels('ocean', method.lower()).time():
+                async with self.http.request(
+                    method,
+                    f"{self.ocean.api_base}/{endpoint}",
+                    headers=self.ocean.request_headers(),
+                    json=data,
+                    timeout=aiohttp.ClientTimeout(total=30)
+                ) as response:
+                    response.raise_for_status()
+                    return {
+                        'success': True,
+                        'data': await response.json()
+                    }
+
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.error(f"Ocean API request failed: {e}")
+            return {
+                'success': False,
+                'error': str(e)
+            }
+
+    async def create_referral(self, referral_data):
+        """
+        Create an eReferral in Ocean (async OceanService.create_referral)
+
+        Unlike the synchronous version, no database connection is held while the
+        Ocean request is in flight.
+        """
+        try:
+            patient_id = referral_data['patient_id']
+            specialist_id = referral_data.get('specialist_id')
+
+            async with self.db.transaction() as cursor:
+                await cursor.execute(self.ocean.PATIENT_SQL, (patient_id,))
+                patient = await cursor.fetchone()
+
+                if not patient:
+                    return {'success': False, 'error': 'Patient not found'}
+
+                await cursor.execute(self.ocean.PROVIDER_SQL, (patient_id,))
+                provider = await cursor.fetchone()
+
+                specialist = None
+                if specialist_id:
+                    await cursor.execute(self.ocean.SPECIALIST_SQL, (specialist_id,))
+                    specialist = await cursor.fetchone()
+
+            ocean_request = self.ocean.build_ocean_request(referral_data, patient, provider, specialist)
+
+            result = await self._make_request('POST', 'referrals', ocean_request)
+            if not result['success']:
+                return result
+
+            ocean_referral_id = result['data'].get('id')
+            async with self.db.transaction() as cursor:
+                await cursor.execute(self.ocean.INSERT_REFERRAL_SQL, (
+                    patient_id, specialist_id, ocean_referral_id,
+                    referral_data['reason'], referral_data.get('priority', 'routine'),
+                    referral_data.get('clinical_info', ''), datetime.now()
+                ))
+                await cursor.execute(self.ocean.LINK_CONSULTATION_SQL, (ocean_referral_id, patient_id))
+
+            logger.info(f"✅ Created Ocean referral {ocean_referral_id} for patient {patient_id}")
+
+            attachments = referral_data.get('attachments', [])
+            if attachments and ocean_referral_id:
+                await asyncio.to_thread(self.ocean.upload_attachments, ocean_referral_id, attachments)
+
+            return {
+                'success': True,
+                'ocean_referral_id': ocean_referral_id,
+                'data': result['data']
+            }
+
+        except Exception as e:
+            logger.error(f"Error creating Ocean referral: {e}")
+            return {'success': False, 'error': str(e)}
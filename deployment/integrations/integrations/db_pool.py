@@ -0,0 +1,278 @@
+"""
+Database Connection Pool
+Process-wide MySQL connection pool shared by the API and all integration services
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+
+import mysql.connector
+from mysql.connector import errors
+
+from integrations.metrics import DB_QUERY_LATENCY, statement_type
+
+logger = logging.getLogger(__name__)
+
+
+def insert_rows(cursor, insert_sql, values_sql, rows, chunk_size=500):
+    """
+    Insert rows with multi-row INSERT statements of up to chunk_size rows each
+
+    insert_sql is the statement up to and including VALUES, values_sql the
+    placeholder group for one row, e.g.
+        insert_rows(cursor, "INSERT INTO t (a, b) VALUES", "(%s, %s)", rows)
+
+    Runs on the caller's cursor, so the caller controls the transaction. Returns the
+    AUTO_INCREMENT ids assigned, in row order. With innodb_autoinc_lock_mode 0 or 1
+    (MariaDB's default) InnoDB gives the rows of a multi-row INSERT consecutive ids
+    (in steps of auto_increment_increment) starting at the lastrowid reported for
+    the first row. In mode 2 (MySQL 8's default) a concurrent INSERT can take ids
+    in between, so the rows are inserted one at a time and each lastrowid kept;
+    set innodb_autoinc_lock_mode = 1 on MySQL 8 to keep the multi-row path.
+    """
+    if not rows:
+        return []
+
+    cursor.execute("SELECT @@auto_increment_increment, @@innodb_autoinc_lock_mode")
+    step, lock_mode = (int(value) for value in cursor.fetchone())
+
+    ids = []
+    if lock_mode == 2:
+        for row in rows:
+            cursor.execute(f"{insert_sql} {values_sql}", row)
+            ids.append(cursor.lastrowid)
+        return ids
+
+    for offset in range(0, len(rows), chunk_size):
+        chunk = rows[offset:offset + chunk_size]
+        cursor.execute(
+            f"{insert_sql} {', '.join([values_sql] * len(chunk))}",
+            [value for row in chunk for value in row]
+        )
+        ids.extend(range(cursor.lastrowid, cursor.lastrowid + step * len(chunk), step))
+    return ids
+
+
+class PoolExhaustedError(errors.PoolError):
+    """Raised when no connection becomes free within the borrow timeout"""
+
+
+class TimedCursor:
+    """Cursor wrapper that records statement latency in the integration_db_query_seconds histogram"""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def execute(self, operation, params=None, *args, **kwargs):
+        with DB_QUERY_LATENCY.labels(statement_type(operation)).time():
+            return self._cursor.execute(operation, params, *args, **kwargs)
+
+    def executemany(self, operation, seq_params, *args, **kwargs):
+        with DB_QUERY_LATENCY.labels(statement_type(operation)).time():
+            return self._cursor.executemany(operation, seq_params, *args, **kwargs)
+
+
+class PooledConnection:
+    """
+    Borrowed connection; behaves like a MySQL connection, but close() returns it to the pool
+
+    Existing code that does db = get_db_connection() ... db.close() works unchanged.
+    Can also be used as a context manager.
+    """
+
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+        self._returned = False
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def cursor(self, *args, **kwargs):
+        return TimedCursor(self._conn.cursor(*args, **kwargs))
+
+    def close(self):
+        """Return the connection to the pool"""
+        if not self._returned:
+            self._returned = True
+            self._pool._release(self._conn)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __del__(self):
+        # Safety net for error paths that never reach close()
+        if not getattr(self, '_returned', True):
+            logger.warning("Pooled connection was not closed; returning it to the pool")
+            self.close()
+
+
+class ConnectionPool:
+    """
+    Thread-safe MySQL connection pool
+
+    Connections are created lazily up to max_size. A borrower waits up to
+    borrow_timeout seconds for a free connection. Connections idle for longer than
+    health_check_interval are pinged before being handed out, and connections older
+    than max_lifetime are replaced.
+    """
+
+    def __init__(self, db_config, max_size=10, borrow_timeout=30, health_check_interval=30,
+                 max_lifetime=3600, connect=None):
+        self.db_config = db_config
+        self.max_size = max_size
+        self.borrow_timeout = borrow_timeout
+        self.health_check_interval = health_check_interval
+        self.max_lifetime = max_lifetime
+        self._connect = connect or mysql.connector.connect
+
+        self._lock = threading.Lock()
+        self._available = threading.Condition(self._lock)
+        self._idle = deque()  # (conn, created_at, last_used)
+        self._created_at = {}  # id(conn) -> created_at for connections in use
+        self._size = 0
+
+        self._stats = {
+            'borrows': 0,
+            'timeouts': 0,
+            'created': 0,
+            'discarded': 0,
+            'health_check_failures': 0,
+            'wait_seconds_total': 0.0,
+            'wait_seconds_max': 0.0,
+        }
+
+    def get_connection(self):
+        """Borrow a connection; close() on it returns it to the pool"""
+        start = time.monotonic()
+        deadline = start + self.borrow_timeout
+
+        with self._available:
+            while True:
+                if self._idle:
+                    conn, created_at, last_used = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    # Reserve the slot, then connect outside the lock
+                    self._size += 1
+                    conn = None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._stats['timeouts'] += 1
+                    raise PoolExhaustedError(
+                        msg=f"No database connection available after {self.borrow_timeout}s "
+                            f"({self.max_size} in use)")
+                self._available.wait(remaining)
+
+        try:
+            if conn is None:
+                conn, created_at = self._new_connection(), time.monotonic()
+            elif not self._is_healthy(conn, created_at, last_used):
+                self._close_quietly(conn)
+                with self._lock:
+                    self._stats['discarded'] += 1
+                conn, created_at = self._new_connection(), time.monotonic()
+        except Exception:
+            with self._available:
+                self._size -= 1
+                self._available.notify()
+            raise
+
+        waited = time.monotonic() - start
+        with self._lock:
+            self._created_at[id(conn)] = created_at
+            self._stats['borrows'] += 1
+            self._stats['wait_seconds_total'] += waited
+            self._stats['wait_seconds_max'] = max(self._stats['wait_seconds_max'], waited)
+
+        return PooledConnection(self, conn)
+
+    def _new_connection(self):
+        conn = self._connect(**self.db_config)
+        with self._lock:
+            self._stats['created'] += 1
+        return conn
+
+    def _is_healthy(self, conn, created_at, last_used):
+        """Check a connection before reuse; pings only if it has been idle a while"""
+        now = time.monotonic()
+        if self.max_lifetime and now - created_at > self.max_lifetime:
+            return False
+        if now - last_used < self.health_check_interval:
+            return True
+        try:
+            conn.ping(reconnect=False)
+            return True
+        except Exception as e:
+            logger.warning(f"Discarding stale database connection: {e}")
+            with self._lock:
+                self._stats['health_check_failures'] += 1
+            return False
+
+    def _release(self, conn):
+        """Return a borrowed connection to the idle list"""
+        with self._lock:
+            created_at = self._created_at.pop(id(conn), time.monotonic())
+        try:
+            # Never hand out a connection with an open transaction
+            if getattr(conn, 'in_transaction', False):
+                conn.rollback()
+            reusable = True
+        except Exception:
+            reusable = False
+
+        with self._available:
+            if reusable:
+                self._idle.append((conn, created_at, time.monotonic()))
+            else:
+                self._size -= 1
+                self._stats['discarded'] += 1
+            self._available.notify()
+
+        if not reusable:
+            self._close_quietly(conn)
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def close_all(self):
+        """Close idle connections (borrowed ones are closed when returned)"""
+        with self._lock:
+            idle = list(self._idle)
+            self._idle.clear()
+            self._size -= len(idle)
+        for conn, _, _ in idle:
+            self._close_quietly(conn)
+
+    def stats(self):
+        """Pool metrics for the /health endpoint"""
+        with self._lock:
+            stats = dict(self._stats)
+            idle = len(self._idle)
+            size = self._size
+        borrows = stats['borrows']
+        stats.update({
+            'max_size': self.max_size,
+            'size': size,
+            'idle': idle,
+            'in_use': size - idle,
+            'wait_ms_avg': round(stats.pop('wait_seconds_total') / borrows * 1000, 3) if borrows else 0.0,
+            'wait_ms_max': round(stats.pop('wait_seconds_max') * 1000, 3),
+        })
+        return stats
@@ -0,0 +1,47 @@
+"""
+Dispatch
+In-process channel that wakes the queue senders as soon as work is enqueued
+
+Services call notify('fax') or notify('sms') after committing new queue rows; the
+app subscribes the matching sender job, which then runs immediately instead of at
+its next one-minute poll. The queue tables stay the source of truth: a
+notification only says "look now", and the scheduled poll remains the catch-up
+path for rows inserted by OSCAR itself (or by another process).
+"""
+
+import logging
+import threading
+from collections import defaultdict
+
+from integrations.metrics import QUEUE_WAKEUPS
+
+logger = logging.getLogger(__name__)
+
+
+class Dispatcher:
+    """Maps channel names to wake-up callbacks"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = defaultdict(list)
+
+    def subscribe(self, channel, callback):
+        """Call callback() whenever channel is notified"""
+        with self._lock:
+            self._subscribers[channel].append(callback)
+
+    def notify(self, channel):
+        """Wake the subscribers of channel; never raises into the enqueuing request"""
+        with self._lock:
+            callbacks = list(self._subscribers.get(channel, ()))
+        QUEUE_WAKEUPS.labels(channel).inc()
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.error(f"Dispatch to {channel} subscriber failed: {e}")
+
+
+DISPATCHER = Dispatcher()
+subscribe = DISPATCHER.subscribe
+notify = DISPATCHER.notify
@@ -8,25 +8,26 @@ import paramiko
 import logging
 from datetime import datetime
 from typing import Dict, Optional, List
-import mysql.connector
 from pathlib import Path
 
+from integrations.metrics import EXTERNAL_LATENCY, LABS_IMPORTED
+
 logger = logging.getLogger(__name__)
 
 
 class ExpediusService:
     """Service for downloading and processing lab results from Expedius"""
 
-    def __init__(self, config: Dict, db_config: Dict):
+    def __init__(self, config: Dict, db_pool):
         """
         Initialize Expedius service
 
         Args:
             config: Expedius configuration (host, username, password, path)
-            db_config: Database configuration for OSCAR
+            db_pool: Shared ConnectionPool for the OSCAR database
         """
         self.config = config
-        self.db_config = db_config
+        self.db_pool = db_pool
 
         # SFTP connection details
         self.host = config.get('host', 'sftp.excelleris.com')
@@ -42,10 +43,14 @@ class ExpediusService:
         # Track processed files
         self.processed_files = self._load_processed_files()
 
+    def get_db_connection(self):
+        """Borrow a connection from the shared pool (close() returns it)"""
+        return self.db_pool.get_connection()
+
     def _load_processed_files(self) -> set:
         """Load list of already processed files from database"""
         try:
-            conn = mysql.connector.connect(**self.db_config)
+            conn = self.get_db_connection()
             cursor = conn.cursor()
 
             cursor.execute("""
@@ -68,7 +73,7 @@ class ExpediusService:
     def _mark_file_processed(self, filename: str):
         """Mark a file as processed in the database"""
         try:
-            conn = mysql.connector.connect(**self.db_config)
+            conn = self.get_db_connection()
             cursor = conn.cursor()
 
             cursor.execute("""
@@ -89,9 +94,10 @@ class ExpediusService:
     def connect_sftp(self) -> Optional[paramiko.SFTPClient]:
         """Establish SFTP connection to Expedius"""
         try:
-            transport = paramiko.Transport((self.host, self.port))
-            transport.connect(username=self.username, password=self.password)
-            sftp = paramiko.SFTPClient.from_transport(transport)
+            with EXTERNAL_LATENCY.labels('sftp', 'connect').time():
+                transport = paramiko.Transport((self.host, self.port))
+                transport.connect(username=self.username, password=self.password)
+                sftp = paramiko.SFTPClient.from_transport(transport)
 
             logger.info(f"Connected to Expedius SFTP: {self.host}")
             return sftp
@@ -104,7 +110,8 @@ class ExpediusService:
         """List new lab files that haven't been processed"""
         try:
             # List all files in remote directory
-            files = sftp.listdir(self.remote_path)
+            with EXTERNAL_LATENCY.labels('sftp', 'list').time():
+                files = sftp.listdir(self.remote_path)
 
             # Filter for HL7 lab files (typically .hl7 or .txt)
             lab_files = [f for f in files if f.endswith(('.hl7', '.txt', '.HL7', '.TXT'))]
@@ -125,7 +132,8 @@ class ExpediusService:
             remote_file = os.path.join(self.remote_path, filename)
             local_file = os.path.join(self.local_path, filename)
 
-            sftp.get(remote_file, local_file)
+            with EXTERNAL_LATENCY.labels('sftp', 'download').time():
+                sftp.get(remote_file, local_file)
             logger.info(f"Downloaded: {filename}")
 
             return local_file
@@ -154,7 +162,7 @@ class ExpediusService:
             message_id = segments[9] if len(segments) > 9 else 'Unknown'
 
             # Insert into OSCAR's hl7TextInfo table
-            conn = mysql.connector.connect(**self.db_config)
+            conn = self.get_db_connection()
             cursor = conn.cursor()
 
             # Check if this message ID already exists
@@ -206,6 +214,7 @@ class ExpediusService:
             cursor.close()
             conn.close()
 
+            LABS_IMPORTED.inc()
             logger.info(f"Imported lab to OSCAR: {message_id} (ID: {lab_id})")
             return True
 
@@ -5,256 +5,487 @@ Handles inbound and outbound fax processing with RingCentral
 
 import logging
 import os
-import mysql.connector
-from datetime import datetime, timedelta
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from integrations import dispatch
+from integrations.db_pool import insert_rows
+from integrations.message_sync import MessageStoreSync
+from integrations.metrics import (
+    FAX_POLL_THROUGHPUT, FAXES_FAILED, FAXES_POLLED, FAXES_RECEIVED, FAXES_SENT, QUEUE_LATENCY
+)
+from integrations.queue_lease import QueueLease
+from integrations.rate_limit import SharedTokenBucket
+from integrations.recent_ids import RecentIds
 
 logger = logging.getLogger(__name__)
 
 class FaxProcessor:
-    def __init__(self, ringcentral_service, db_config):
+    # Shared with the asyncio variant (async_services.AsyncFaxProcessor)
+    QUEUE_FAX_SQL = """
+                INSERT INTO fax_queue (
+                    to_number, document_path, cover_page,
+                    status, created_at
+                ) VALUES (%s, %s, %s, 'pending', %s)
+            """
+    QUEUE_FAX_BATCH_SQL = """
+                INSERT INTO fax_queue (
+                    to_number, document_path, cover_page,
+                    status, created_at
+                ) VALUES"""
+    QUEUE_FAX_ROW = "(%s, %s, %s, 'pending', %s)"
+
+    # Largest batch accepted by send_fax_batch
+    MAX_BATCH_SIZE = 1000
+
+    # Inbound faxes are filed in one transaction (see _record_inbound_faxes)
+    INBOUND_FAX_LOG_SQL = """
+                INSERT INTO fax_log (
+                    external_id, direction, from_number, to_number,
+                    file_path, status, received_date, created_at
+                ) VALUES"""
+    INBOUND_FAX_LOG_ROW = "(%s, %s, %s, %s, %s, %s, %s, %s)"
+    DOCUMENT_SQL = """
+                INSERT INTO document (
+                    doctype, docdesc, docxml, docfilename,
+                    doccreator, source, sourceFacility,
+                    public1, updatedatetime, status,
+                    contenttype, abnormal, receivedDate
+                ) VALUES"""
+    DOCUMENT_ROW = "('fax', %s, '', %s, 'system', 'fax', %s, '0', %s, 'A', 'application/pdf', '0', %s)"
+    CTL_DOCUMENT_SQL = """
+                INSERT INTO ctl_document (
+                    module, module_id, document_no, status,
+                    document_description, responsible, source,
+                    created_date, updatedatetime
+                ) VALUES"""
+    CTL_DOCUMENT_ROW = "('demographic', 0, %s, 'A', %s, 'system', 'fax', %s, %s)"
+
+    # Message ids per fax_log dedup query
+    DEDUP_CHUNK = 500
+
+    def __init__(self, ringcentral_service, db_pool):
         self.rc = ringcentral_service
-        self.db_config = db_config
-        self.fax_dir = '/var/lib/OscarDocument/oscar_nextscript/incomingdocs/1/Fax/'
+        self.db_pool = db_pool
+        # ringcentral config key fax_dir (optional) overrides OSCAR's incoming fax folder
+        self.fax_dir = self.rc.config.get('fax_dir', '/var/lib/OscarDocument/oscar_nextscript/incomingdocs/1/Fax/')
         os.makedirs(self.fax_dir, exist_ok=True)
 
+        # Outbound sending; fax is in RingCentral's "Heavy" API group (10 requests/min)
+        config = self.rc.config
+        self.send_concurrency = int(config.get('fax_send_concurrency', 4))
+        self.max_batch = int(config.get('fax_max_batch', 50))
+        self.send_time_budget = float(config.get('fax_send_time_budget', 4 * 60))
+        self.send_stale_after = float(config.get('fax_send_stale_after', 15 * 60))
+        # Shared by all workers and instances, since any of them may send
+        self.rate_limiter = SharedTokenBucket.per_minute(db_pool, 'ringcentral_fax',
+                                                         float(config.get('fax_rate_per_minute', 10)))
+        self.download_concurrency = int(config.get('fax_download_concurrency', 4))
+        self.recent_inbound = RecentIds(int(config.get('fax_recent_ids', 5000)))
+        self.inbound_sync = MessageStoreSync(
+            db_pool, self._list_inbound_pages, 'last_fax_poll',
+            page_size=int(config.get('fax_sync_page_size', 100)),
+            overlap=int(config.get('fax_sync_overlap', 300)),
+            max_attempts=int(config.get('fax_sync_max_attempts', 5))
+        )
+        self.retry_delay = int(config.get('fax_retry_delay', 60))
+        # Claimed rows may wait for rate-limit tokens for up to the whole time budget
+        self.lease = QueueLease(db_pool, 'fax_queue', lease_seconds=int(self.send_time_budget) + 60)
+
     def get_db_connection(self):
-        """Get database connection"""
-        return mysql.connector.connect(**self.db_config)
+        """Borrow a connection from the shared pool (close() returns it)"""
+        return self.db_pool.get_connection()
 
     def poll_inbound(self):
-        """Poll RingCentral for new inbound faxes"""
+        """
+        Poll RingCentral for new inbound faxes
+
+        Walks the message store from the saved cursor (see MessageStoreSync), one
+        page at a time. Each page runs as a staged pipeline: batched dedup (see
+        _filter_new_faxes), concurrent downloads (up to download_concurrency at
+        once), then a single transaction of fax_log / document / ctl_document
+        inserts. No database connection is held while downloads are
+        in flight. Faxes that fail to download hold the cursor back so the next
+        poll retries them, up to fax_sync_max_attempts polls; after that they are
+        logged as failed in fax_log. Returns the poll's counts and throughput.
+        """
         logger.info("Polling for inbound faxes...")
+        start = time.monotonic()
+        polled = new = received = 0
 
         try:
-            # Get last poll time from database
-            db = self.get_db_connection()
-            cursor = db.cursor(dictionary=True)
-
-            cursor.execute("""
-                SELECT config_value
-                FROM system_config
-                WHERE config_key = 'last_fax_poll'
-            """)
-            result = cursor.fetchone()
+            for page in self.inbound_sync.pages():
+                FAXES_POLLED.inc(len(page))
+                new_faxes = self._filter_new_faxes(page)
+                downloaded = self._download_faxes(new_faxes)
+                try:
+                    self._record_inbound_faxes(downloaded)
+                except Exception:
+                    # Nothing was filed; the next poll downloads these again under new names
+                    self._discard_downloads(downloaded)
+                    raise
+
+                filed = {str(fax['message_id']) for fax in downloaded}
+                given_up = [fax for fax in new_faxes
+                            if str(fax['id']) not in filed and not self.inbound_sync.hold(fax)]
+                self._record_failed_inbound_faxes(given_up)
+
+                polled += len(page)
+                new += len(new_faxes)
+                received += len(downloaded)
+                logger.info(f"Found {len(page)} faxes, {len(new_faxes)} new")
+
+            elapsed = time.monotonic() - start
+            per_minute = received / elapsed * 60 if elapsed else 0.0
+            FAX_POLL_THROUGHPUT.set(round(per_minute, 1))
+            logger.info(f"Inbound fax poll: {received} of {new} new faxes filed in "
+                        f"{elapsed:.1f}s ({per_minute:.1f} faxes/min)")
 
-            last_poll = result['config_value'] if result else None
-            if not last_poll:
-                # First poll - get faxes from last 7 days
-                last_poll = (datetime.now() - timedelta(days=7)).isoformat()
-
-            # Get faxes from RingCentral
-            faxes = self.rc.get_inbound_faxes(date_from=last_poll)
+            return {
+                'polled': polled,
+                'new': new,
+                'received': received,
+                'seconds': round(elapsed, 3),
+                'faxes_per_minute': round(per_minute, 1)
+            }
 
-            logger.info(f"Found {len(faxes)} new faxes")
+        except Exception as e:
+            logger.error(f"Error polling faxes: {e}")
 
-            # Process each fax
-            for fax in faxes:
-                self._process_inbound_fax(fax, cursor)
+    def _list_inbound_pages(self, date_from, date_to, page_size):
+        return self.rc.iter_inbound_faxes(date_from=date_from, date_to=date_to, page_size=page_size)
 
-            # Update last poll time
-            cursor.execute("""
-                INSERT INTO system_config (config_key, config_value)
-                VALUES ('last_fax_poll', %s)
-                ON DUPLICATE KEY UPDATE config_value = %s
-            """, (datetime.now().isoformat(), datetime.now().isoformat()))
+    def _filter_new_faxes(self, faxes):
+        """
+        Drop faxes already in fax_log
 
-            db.commit()
+        Ids in recent_inbound are known to be filed and skip the database; the rest
+        are checked with one IN (...) query per DEDUP_CHUNK ids. The first call warms
+        recent_inbound with the latest inbound fax_log ids.
+        """
+        unique = {}
+        for fax in faxes:
+            unique.setdefault(str(fax['id']), fax)
+        if not unique:
+            return []
+
+        _, unknown = self.recent_inbound.split(unique)
+        if not unknown and self.recent_inbound.warmed:
+            return []
+
+        found = []
+        db = self.get_db_connection()
+        try:
+            cursor = db.cursor()
+            if not self.recent_inbound.warmed:
+                cursor.execute("""
+                    SELECT external_id FROM fax_log
+                    WHERE direction = 'inbound' AND external_id IS NOT NULL
+                    ORDER BY id DESC
+                    LIMIT %s
+                """, (self.recent_inbound.maxlen,))
+                # Oldest first, so the newest ids are the last to be evicted
+                self.recent_inbound.add(reversed([row[0] for row in cursor.fetchall()]))
+                self.recent_inbound.warmed = True
+                _, unknown = self.recent_inbound.split(unknown)
+
+            for offset in range(0, len(unknown), self.DEDUP_CHUNK):
+                chunk = unknown[offset:offset + self.DEDUP_CHUNK]
+                cursor.execute(f"""
+                    SELECT external_id FROM fax_log
+                    WHERE external_id IN ({', '.join(['%s'] * len(chunk))})
+                """, chunk)
+                found.extend(str(row[0]) for row in cursor.fetchall())
             cursor.close()
+        finally:
             db.close()
 
-        except Exception as e:
-            logger.error(f"Error polling faxes: {e}")
+        self.recent_inbound.add(found)
+        new_ids = set(unknown) - set(found)
+        return [fax for message_id, fax in unique.items() if message_id in new_ids]
 
-    def _process_inbound_fax(self, fax, cursor):
-        """Process a single inbound fax"""
+    def _download_faxes(self, faxes):
+        """Download faxes concurrently; returns the ones that downloaded"""
+        if not faxes:
+            return []
+        with ThreadPoolExecutor(max_workers=self.download_concurrency, thread_name_prefix='fax-download') as pool:
+            return [fax for fax in pool.map(self._download_fax, faxes) if fax]
+
+    def _download_fax(self, fax):
+        """Download one fax; returns what _record_inbound_faxes needs, or None"""
         try:
             message_id = fax['id']
-            from_number = fax.get('from', {}).get('phoneNumber', 'Unknown')
-            received_date = fax.get('creationTime')
-
-            # Check if already processed
-            cursor.execute("""
-                SELECT id FROM fax_log
-                WHERE external_id = %s
-            """, (message_id,))
+            attachments = fax.get('attachments') or []
 
-            if cursor.fetchone():
-                logger.debug(f"Fax {message_id} already processed, skipping")
-                return
-
-            # Download fax
             filename = f"fax_{message_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf"
             save_path = os.path.join(self.fax_dir, filename)
 
-            result = self.rc.download_fax(message_id, save_path)
-
-            if result['success']:
-                # Log to database
-                cursor.execute("""
-                    INSERT INTO fax_log (
-                        external_id, direction, from_number, to_number,
-                        file_path, status, received_date, created_at
-                    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-                """, (
-                    message_id, 'inbound', from_number, self.rc.config.get('fax_number'),
-                    save_path, 'received', received_date, datetime.now()
-                ))
-
-                # Create OSCAR document entry
-                self._create_oscar_document(filename, from_number, received_date, cursor)
+            # The list record already carries the attachment URI
+            result = self.rc.download_fax(message_id, save_path,
+                                          attachment_uri=attachments[0].get('uri') if attachments else None)
+            if not result['success']:
+                FAXES_FAILED.labels('inbound').inc()
+                return None
 
-                logger.info(f"✅ Processed inbound fax from {from_number}")
+            return {
+                'message_id': message_id,
+                'from_number': (fax.get('from') or {}).get('phoneNumber', 'Unknown'),
+                'received_date': fax.get('creationTime'),
+                'filename': filename,
+                'save_path': save_path
+            }
 
         except Exception as e:
-            logger.error(f"Error processing inbound fax: {e}")
-
-    def _create_oscar_document(self, filename, from_number, received_date, cursor):
-        """Create document entry in OSCAR"""
+            FAXES_FAILED.labels('inbound').inc()
+            logger.error(f"Error downloading inbound fax: {e}")
+            return None
+
+    def _discard_downloads(self, faxes):
+        """Delete downloaded files that were never filed, so they are not left orphaned"""
+        for fax in faxes:
+            try:
+                os.remove(fax['save_path'])
+            except OSError as e:
+                logger.warning(f"Could not remove unfiled fax {fax['save_path']}: {e}")
+
+    def _record_failed_inbound_faxes(self, faxes):
+        """Log faxes that could not be downloaded after repeated polls, so they are not listed again"""
+        if not faxes:
+            return
+
+        db = self.get_db_connection()
         try:
-            # Insert into ctl_document table
-            cursor.execute("""
-                INSERT INTO ctl_document (
-                    module, module_id, document_no, status,
-                    document_description, responsible, source,
-                    created_date, updatedatetime
-                ) VALUES (
-                    'demographic', 0, 0, 'A',
-                    %s, 'system', 'fax',
-                    %s, %s
-                )
-            """, (
-                f"Inbound Fax from {from_number}",
-                received_date,
-                datetime.now()
-            ))
-
-            # Get document ID
-            doc_id = cursor.lastrowid
-
-            # Insert into document table
-            cursor.execute("""
-                INSERT INTO document (
-                    doctype, docdesc, docxml, docfilename,
-                    doccreator, source, sourceFacility,
-                    public1, updatedatetime, status,
-                    contenttype, abnormal, receivedDate
-                ) VALUES (
-                    'fax', %s, '', %s,
-                    'system', 'fax', %s,
-                    '0', %s, 'A',
-                    'application/pdf', '0', %s
-                )
-            """, (
-                f"Inbound Fax from {from_number}",
-                filename,
-                from_number,
-                datetime.now(),
-                received_date
-            ))
-
-            logger.debug(f"Created OSCAR document {doc_id} for fax")
+            cursor = db.cursor()
+            insert_rows(cursor, self.INBOUND_FAX_LOG_SQL, self.INBOUND_FAX_LOG_ROW, [(
+                str(fax['id']), 'inbound', (fax.get('from') or {}).get('phoneNumber', 'Unknown'),
+                self.rc.config.get('fax_number'), None, 'failed', fax.get('creationTime'), datetime.now()
+            ) for fax in faxes])
+            db.commit()
+            cursor.close()
+        finally:
+            db.close()
 
-        except Exception as e:
-            logger.error(f"Error creating OSCAR document: {e}")
+        for fax in faxes:
+            logger.error(f"❌ Inbound fax {fax['id']} could not be downloaded; marked failed in fax_log")
 
-    def process_queue(self):
-        """Process outbound fax queue"""
-        logger.info("Processing outbound fax queue...")
+    def _record_inbound_faxes(self, faxes):
+        """Log downloaded faxes and file them as OSCAR documents in one transaction"""
+        if not faxes:
+            return
 
+        now = datetime.now()
+        db = self.get_db_connection()
         try:
-            db = self.get_db_connection()
-            cursor = db.cursor(dictionary=True)
-
-            # Get pending faxes
-            cursor.execute("""
-                SELECT * FROM fax_queue
-                WHERE status = 'pending'
-                AND (retry_count < 3 OR retry_count IS NULL)
-                ORDER BY created_at ASC
-                LIMIT 10
-            """)
+            db.start_transaction()
+            cursor = db.cursor()
 
-            pending = cursor.fetchall()
-            logger.info(f"Found {len(pending)} pending faxes")
+            # Log to database
+            insert_rows(cursor, self.INBOUND_FAX_LOG_SQL, self.INBOUND_FAX_LOG_ROW, [(
+                fax['message_id'], 'inbound', fax['from_number'], self.rc.config.get('fax_number'),
+                fax['save_path'], 'received', fax['received_date'], now
+            ) for fax in faxes])
 
-            for fax in pending:
-                self._send_queued_fax(fax, cursor)
+            # Create OSCAR document entries, each linked from ctl_document. OSCAR inserts
+            # into document too, so ids are taken one row at a time from lastrowid rather
+            # than assumed consecutive
+            document_ids = []
+            for fax in faxes:
+                cursor.execute(f"{self.DOCUMENT_SQL} {self.DOCUMENT_ROW}", (
+                    f"Inbound Fax from {fax['from_number']}", fax['filename'], fax['from_number'],
+                    now, fax['received_date']
+                ))
+                document_ids.append(cursor.lastrowid)
+            insert_rows(cursor, self.CTL_DOCUMENT_SQL, self.CTL_DOCUMENT_ROW, [(
+                document_id, f"Inbound Fax from {fax['from_number']}", fax['received_date'], now
+            ) for document_id, fax in zip(document_ids, faxes)])
 
             db.commit()
             cursor.close()
+        finally:
             db.close()
 
-        except Exception as e:
-            logger.error(f"Error processing fax queue: {e}")
-
-    def _send_queued_fax(self, fax, cursor):
-        """Send a queued fax"""
-        try:
-            fax_id = fax['id']
-            to_number = fax['to_number']
-            document_path = fax['document_path']
-            cover_page = fax.get('cover_page', '')
+        self.recent_inbound.add(fax['message_id'] for fax in faxes)
+        FAXES_RECEIVED.inc(len(faxes))
+        for fax in faxes:
+            logger.info(f"✅ Processed inbound fax from {fax['from_number']}")
 
-            logger.info(f"Sending fax {fax_id} to {to_number}")
+    def process_queue(self):
+        """
+        Send pending faxes concurrently
+
+        Uploads run on up to send_concurrency threads, paced by a token bucket at
+        RingCentral's fax rate limit. The batch claimed per pass grows with the
+        backlog (bounded by max_batch and by what the rate limit allows within the
+        time budget), and passes repeat until the queue is empty or the budget is
+        spent.
+
+        Rows are claimed under a lease (queue_lease.QueueLease), so several service
+        instances can drain the queue together. A row is marked 'sending' and
+        committed before its upload starts, and its result is committed as soon as
+        the upload returns; if the process dies in between, the row is failed for
+        manual review rather than sent again.
+        """
+        logger.info("Processing outbound fax queue...")
 
-            # Send via RingCentral
-            result = self.rc.send_fax(to_number, document_path, cover_page)
+        try:
+            interrupted = self.lease.fail_interrupted(self.send_stale_after)
+            if interrupted:
+                FAXES_FAILED.labels('outbound').inc(interrupted)
+                logger.error(f"❌ {interrupted} faxes were interrupted mid-upload and marked failed for review")
+
+            start = time.monotonic()
+            deadline = start + self.send_time_budget
+            outcomes = {'sent': 0, 'failed': 0, 'skipped': 0}
+
+            with ThreadPoolExecutor(max_workers=self.send_concurrency, thread_name_prefix='fax-send') as pool:
+                while True:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    backlog = self.lease.pending_count()
+                    limit = min(backlog, self.max_batch, self.rate_limiter.available_within(remaining))
+                    if limit <= 0:
+                        break
+
+                    claimed = self.lease.claim(limit)
+                    if not claimed:
+                        break
+                    logger.info(f"Sending {len(claimed)} of {backlog} pending faxes "
+                                f"({self.send_concurrency} concurrent)")
+
+                    for outcome in pool.map(lambda fax: self._send_queued_fax(fax, deadline), claimed):
+                        outcomes[outcome] += 1
+                    if outcomes['skipped']:
+                        # Rate limited or out of time; leave the rest for the next run
+                        break
+
+            elapsed = time.monotonic() - start
+            if outcomes['sent'] or outcomes['failed']:
+                logger.info(f"Fax queue pass: {outcomes['sent']} sent, {outcomes['failed']} failed in "
+                            f"{elapsed:.1f}s ({outcomes['sent'] / elapsed * 60:.1f} faxes/min)")
 
-            if result['success']:
-                # Update queue status
-                cursor.execute("""
-                    UPDATE fax_queue
-                    SET status = 'sent',
-                        external_id = %s,
-                        sent_at = %s
-                    WHERE id = %s
-                """, (result['fax_id'], datetime.now(), fax_id))
+        except Exception as e:
+            logger.error(f"Error processing fax queue: {e}")
 
-                # Log successful send
-                cursor.execute("""
-                    INSERT INTO fax_log (
-                        external_id, direction, from_number, to_number,
-                        file_path, status, created_at
-                    ) VALUES (%s, %s, %s, %s, %s, %s, %s)
-                """, (
-                    result['fax_id'], 'outbound',
-                    self.rc.config.get('fax_number'), to_number,
-                    document_path, 'sent', datetime.now()
-                ))
+    def _send_queued_fax(self, fax, deadline):
+        """
+        Send one claimed fax on its own pooled connection
 
-                logger.info(f"✅ Sent fax {fax_id} to {to_number}, RC ID: {result['fax_id']}")
+        Returns 'sent', 'failed' or 'skipped' (rate limited, out of time or lease
+        lost; the row stays pending without using up a retry).
+        """
+        fax_id = fax['id']
+        try:
+            if not self.rate_limiter.acquire(timeout=max(0.0, deadline - time.monotonic())):
+                self.lease.release(fax)
+                return 'skipped'
 
-            else:
-                # Update retry count
+            db = self.get_db_connection()
+            try:
+                cursor = db.cursor()
+
+                # Committed before the upload so a crash cannot resend it
+                started = self.lease.start_send(cursor, fax)
+                db.commit()
+                if not started:
+                    # The worker that reclaimed it takes its own token
+                    self.rate_limiter.refund()
+                    logger.warning(f"Lease on fax {fax_id} expired and was reclaimed; skipping")
+                    return 'skipped'
+
+                to_number = fax['to_number']
+                document_path = fax['document_path']
+                cover_page = fax.get('cover_page', '')
+
+                logger.info(f"Sending fax {fax_id} to {to_number}")
+
+                # Send via RingCentral
+                result = self.rc.send_fax(to_number, document_path, cover_page)
+
+                if result['success']:
+                    # Update queue status
+                    cursor.execute("""
+                        UPDATE fax_queue
+                        SET status = 'sent',
+                            external_id = %s,
+                            sent_at = %s,
+                            claimed_by = NULL,
+                            lease_expires_at = NULL
+                        WHERE id = %s
+                    """, (result['fax_id'], datetime.now(), fax_id))
+
+                    # Log successful send
+                    cursor.execute("""
+                        INSERT INTO fax_log (
+                            external_id, direction, from_number, to_number,
+                            file_path, status, created_at
+                        ) VALUES (%s, %s, %s, %s, %s, %s, %s)
+                    """, (
+                        result['fax_id'], 'outbound',
+                        self.rc.config.get('fax_number'), to_number,
+                        document_path, 'sent', datetime.now()
+                    ))
+                    db.commit()
+
+                    FAXES_SENT.inc()
+                    if fax.get('created_at'):
+                        QUEUE_LATENCY.labels('fax').observe(max(0.0, (datetime.now() - fax['created_at']).total_seconds()))
+                    logger.info(f"✅ Sent fax {fax_id} to {to_number}, RC ID: {result['fax_id']}")
+                    return 'sent'
+
+                if result.get('rate_limited'):
+                    # Not the fax's fault: back off and put it back without counting a retry
+                    self.rate_limiter.pause(result['retry_after'])
+                    cursor.execute("""
+                        UPDATE fax_queue
+                        SET status = 'pending',
+                            last_error = %s,
+                            claimed_by = NULL,
+                            lease_expires_at = NULL
+                        WHERE id = %s
+                    """, (result.get('error'), fax_id))
+                    db.commit()
+                    logger.warning(f"RingCentral rate limit hit; pausing fax sends for {result['retry_after']:.0f}s")
+                    return 'skipped'
+
+                # Update retry count; the lease doubles as the retry delay
                 retry_count = (fax.get('retry_count') or 0) + 1
                 cursor.execute("""
                     UPDATE fax_queue
                     SET retry_count = %s,
                         last_error = %s,
-                        status = CASE WHEN %s >= 3 THEN 'failed' ELSE 'pending' END
+                        status = CASE WHEN %s >= 3 THEN 'failed' ELSE 'pending' END,
+                        claimed_by = NULL,
+                        lease_expires_at = DATE_ADD(NOW(), INTERVAL %s SECOND)
                     WHERE id = %s
-                """, (retry_count, result.get('error'), retry_count, fax_id))
+                """, (retry_count, result.get('error'), retry_count, self.retry_delay, fax_id))
+                db.commit()
 
+                FAXES_FAILED.labels('outbound').inc()
                 logger.error(f"❌ Failed to send fax {fax_id}: {result.get('error')}")
+                return 'failed'
+
+            finally:
+                db.close()
 
         except Exception as e:
-            logger.error(f"Error sending queued fax: {e}")
+            logger.error(f"Error sending queued fax {fax_id}: {e}")
+            return 'failed'
 
     def send_fax(self, to_number, document_path, cover_page=''):
         """
         Queue a fax for sending
-        Called from API endpoint
+        Called from API endpoint. The number is normalized as in send_fax_batch;
+        raises ValueError for one that cannot be, before anything is queued.
         """
+        to_number = self.rc.normalize_number(to_number)
+
         try:
             db = self.get_db_connection()
             cursor = db.cursor()
 
-            cursor.execute("""
-                INSERT INTO fax_queue (
-                    to_number, document_path, cover_page,
-                    status, created_at
-                ) VALUES (%s, %s, %s, 'pending', %s)
-            """, (to_number, document_path, cover_page, datetime.now()))
+            cursor.execute(self.QUEUE_FAX_SQL, (to_number, document_path, cover_page, datetime.now()))
 
             fax_id = cursor.lastrowid
 
@@ -263,6 +494,7 @@ class FaxProcessor:
             db.close()
 
             logger.info(f"Queued fax {fax_id} to {to_number}")
+            dispatch.notify('fax')
 
             return {
                 'success': True,
@@ -276,3 +508,64 @@ class FaxProcessor:
                 'success': False,
                 'error': str(e)
             }
+
+    def send_fax_batch(self, faxes):
+        """
+        Queue many faxes for sending in one transaction
+
+        faxes: list of {'to', 'document_path', optional 'cover_page'}. Numbers are
+        normalized; invalid entries are skipped and reported by index in
+        'rejected'. The rest are inserted with multi-row INSERTs and one commit,
+        and their queue ids returned in order.
+        """
+        if not isinstance(faxes, list) or not faxes:
+            return {'success': False, 'error': 'faxes must be a non-empty list'}
+        if len(faxes) > self.MAX_BATCH_SIZE:
+            return {'success': False, 'error': f'At most {self.MAX_BATCH_SIZE} faxes per batch'}
+
+        rows, indexes, rejected = [], [], []
+        now = datetime.now()
+        for index, item in enumerate(faxes):
+            try:
+                if not isinstance(item, dict):
+                    raise ValueError('Entry must be an object')
+                document_path = item.get('document_path')
+                if not isinstance(document_path, str) or not document_path.strip():
+                    raise ValueError('document_path is required')
+                rows.append((self.rc.normalize_number(item.get('to')), document_path,
+                             item.get('cover_page', ''), now))
+                indexes.append(index)
+            except (TypeError, ValueError) as e:
+                rejected.append({'index': index, 'error': str(e)})
+
+        try:
+            ids = []
+            if rows:
+                db = self.get_db_connection()
+                try:
+                    # The pool's connections autocommit; make all chunks one transaction
+                    db.start_transaction()
+                    cursor = db.cursor()
+                    ids = insert_rows(cursor, self.QUEUE_FAX_BATCH_SQL, self.QUEUE_FAX_ROW, rows)
+                    db.commit()
+                    cursor.close()
+                finally:
+                    db.close()
+
+            logger.info(f"Queued {len(ids)} faxes ({len(rejected)} rejected)")
+            if ids:
+                dispatch.notify('fax')
+
+            return {
+                'success': True,
+                'queued': [{'index': index, 'fax_id': fax_id} for index, fax_id in zip(indexes, ids)],
+                'rejected': rejected,
+                'status': 'queued'
+            }
+
+        except Exception as e:
+            logger.error(f"Error queuing fax batch: {e}")
+            return {
+                'success': False,
+                'error': str(e)
+            }
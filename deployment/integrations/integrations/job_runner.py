@@ -0,0 +1,208 @@
+"""
+Job Runner
+Runs the service's periodic jobs on a worker pool, so a slow job (e.g. an SFTP lab
+poll) no longer delays the others
+"""
+
+import logging
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from integrations.metrics import JOB_DURATION, JOB_RUNS
+
+logger = logging.getLogger(__name__)
+
+
+class Job:
+    """A periodic job and its run history"""
+
+    def __init__(self, name, func, interval, jitter=0, slow_after=None, history_size=50, leader_only=False):
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.jitter = jitter
+        self.slow_after = slow_after
+        self.leader_only = leader_only
+        self.history = deque(maxlen=history_size)
+        self.next_run = None  # monotonic time the next run is due
+        self.running = False
+        self.started = None  # monotonic start of the current run
+        self.reported_slow = False  # the current run has been logged as slow
+        self.rerun = False  # triggered while running; run again when this run ends
+        self.counts = {'success': 0, 'error': 0, 'slow': 0, 'skipped': 0, 'triggered': 0}
+
+    def schedule_next(self, after):
+        self.next_run = after + self.interval + random.uniform(0, self.jitter)
+
+    def summary(self, history=10):
+        last = self.history[-1] if self.history else None
+        durations = [run['duration'] for run in self.history if run['duration'] is not None]
+        return {
+            'interval_seconds': self.interval,
+            'jitter_seconds': self.jitter,
+            'slow_after_seconds': self.slow_after,
+            'leader_only': self.leader_only,
+            'running': self.running,
+            'next_run_in_seconds': round(max(0.0, self.next_run - time.monotonic()), 1) if self.next_run else None,
+            'counts': dict(self.counts),
+            'last_run': last,
+            'avg_duration_seconds': round(sum(durations) / len(durations), 3) if durations else None,
+            'max_duration_seconds': max(durations) if durations else None,
+            'history': list(self.history)[-history:] if history else [],
+        }
+
+
+class JobRunner:
+    """
+    Periodic job scheduler backed by a thread pool
+
+    - Each job runs on the pool, so jobs do not block each other
+    - A job never overlaps itself; a run that comes due while the previous one is
+      still going is recorded as skipped
+    - Random jitter is added to every interval so jobs do not fire in lockstep
+    - Runs taking longer than slow_after seconds are logged while still running and
+      counted as 'slow' when they end. This is a threshold for attention, not a
+      timeout: Python threads cannot be killed, and abandoning a run would let the
+      job overlap itself. A run that hangs keeps its job from running (each missed
+      run is logged and counted as skipped) until it returns, so jobs must bound
+      their own I/O (HTTP timeouts, the pool's borrow timeout)
+    - Duration, lateness (start delay past the due time) and outcome are kept per run
+    - Jobs registered with leader_only=True run on schedule only in the process that
+      currently holds scheduler leadership (see leader.py); trigger() and run_now()
+      still run them anywhere
+    """
+
+    def __init__(self, max_workers=4, history_size=50, tick=0.5):
+        self.max_workers = max_workers
+        self.history_size = history_size
+        self.tick = tick
+        self.jobs = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job')
+
+    def every(self, seconds, func, name=None, jitter=0, slow_after=None, leader_only=False):
+        """Register func to run every seconds (plus up to jitter seconds)"""
+        name = name or func.__name__
+        job = Job(name, func, seconds, jitter, slow_after, self.history_size, leader_only)
+        job.schedule_next(time.monotonic())
+        with self._lock:
+            self.jobs[name] = job
+        return job
+
+    def run_pending(self, is_leader=True):
+        """Submit every due job and report running jobs that have become slow"""
+        now = time.monotonic()
+        with self._lock:
+            for job in self.jobs.values():
+                if job.leader_only and not is_leader:
+                    # Another process owns this job; stay due so it starts promptly if we take over
+                    continue
+                if job.running:
+                    if (job.slow_after and not job.reported_slow and job.started
+                            and now - job.started > job.slow_after):
+                        job.reported_slow = True
+                        logger.error(f"Job {job.name} has been running for over {job.slow_after}s")
+                    if now >= job.next_run:
+                        job.counts['skipped'] += 1
+                        JOB_RUNS.labels(job.name, 'skipped').inc()
+                        logger.warning(f"Job {job.name} still running, skipping this run")
+                        job.schedule_next(now)
+                    continue
+                if now >= job.next_run:
+                    due = job.next_run
+                    job.running = True
+                    job.reported_slow = False
+                    job.started = None
+                    job.schedule_next(now)
+                    self._executor.submit(self._run, job, due)
+
+    def run_now(self, name):
+        """Run a job immediately (unless it is already running); returns False if it was"""
+        with self._lock:
+            job = self.jobs[name]
+            if job.running:
+                return False
+            job.running = True
+            job.reported_slow = False
+            job.started = None
+        self._executor.submit(self._run, job, time.monotonic())
+        return True
+
+    def trigger(self, name):
+        """
+        Run a job as soon as possible: now if it is idle, otherwise once more right
+        after the current run ends (work that arrives mid-run is not left for the next
+        interval). Triggers arriving during a run are coalesced into one rerun.
+        """
+        with self._lock:
+            job = self.jobs[name]
+            job.counts['triggered'] += 1
+            if job.running:
+                job.rerun = True
+                return
+            job.running = True
+            job.reported_slow = False
+            job.started = None
+        self._executor.submit(self._run, job, time.monotonic())
+
+    def _run(self, job, due):
+        start = time.monotonic()
+        with self._lock:
+            job.started = start
+        outcome, error = 'success', None
+        try:
+            job.func()
+        except Exception as e:
+            outcome, error = 'error', str(e)
+            logger.error(f"Job {job.name} failed: {e}")
+        duration = time.monotonic() - start
+
+        slow = bool(job.slow_after and duration > job.slow_after)
+        with self._lock:
+            job.counts[outcome] += 1
+            if slow:
+                job.counts['slow'] += 1
+            JOB_DURATION.labels(job.name).observe(duration)
+            JOB_RUNS.labels(job.name, outcome).inc()
+            job.history.append({
+                'started_at': datetime.now().isoformat(timespec='seconds'),
+                'duration': round(duration, 3),
+                'lateness': round(max(0.0, start - due), 3),
+                'outcome': outcome,
+                'slow': slow,
+                'error': error,
+            })
+            rerun = job.rerun and not self._stop.is_set()
+            job.rerun = False
+            job.reported_slow = False
+            job.started = None
+            job.running = rerun
+
+        if rerun:
+            self._executor.submit(self._run, job, time.monotonic())
+
+    def run_forever(self, is_leader=None):
+        """
+        Scheduler loop; returns after stop()
+
+        is_leader: Callable saying whether this process currently holds scheduler
+        leadership (default: always)
+        """
+        logger.info(f"Starting job runner with {self.max_workers} workers...")
+        while not self._stop.is_set():
+            self.run_pending(is_leader() if is_leader else True)
+            self._stop.wait(self.tick)
+
+    def stop(self, wait=False):
+        self._stop.set()
+        self._executor.shutdown(wait=wait)
+
+    def stats(self, history=10):
+        """Per-job counters, timings and recent run history for /api/jobs"""
+        with self._lock:
+            return {name: job.summary(history) for name, job in self.jobs.items()}
@@ -0,0 +1,173 @@
+"""
+Scheduler Leader Election
+Makes exactly one process own the scheduled jobs when the API runs as several
+worker processes (gunicorn) or containers
+
+Every process runs a LeaderElection that keeps trying to take a lock:
+- DatabaseLock: a MySQL/MariaDB named lock (GET_LOCK) on a dedicated connection;
+  works across hosts, and the server frees it as soon as the holder's connection
+  drops, so a dead leader is replaced within one retry interval
+- FileLock: an flock() on a local file, for single-host setups
+"""
+
+import fcntl
+import logging
+import os
+import threading
+from datetime import datetime
+
+import mysql.connector
+
+logger = logging.getLogger(__name__)
+
+
+class DatabaseLock:
+    """MySQL named lock held by a dedicated (non-pooled) connection"""
+
+    def __init__(self, db_config, name='nextscript_scheduler', connect=None):
+        self.db_config = db_config
+        self.name = name
+        self._connect = connect or mysql.connector.connect
+        self._conn = None
+
+    def __str__(self):
+        return f"db:{self.name}"
+
+    def _query(self, sql):
+        if self._conn is None:
+            self._conn = self._connect(**self.db_config)
+        cursor = self._conn.cursor()
+        try:
+            cursor.execute(sql, (self.name,))
+            return cursor.fetchone()[0]
+        finally:
+            cursor.close()
+
+    def acquire(self):
+        """Try to take the lock without waiting"""
+        try:
+            return self._query("SELECT GET_LOCK(%s, 0)") == 1
+        except Exception as e:
+            logger.warning(f"Could not try scheduler lock {self}: {e}")
+            self._disconnect()
+            return False
+
+    def held(self):
+        """Check the lock is still ours (it is lost if the connection dropped)"""
+        try:
+            return self._query("SELECT IS_USED_LOCK(%s) = CONNECTION_ID()") == 1
+        except Exception as e:
+            logger.warning(f"Lost connection holding scheduler lock {self}: {e}")
+            self._disconnect()
+            return False
+
+    def release(self):
+        try:
+            if self._conn is not None:
+                self._query("SELECT RELEASE_LOCK(%s)")
+        except Exception:
+            pass
+        self._disconnect()
+
+    def _disconnect(self):
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except Exception:
+                pass
+            self._conn = None
+
+
+class FileLock:
+    """Exclusive flock() on a file shared by all processes on the host"""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def __str__(self):
+        return f"file:{self.path}"
+
+    def acquire(self):
+        lock_file = open(self.path, 'a+')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        lock_file.seek(0)
+        lock_file.truncate()
+        lock_file.write(f"{os.getpid()}\n")
+        lock_file.flush()
+        self._file = lock_file
+        return True
+
+    def held(self):
+        # flock() locks stay with the open file until it is closed or the process exits
+        return self._file is not None
+
+    def release(self):
+        if self._file is not None:
+            try:
+                fcntl.flock(self._file, fcntl.LOCK_UN)
+            finally:
+                self._file.close()
+                self._file = None
+
+
+class LeaderElection:
+    """
+    Background thread that takes the lock when it is free and keeps checking it
+
+    is_leader is True while this process holds the lock.
+    """
+
+    def __init__(self, lock, interval=15):
+        self.lock = lock
+        self.interval = interval
+        self.is_leader = False
+        self.elected_at = None
+        self.terms = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def check(self):
+        """One election round: verify leadership, or try to take it"""
+        if self.is_leader:
+            if not self.lock.held():
+                self.is_leader = False
+                self.elected_at = None
+                logger.warning(f"❌ Lost scheduler leadership ({self.lock})")
+        elif self.lock.acquire():
+            self.is_leader = True
+            self.elected_at = datetime.now().isoformat(timespec='seconds')
+            self.terms += 1
+            logger.info(f"✅ Process {os.getpid()} is now the scheduler leader ({self.lock})")
+        return self.is_leader
+
+    def run(self):
+        while not self._stop.is_set():
+            try:
+                self.check()
+            except Exception as e:
+                logger.error(f"Scheduler leader election failed: {e}")
+            self._stop.wait(self.interval)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, name='leader-election', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self.is_leader:
+            self.lock.release()
+            self.is_leader = False
+
+    def status(self):
+        return {
+            'pid': os.getpid(),
+            'leader': self.is_leader,
+            'lock': str(self.lock),
+            'elected_at': self.elected_at,
+            'terms': self.terms
+        }
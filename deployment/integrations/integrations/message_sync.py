@@ -0,0 +1,171 @@
+"""
+Message Store Sync
+Incremental, resumable walk of the RingCentral message store, driven by a
+creationTime cursor kept in system_config
+
+Each sync lists the window [cursor, start of sync] page by page (newest first) and
+hands every page to the caller. A page counts as done when the caller asks for
+the next one; the window's upper bound is then narrowed to the oldest message on
+that page and saved, so a sync that dies part way resumes where it stopped
+instead of listing the whole window again. When the walk finishes, the cursor
+moves to the newest creationTime seen, less a small overlap for messages that
+show up in the store late. Callers dedup by message id, so overlap only costs a
+re-listing, never a duplicate.
+
+A message the caller could not handle (e.g. its download failed) can be held:
+the cursor then stops at its creationTime, so the next sync lists it again. Each
+message can be held by at most max_attempts syncs in a row; after that hold()
+refuses, and the caller records it as failed so the cursor can move on.
+"""
+
+import json
+import logging
+from datetime import datetime, timedelta, timezone
+
+logger = logging.getLogger(__name__)
+
+
+def parse_time(value):
+    """Parse a RingCentral timestamp (or an older naive local isoformat cursor) to aware UTC"""
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    return parsed.astimezone(timezone.utc)
+
+
+def format_time(value):
+    """Format as RingCentral does, e.g. 2026-01-01T12:00:00.000Z"""
+    return value.astimezone(timezone.utc).isoformat(timespec='milliseconds').replace('+00:00', 'Z')
+
+
+class MessageStoreSync:
+    """Pages through the message store from a cursor saved under cursor_key"""
+
+    def __init__(self, db_pool, fetch_pages, cursor_key, page_size=100, overlap=300, initial_days=7,
+                 max_attempts=5):
+        """
+        Args:
+            db_pool: Connection pool (db_pool.ConnectionPool)
+            fetch_pages: fetch_pages(date_from, date_to, page_size) yields lists of
+                records, newest first (e.g. RingCentralService.iter_inbound_faxes)
+            cursor_key: system_config key of the cursor; an unfinished sync is kept
+                under cursor_key + '_sync'
+            page_size: Records per message-store request
+            overlap: Seconds the cursor stays behind the newest message seen
+            initial_days: How far back the first sync reaches
+            max_attempts: Syncs a message may be held for before hold() gives up
+                (attempt counts are kept under cursor_key + '_holds')
+        """
+        self.db_pool = db_pool
+        self.fetch_pages = fetch_pages
+        self.cursor_key = cursor_key
+        self.state_key = f"{cursor_key}_sync"
+        self.holds_key = f"{cursor_key}_holds"
+        self.page_size = page_size
+        self.overlap = timedelta(seconds=overlap)
+        self.initial_days = initial_days
+        self.max_attempts = max_attempts
+        self._held = {}  # message id -> creationTime, for this sync
+        self._attempts = {}  # message id -> syncs that held it before this one
+
+    def _load(self, *keys):
+        db = self.db_pool.get_connection()
+        try:
+            cursor = db.cursor()
+            cursor.execute(f"""
+                SELECT config_key, config_value
+                FROM system_config
+                WHERE config_key IN ({', '.join(['%s'] * len(keys))})
+            """, keys)
+            values = dict(cursor.fetchall())
+            cursor.close()
+            return values
+        finally:
+            db.close()
+
+    def _save(self, values, delete=()):
+        """Upsert and delete system_config keys in one transaction"""
+        db = self.db_pool.get_connection()
+        try:
+            db.start_transaction()
+            cursor = db.cursor()
+            for key, value in values.items():
+                cursor.execute("""
+                    INSERT INTO system_config (config_key, config_value)
+                    VALUES (%s, %s)
+                    ON DUPLICATE KEY UPDATE config_value = %s
+                """, (key, value, value))
+            for key in delete:
+                cursor.execute("DELETE FROM system_config WHERE config_key = %s", (key,))
+            db.commit()
+            cursor.close()
+        finally:
+            db.close()
+
+    def _start(self):
+        """The window to walk: resumed from an unfinished sync, or a new one"""
+        stored = self._load(self.cursor_key, self.state_key, self.holds_key)
+        self._attempts = json.loads(stored.get(self.holds_key) or '{}')
+        if stored.get(self.state_key):
+            state = json.loads(stored[self.state_key])
+            logger.info(f"Resuming {self.cursor_key} sync: {state['date_from']} to {state['date_to']}")
+            return state
+
+        cursor = stored.get(self.cursor_key)
+        if cursor:
+            date_from = format_time(parse_time(cursor))
+        else:
+            # First sync
+            date_from = format_time(datetime.now(timezone.utc) - timedelta(days=self.initial_days))
+        # Pinning the upper bound keeps pages stable while new messages arrive
+        return {'date_from': date_from, 'date_to': format_time(datetime.now(timezone.utc)),
+                'newest': None, 'held': {}}
+
+    def hold(self, record):
+        """
+        Keep the cursor at or before this record, so the next sync lists it again
+
+        Returns False, holding nothing, once the record has already been held by
+        max_attempts syncs; the caller should then give up on it.
+        """
+        message_id = str(record['id'])
+        attempts = self._attempts.get(message_id, 0) + 1
+        if attempts > self.max_attempts:
+            logger.error(f"Giving up on message {message_id} ({record.get('creationTime')}) "
+                         f"after {self.max_attempts} attempts; {self.cursor_key} moves past it")
+            return False
+        if record.get('creationTime'):
+            self._held[message_id] = record['creationTime']
+        return True
+
+    def pages(self):
+        """
+        Yield the window's records page by page, newest first
+
+        Checkpoints after each page the caller has finished with, and moves the
+        cursor when the last page is done. Abandoning the generator (or an error)
+        leaves the sync to be resumed by the next call.
+        """
+        state = self._start()
+        self._held = state['held']
+
+        for page in self.fetch_pages(state['date_from'], state['date_to'], self.page_size):
+            if not page:
+                continue
+            yield page
+
+            times = [record['creationTime'] for record in page if record.get('creationTime')]
+            if times:
+                state['newest'] = max([state['newest'] or times[0]] + times)
+                # Inclusive bound: a message on the page boundary is listed again, and deduped
+                state['date_to'] = min(times)
+            state['held'] = self._held
+            self._save({self.state_key: json.dumps(state)})
+
+        cursor = parse_time(state['newest'] or state['date_to']) - self.overlap
+        if self._held:
+            cursor = min(cursor, parse_time(min(self._held.values())))
+        cursor = format_time(max(parse_time(state['date_from']), cursor))
+
+        # Attempt counts carry over only for messages held again by this sync
+        holds = {message_id: self._attempts.get(message_id, 0) + 1 for message_id in self._held}
+        self._save({self.cursor_key: cursor, self.holds_key: json.dumps(holds)}, delete=[self.state_key])
+        logger.info(f"{self.cursor_key} sync complete, cursor now {cursor}")
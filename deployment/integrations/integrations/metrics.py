@@ -0,0 +1,85 @@
+"""
+Metrics
+Prometheus metrics for the integration service, exposed on /metrics
+
+Metrics are module-level prometheus_client objects that services update directly, e.g.
+    FAXES_SENT.inc()
+    with EXTERNAL_LATENCY.labels(service='ocean', operation='post').time():
+        ...
+
+Under gunicorn every worker is a separate process, so gunicorn.conf.py sets
+PROMETHEUS_MULTIPROC_DIR: each process then writes its samples to files in that
+directory and render() aggregates all of them, whichever worker serves the scrape.
+"""
+
+import os
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, disable_created_metrics,
+    generate_latest, multiprocess
+)
+
+CONTENT_TYPE = CONTENT_TYPE_LATEST
+
+# No *_created samples: they double the exposition for little use here
+disable_created_metrics()
+
+# Callables run before every scrape (e.g. to refresh gauges from the DB)
+_collectors = []
+
+
+def add_collector(collector):
+    """Register a callable run before every scrape"""
+    _collectors.append(collector)
+
+
+def render():
+    """Exposition text for all metrics, across worker processes in multiprocess mode"""
+    for collector in _collectors:
+        collector()
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry)
+
+
+# ===== Integration metrics =====
+
+FAXES_POLLED = Counter('integration_faxes_polled_total', 'Inbound faxes returned by RingCentral polls')
+FAXES_RECEIVED = Counter('integration_faxes_received_total', 'Inbound faxes downloaded and filed in OSCAR')
+FAXES_SENT = Counter('integration_faxes_sent_total', 'Outbound faxes accepted by RingCentral')
+FAXES_FAILED = Counter('integration_faxes_failed_total', 'Failed fax operations', ['direction'])
+FAX_POLL_THROUGHPUT = Gauge('integration_fax_poll_faxes_per_minute', 'Inbound faxes filed per minute in the last poll',
+                            multiprocess_mode='mostrecent')
+FAX_TRANSFER_BYTES = Histogram('integration_fax_transfer_bytes', 'Size of fax documents downloaded or uploaded',
+                               ['direction'], buckets=tuple(2 ** n for n in range(15, 28)))
+FAX_TRANSFER_RATE = Histogram('integration_fax_transfer_bytes_per_second', 'Fax document transfer throughput',
+                              ['direction'], buckets=tuple(2 ** n for n in range(14, 27)))
+SMS_SENT = Counter('integration_sms_sent_total', 'SMS messages accepted by RingCentral')
+SMS_FAILED = Counter('integration_sms_failed_total', 'SMS messages RingCentral did not accept')
+LABS_IMPORTED = Counter('integration_labs_imported_total', 'Lab result files imported into OSCAR')
+
+# Read from the database at scrape time, so the latest value from any process is right
+QUEUE_DEPTH = Gauge('integration_queue_depth', 'Pending rows in the outbound queues', ['queue'],
+                    multiprocess_mode='mostrecent')
+QUEUE_WAKEUPS = Counter('integration_queue_wakeups_total', 'Enqueue notifications sent to the queue senders',
+                        ['queue'])
+QUEUE_LATENCY = Histogram('integration_queue_latency_seconds', 'Time from enqueue (or scheduled time) to send',
+                          ['queue'], buckets=(0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 900, 3600))
+
+EXTERNAL_LATENCY = Histogram('integration_external_request_seconds', 'External API call latency',
+                             ['service', 'operation'])
+DB_QUERY_LATENCY = Histogram('integration_db_query_seconds', 'Database statement latency', ['statement'])
+DB_POOL_CONNECTIONS = Gauge('integration_db_pool_connections', 'Database pool connections', ['state'],
+                            multiprocess_mode='livesum')
+
+JOB_DURATION = Histogram('integration_job_duration_seconds', 'Scheduled job run duration', ['job'])
+JOB_RUNS = Counter('integration_job_runs_total', 'Scheduled job runs by outcome', ['job', 'outcome'])
+
+
+def statement_type(sql):
+    """Label for a SQL statement: its leading keyword (select, insert, update, ...)"""
+    words = sql.split(None, 1)
+    return words[0].lower() if words else 'unknown'
@@ -5,42 +5,89 @@ Handles electronic specialist referrals via OceanMD
 
 import logging
 import requests
-import mysql.connector
 from datetime import datetime
 import json
 
+from integrations.metrics import EXTERNAL_LATENCY
+
 logger = logging.getLogger(__name__)
 
 class OceanService:
-    def __init__(self, config, db_config):
+    # Queries shared with the asyncio variant (async_services.AsyncOceanService)
+    PATIENT_SQL = """
+                SELECT first_name, last_name, hin, ver, sex, year_of_birth,
+                       month_of_birth, date_of_birth, phone, email
+                FROM demographic
+                WHERE demographic_no = %s
+            """
+    PROVIDER_SQL = """
+                SELECT first_name, last_name, practitioner_no, phone
+                FROM provider
+                WHERE provider_no = (
+                    SELECT provider_no FROM demographic
+                    WHERE demographic_no = %s
+                )
+            """
+    SPECIALIST_SQL = """
+                    SELECT first_name, last_name, specialty, fax_number
+                    FROM professionalSpecialists
+                    WHERE specialist_no = %s
+                """
+    INSERT_REFERRAL_SQL = """
+                    INSERT INTO ocean_referrals (
+                        patient_id, specialist_id, ocean_referral_id,
+                        reason, priority, clinical_info,
+                        status, created_at
+                    ) VALUES (%s, %s, %s, %s, %s, %s, 'sent', %s)
+                """
+    LINK_CONSULTATION_SQL = """
+                    UPDATE consultationRequests
+                    SET referralNo = %s,
+                        status = 'sent via Ocean'
+                    WHERE demographicId = %s
+                    AND status = 'pending'
+                    ORDER BY referalDate DESC
+                    LIMIT 1
+                """
+
+    def __init__(self, config, db_pool):
+        """
+        config keys: site_id, api_key
+        (optional: api_base, default the production API; point it at a stub server for testing)
+        """
         self.config = config
-        self.db_config = db_config
-        self.api_base = 'https://ocean.cognisantmd.com/api/v1'
+        self.db_pool = db_pool
+        self.api_base = config.get('api_base', 'https://ocean.cognisantmd.com/api/v1')
         self.site_id = config['site_id']
         self.api_key = config['api_key']
 
     def get_db_connection(self):
-        """Get database connection"""
-        return mysql.connector.connect(**self.db_config)
+        """Borrow a connection from the shared pool (close() returns it)"""
+        return self.db_pool.get_connection()
+
+    def request_headers(self):
+        """Headers for an authenticated Ocean API request"""
+        return {
+            'Authorization': f'Bearer {self.api_key}',
+            'Content-Type': 'application/json',
+            'X-Site-ID': self.site_id
+        }
 
     def _make_request(self, method, endpoint, data=None):
         """Make authenticated API request to Ocean"""
         try:
             url = f"{self.api_base}/{endpoint}"
-            headers = {
-                'Authorization': f'Bearer {self.api_key}',
-                'Content-Type': 'application/json',
-                'X-Site-ID': self.site_id
-            }
-
-            if method == 'GET':
-                response = requests.get(url, headers=headers, timeout=30)
-            elif method == 'POST':
-                response = requests.post(url, headers=headers, json=data, timeout=30)
-            elif method == 'PUT':
-                response = requests.put(url, headers=headers, json=data, timeout=30)
-            else:
-                raise ValueError(f"Unsupported method: {method}")
+            headers = self.request_headers()
+
+            with EXTERNAL_LATENCY.labels('ocean', method.lower()).time():
+                if method == 'GET':
+                    response = requests.get(url, headers=headers, timeout=30)
+                elif method == 'POST':
+                    response = requests.post(url, headers=headers, json=data, timeout=30)
+                elif method == 'PUT':
+                    response = requests.put(url, headers=headers, json=data, timeout=30)
+                else:
+                    raise ValueError(f"Unsupported method: {method}")
 
             response.raise_for_status()
             return {
@@ -81,73 +128,26 @@ class OceanService:
             db = self.get_db_connection()
             cursor = db.cursor(dictionary=True)
 
-            cursor.execute("""
-                SELECT first_name, last_name, hin, ver, sex, year_of_birth,
-                       month_of_birth, date_of_birth, phone, email
-                FROM demographic
-                WHERE demographic_no = %s
-            """, (patient_id,))
+            cursor.execute(self.PATIENT_SQL, (patient_id,))
 
             patient = cursor.fetchone()
 
             if not patient:
+                cursor.close()
+                db.close()
                 return {'success': False, 'error': 'Patient not found'}
 
             # Get provider info
-            cursor.execute("""
-                SELECT first_name, last_name, practitioner_no, phone
-                FROM provider
-                WHERE provider_no = (
-                    SELECT provider_no FROM demographic
-                    WHERE demographic_no = %s
-                )
-            """, (patient_id,))
+            cursor.execute(self.PROVIDER_SQL, (patient_id,))
 
             provider = cursor.fetchone()
 
-            # Build Ocean referral request
-            ocean_request = {
-                'patient': {
-                    'firstName': patient['first_name'],
-                    'lastName': patient['last_name'],
-                    'healthNumber': patient['hin'],
-                    'versionCode': patient['ver'],
-                    'sex': patient['sex'],
-                    'dateOfBirth': f"{patient['year_of_birth']}-{patient['month_of_birth']:02d}-{patient['date_of_birth']:02d}",
-                    'phone': patient.get('phone'),
-                    'email': patient.get('email')
-                },
-                'referral': {
-                    'reason': reason,
-                    'priority': priority,
-                    'clinicalInformation': clinical_info,
-                    'urgency': priority
-                },
-                'provider': {
-                    'firstName': provider['first_name'] if provider else '',
-                    'lastName': provider['last_name'] if provider else '',
-                    'licenseNumber': provider['practitioner_no'] if provider else '',
-                    'phone': provider['phone'] if provider else ''
-                }
-            }
-
-            # Add specialist if specified
+            specialist = None
             if specialist_id:
-                cursor.execute("""
-                    SELECT first_name, last_name, specialty, fax_number
-                    FROM professionalSpecialists
-                    WHERE specialist_no = %s
-                """, (specialist_id,))
-
+                cursor.execute(self.SPECIALIST_SQL, (specialist_id,))
                 specialist = cursor.fetchone()
 
-                if specialist:
-                    ocean_request['specialist'] = {
-                        'firstName': specialist['first_name'],
-                        'lastName': specialist['last_name'],
-                        'specialty': specialist['specialty'],
-                        'fax': specialist.get('fax_number')
-                    }
+            ocean_request = self.build_ocean_request(referral_data, patient, provider, specialist)
 
             # Send to Ocean
             result = self._make_request('POST', 'referrals', ocean_request)
@@ -156,27 +156,13 @@ class OceanService:
                 ocean_referral_id = result['data'].get('id')
 
                 # Log in database
-                cursor.execute("""
-                    INSERT INTO ocean_referrals (
-                        patient_id, specialist_id, ocean_referral_id,
-                        reason, priority, clinical_info,
-                        status, created_at
-                    ) VALUES (%s, %s, %s, %s, %s, %s, 'sent', %s)
-                """, (
+                cursor.execute(self.INSERT_REFERRAL_SQL, (
                     patient_id, specialist_id, ocean_referral_id,
                     reason, priority, clinical_info, datetime.now()
                 ))
 
                 # Link to OSCAR consultation request if it exists
-                cursor.execute("""
-                    UPDATE consultationRequests
-                    SET referralNo = %s,
-                        status = 'sent via Ocean'
-                    WHERE demographicId = %s
-                    AND status = 'pending'
-                    ORDER BY referalDate DESC
-                    LIMIT 1
-                """, (ocean_referral_id, patient_id))
+                cursor.execute(self.LINK_CONSULTATION_SQL, (ocean_referral_id, patient_id))
 
                 db.commit()
 
@@ -184,7 +170,7 @@ class OceanService:
 
                 # Handle attachments if any
                 if attachments and ocean_referral_id:
-                    self._upload_attachments(ocean_referral_id, attachments)
+                    self.upload_attachments(ocean_referral_id, attachments)
 
                 cursor.close()
                 db.close()
@@ -204,7 +190,46 @@ class OceanService:
             logger.error(f"Error creating Ocean referral: {e}")
             return {'success': False, 'error': str(e)}
 
-    def _upload_attachments(self, referral_id, attachments):
+    def build_ocean_request(self, referral_data, patient, provider, specialist=None):
+        """Build the Ocean referral request from OSCAR demographic, provider and specialist rows"""
+        priority = referral_data.get('priority', 'routine')
+        ocean_request = {
+            'patient': {
+                'firstName': patient['first_name'],
+                'lastName': patient['last_name'],
+                'healthNumber': patient['hin'],
+                'versionCode': patient['ver'],
+                'sex': patient['sex'],
+                'dateOfBirth': f"{patient['year_of_birth']}-{patient['month_of_birth']:02d}-{patient['date_of_birth']:02d}",
+                'phone': patient.get('phone'),
+                'email': patient.get('email')
+            },
+            'referral': {
+                'reason': referral_data['reason'],
+                'priority': priority,
+                'clinicalInformation': referral_data.get('clinical_info', ''),
+                'urgency': priority
+            },
+            'provider': {
+                'firstName': provider['first_name'] if provider else '',
+                'lastName': provider['last_name'] if provider else '',
+                'licenseNumber': provider['practitioner_no'] if provider else '',
+                'phone': provider['phone'] if provider else ''
+            }
+        }
+
+        # Add specialist if specified
+        if specialist:
+            ocean_request['specialist'] = {
+                'firstName': specialist['first_name'],
+                'lastName': specialist['last_name'],
+                'specialty': specialist['specialty'],
+                'fax': specialist.get('fax_number')
+            }
+
+        return ocean_request
+
+    def upload_attachments(self, referral_id, attachments):
         """Upload attachments to Ocean referral"""
         try:
             for attachment in attachments:
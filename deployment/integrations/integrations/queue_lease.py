@@ -0,0 +1,192 @@
+"""
+Queue Leases
+Claim/lease protocol that lets several service instances work the outbound queues
+(fax_queue, sms_queue) without sending a row twice
+
+1. claim(): a worker atomically claims up to N due rows by stamping them with a
+   claim token (worker id + sequence) and a lease expiry. On MySQL 8 / MariaDB
+   10.6+ the rows are picked with SELECT ... FOR UPDATE SKIP LOCKED, so concurrent
+   claimers skip each other's rows instead of queueing behind them; older servers
+   use a single UPDATE ... ORDER BY ... LIMIT.
+2. start_send(): right before the external call, the worker moves the row from
+   'pending' to 'sending', but only while its claim token is still on the row. A
+   worker whose lease expired and was reclaimed by someone else updates nothing
+   and skips the row.
+3. A lease that expires before its row reaches 'sending' (worker crashed or fell
+   behind) makes the row claimable again. Rows left in 'sending' may or may not
+   have reached RingCentral, so fail_interrupted() fails them for review instead.
+
+All lease times use the database clock, so instances need not agree on the time.
+"""
+
+import itertools
+import logging
+import os
+import re
+import socket
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# One id per process, unique across hosts and container restarts
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+# Claim tokens are WORKER_ID plus this sequence, so they stay unique even when
+# several QueueLease instances (e.g. before and after a reload) share the process
+_claim_sequence = itertools.count(1)
+
+
+def supports_skip_locked(version):
+    """True if a SELECT VERSION() string is MySQL >= 8.0.1 or MariaDB >= 10.6"""
+    match = re.match(r'(\d+)\.(\d+)\.(\d+)', version or '')
+    if not match:
+        return False
+    release = tuple(int(part) for part in match.groups())
+    if 'mariadb' in version.lower():
+        return release >= (10, 6, 0)
+    return release >= (8, 0, 1)
+
+
+class QueueLease:
+    """Claims due rows of one queue table for this worker"""
+
+    def __init__(self, db_pool, table, due_sql='', order_by='created_at ASC', lease_seconds=300,
+                 worker_id=None):
+        """
+        Args:
+            db_pool: Connection pool (db_pool.ConnectionPool)
+            table: Queue table (fax_queue or sms_queue)
+            due_sql: Extra WHERE condition for rows that are ready to send
+            order_by: Claim order
+            lease_seconds: How long a claim excludes other workers
+            worker_id: Defaults to WORKER_ID
+        """
+        self.db_pool = db_pool
+        self.table = table
+        self.order_by = order_by
+        self.lease_seconds = lease_seconds
+        self.worker_id = worker_id or WORKER_ID
+        self._due = f"""
+                status = 'pending'
+                AND (retry_count < 3 OR retry_count IS NULL)
+                AND (lease_expires_at IS NULL OR lease_expires_at < NOW())
+                {due_sql}
+        """
+        self._skip_locked = None
+
+    def _uses_skip_locked(self, cursor):
+        if self._skip_locked is None:
+            cursor.execute("SELECT VERSION()")
+            row = cursor.fetchone()
+            version = str(list(row.values())[0] if isinstance(row, dict) else row[0])
+            self._skip_locked = supports_skip_locked(version)
+            logger.info(f"{self.table}: claiming rows with "
+                        f"{'SKIP LOCKED' if self._skip_locked else 'UPDATE ... LIMIT'} (server {version})")
+        return self._skip_locked
+
+    def pending_count(self):
+        """Rows that are due and not leased by anyone"""
+        db = self.db_pool.get_connection()
+        try:
+            cursor = db.cursor()
+            cursor.execute(f"SELECT COUNT(*) FROM {self.table} WHERE {self._due}")
+            count = cursor.fetchone()[0]
+            cursor.close()
+            return count
+        finally:
+            db.close()
+
+    def claim(self, limit):
+        """Claim up to limit due rows; returns them (as dicts, with their claim token in claimed_by)"""
+        if limit <= 0:
+            return []
+
+        token = f"{self.worker_id}:{next(_claim_sequence)}"
+        db = self.db_pool.get_connection()
+        try:
+            cursor = db.cursor(dictionary=True)
+            if self._uses_skip_locked(cursor):
+                # Row locks from FOR UPDATE only last until commit (the pool autocommits)
+                db.start_transaction()
+                cursor.execute(f"""
+                    SELECT id FROM {self.table}
+                    WHERE {self._due}
+                    ORDER BY {self.order_by}
+                    LIMIT %s
+                    FOR UPDATE SKIP LOCKED
+                """, (limit,))
+                ids = [row['id'] for row in cursor.fetchall()]
+                if ids:
+                    cursor.execute(f"""
+                        UPDATE {self.table}
+                        SET claimed_by = %s,
+                            lease_expires_at = DATE_ADD(NOW(), INTERVAL %s SECOND)
+                        WHERE id IN ({', '.join(['%s'] * len(ids))})
+                    """, (token, self.lease_seconds, *ids))
+            else:
+                cursor.execute(f"""
+                    UPDATE {self.table}
+                    SET claimed_by = %s,
+                        lease_expires_at = DATE_ADD(NOW(), INTERVAL %s SECOND)
+                    WHERE {self._due}
+                    ORDER BY {self.order_by}
+                    LIMIT %s
+                """, (token, self.lease_seconds, limit))
+            db.commit()
+
+            cursor.execute(f"SELECT * FROM {self.table} WHERE claimed_by = %s ORDER BY {self.order_by}", (token,))
+            rows = cursor.fetchall()
+            cursor.close()
+            return rows
+        finally:
+            db.close()
+
+    def start_send(self, cursor, row):
+        """
+        Move a claimed row to 'sending' if this worker still holds it
+
+        The caller must commit before making the external call. Returns False if the
+        lease was lost (the row was reclaimed by another worker).
+        """
+        cursor.execute(f"""
+            UPDATE {self.table}
+            SET status = 'sending',
+                send_started_at = NOW()
+            WHERE id = %s AND claimed_by = %s AND status = 'pending'
+        """, (row['id'], row['claimed_by']))
+        return cursor.rowcount == 1
+
+    def release(self, row):
+        """Give up a claim without sending, so any worker can claim the row right away"""
+        db = self.db_pool.get_connection()
+        try:
+            cursor = db.cursor()
+            cursor.execute(f"""
+                UPDATE {self.table}
+                SET claimed_by = NULL,
+                    lease_expires_at = NULL
+                WHERE id = %s AND claimed_by = %s AND status = 'pending'
+            """, (row['id'], row['claimed_by']))
+            db.commit()
+            cursor.close()
+        finally:
+            db.close()
+
+    def fail_interrupted(self, stale_seconds):
+        """Fail rows stuck in 'sending' for longer than stale_seconds; returns how many"""
+        db = self.db_pool.get_connection()
+        try:
+            cursor = db.cursor()
+            cursor.execute(f"""
+                UPDATE {self.table}
+                SET status = 'failed',
+                    last_error = 'Interrupted during send; check RingCentral before resending'
+                WHERE status = 'sending'
+                AND send_started_at < DATE_SUB(NOW(), INTERVAL %s SECOND)
+            """, (stale_seconds,))
+            interrupted = cursor.rowcount
+            db.commit()
+            cursor.close()
+            return interrupted
+        finally:
+            db.close()
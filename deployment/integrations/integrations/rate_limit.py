@@ -0,0 +1,117 @@
+"""
+Rate Limiting
+Token buckets used to pace calls to rate-limited external APIs: TokenBucket for
+one process, SharedTokenBucket for a limit shared by every worker through the
+database
+"""
+
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    Token bucket: up to capacity calls at once, refilled at rate calls per second
+
+    acquire() blocks until a token is available; refund() returns one that went
+    unused. pause() empties the bucket for a while, e.g. when the API answers 429
+    with a Retry-After.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(1.0, rate))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def per_minute(cls, calls, capacity=None):
+        return cls(calls / 60.0, capacity if capacity is not None else calls)
+
+    def _update(self, take):
+        """Refill, then apply take(tokens) -> (new token count, result); returns result"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens, result = take(self._tokens)
+            return result
+
+    def acquire(self, timeout=None):
+        """Take one token, waiting for it if needed; returns False if timeout expires first"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            # Seconds until a token is due, or 0 once one was taken
+            wait = self._update(lambda tokens: (tokens - 1, 0) if tokens >= 1 else (tokens, (1 - tokens) / self.rate))
+            if not wait:
+                return True
+            if deadline is not None and time.monotonic() + wait > deadline:
+                return False
+            time.sleep(wait)
+
+    def refund(self):
+        """Give back a token taken by acquire() for a call that was never made"""
+        self._update(lambda tokens: (min(self.capacity, tokens + 1), None))
+
+    def pause(self, seconds):
+        """Hand out no tokens for the next seconds"""
+        self._update(lambda tokens: (min(tokens, 0.0) - seconds * self.rate, None))
+
+    def available_within(self, seconds):
+        """How many tokens can be acquired within seconds from now"""
+        return self._update(lambda tokens: (tokens, max(0, int(tokens + seconds * self.rate))))
+
+
+class SharedTokenBucket(TokenBucket):
+    """
+    TokenBucket whose state is a row of the rate_limits table
+
+    Every process and host using the same name draws from one bucket, so the limit
+    holds however many workers send. Each update is a short SELECT ... FOR UPDATE
+    transaction, and the refill uses the database clock.
+    """
+
+    def __init__(self, db_pool, name, rate, capacity=None):
+        super().__init__(rate, capacity)
+        self.db_pool = db_pool
+        self.name = name
+        self._row_created = False
+
+    @classmethod
+    def per_minute(cls, db_pool, name, calls, capacity=None):
+        return cls(db_pool, name, calls / 60.0, capacity if capacity is not None else calls)
+
+    def _update(self, take):
+        db = self.db_pool.get_connection()
+        try:
+            cursor = db.cursor()
+            if not self._row_created:
+                cursor.execute("""
+                    INSERT IGNORE INTO rate_limits (name, tokens, updated_at)
+                    VALUES (%s, %s, UNIX_TIMESTAMP(NOW(6)))
+                """, (self.name, self.capacity))
+                db.commit()
+                self._row_created = True
+
+            db.start_transaction()
+            cursor.execute("""
+                SELECT tokens, UNIX_TIMESTAMP(NOW(6)) - updated_at
+                FROM rate_limits
+                WHERE name = %s
+                FOR UPDATE
+            """, (self.name,))
+            tokens, elapsed = cursor.fetchone()
+            tokens = min(self.capacity, float(tokens) + max(0.0, float(elapsed)) * self.rate)
+            tokens, result = take(tokens)
+            cursor.execute("""
+                UPDATE rate_limits
+                SET tokens = %s, updated_at = UNIX_TIMESTAMP(NOW(6))
+                WHERE name = %s
+            """, (tokens, self.name))
+            db.commit()
+            cursor.close()
+            return result
+        finally:
+            # The pool rolls back a transaction left open by an error
+            db.close()
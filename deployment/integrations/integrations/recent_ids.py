@@ -0,0 +1,50 @@
+"""
+Recent ID Set
+Bounded, thread-safe set of recently seen external ids (e.g. RingCentral message
+ids already in fax_log), so repeat polls can skip the database lookup
+
+Holds at most maxlen ids; adding beyond that evicts the least recently seen. Only
+ids known to be stored belong here: a miss means "ask the database", never "new".
+"""
+
+import threading
+from collections import OrderedDict
+
+
+class RecentIds:
+    """LRU-bounded set of id strings"""
+
+    def __init__(self, maxlen=5000):
+        self.maxlen = maxlen
+        self.warmed = False
+        self._ids = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __contains__(self, external_id):
+        return str(external_id) in self._ids
+
+    def add(self, ids):
+        """Add (or refresh) ids, evicting the oldest past maxlen"""
+        with self._lock:
+            for external_id in ids:
+                external_id = str(external_id)
+                self._ids[external_id] = None
+                self._ids.move_to_end(external_id)
+            while len(self._ids) > self.maxlen:
+                self._ids.popitem(last=False)
+
+    def split(self, ids):
+        """Split ids into (seen, unseen) lists; seen ids are refreshed"""
+        seen, unseen = [], []
+        with self._lock:
+            for external_id in ids:
+                external_id = str(external_id)
+                if external_id in self._ids:
+                    self._ids.move_to_end(external_id)
+                    seen.append(external_id)
+                else:
+                    unseen.append(external_id)
+        return seen, unseen
@@ -3,22 +3,69 @@ RingCentral Service
 Handles authentication and API access for RingCentral fax and SMS
 """
 
+import hashlib
 import logging
+import os
+import re
+import tempfile
+import threading
+import time
+
+import requests
 from ringcentral import SDK
 
+from integrations.metrics import EXTERNAL_LATENCY, FAX_TRANSFER_BYTES, FAX_TRANSFER_RATE
+from integrations.multipart import MultipartBody
+
 logger = logging.getLogger(__name__)
 
+E164_NUMBER = re.compile(r'^\+[1-9]\d{7,14}$')
+
+# Downloaded faxes get the mode open() would give them (mkstemp creates 0600).
+# os.umask() can only be read by setting it, so do that once, before any threads start
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+FILE_MODE = 0o666 & ~_UMASK
+
 class RingCentralService:
+    SMS_PATH = '/restapi/v1.0/account/~/extension/~/sms'
+    FAX_PATH = '/restapi/v1.0/account/~/extension/~/fax'
+    MESSAGE_STORE_PATH = '/restapi/v1.0/account/~/extension/~/message-store'
+    # Fax documents are streamed to and from disk in pieces of this size
+    TRANSFER_CHUNK = 64 * 1024
+
+    @staticmethod
+    def normalize_number(number):
+        """
+        Normalize a phone or fax number to E.164
+
+        Numbers without a leading + are assumed to be North American. Raises
+        ValueError if the result is not a plausible E.164 number.
+        """
+        cleaned = re.sub(r'[\s().-]', '', str(number or ''))
+        if cleaned and not cleaned.startswith('+'):
+            cleaned = '+' + cleaned if len(cleaned) == 11 and cleaned.startswith('1') else '+1' + cleaned
+        if not E164_NUMBER.match(cleaned):
+            raise ValueError(f"Invalid phone number: {number!r}")
+        return cleaned
+
     def __init__(self, config):
         """
         Initialize RingCentral SDK
         config keys: client_id, client_secret, username, password, extension
+        (optional: server_url, default the production platform; point it at the
+        sandbox or a stub server for testing)
         """
         self.config = config
+        self.server_url = config.get('server_url', 'https://platform.ringcentral.com')
+        # Fax sends and downloads run on several threads; only one may refresh the token
+        self._auth_lock = threading.Lock()
+        # Plain HTTP (with the SDK's token) where the SDK would buffer whole documents
+        self.http = requests.Session()
         self.sdk = SDK(
             config['client_id'],
             config['client_secret'],
-            'https://platform.ringcentral.com'
+            self.server_url
         )
 
         # Login
@@ -34,103 +81,229 @@ class RingCentralService:
             logger.error(f"❌ RingCentral authentication failed: {e}")
             raise
 
+    @staticmethod
+    def rate_limit_retry_after(error, default=60):
+        """Seconds to back off if error is an HTTP 429 from the API (SDK or requests), else None"""
+        if hasattr(error, 'api_response'):
+            api_response = error.api_response()
+            response = api_response.response() if api_response else None
+        else:
+            response = getattr(error, 'response', None)
+        if response is None or response.status_code != 429:
+            return None
+        try:
+            return float(response.headers.get('Retry-After', default))
+        except (TypeError, ValueError):
+            return float(default)
+
     def get_platform(self):
         """Get authenticated platform instance"""
         # Check if token needs refresh
-        if not self.platform.logged_in():
-            self.platform.refresh()
+        with self._auth_lock:
+            if not self.platform.logged_in():
+                self.platform.refresh()
         return self.platform
 
+    def get_access_token(self):
+        """Current OAuth access token (refreshed if needed), for non-SDK HTTP clients"""
+        return self.get_platform().auth().access_token()
+
+    def sms_payload(self, to_number, message):
+        """Request body for the RingCentral SMS endpoint"""
+        return {
+            'from': {'phoneNumber': self.config.get('sms_number')},
+            'to': [{'phoneNumber': to_number}],
+            'text': message
+        }
+
     def send_fax(self, to_number, file_path, cover_text=None):
         """
         Send a fax via RingCentral
+
+        file_path: a document, or a list of them (e.g. a cover letter followed by
+        the referral), sent in order as one fax. The documents are streamed from
+        disk (see MultipartBody), so memory use does not depend on their size, and
+        every file is closed however the upload ends.
         """
+        paths = [file_path] if isinstance(file_path, str) else list(file_path)
+        body = None
         try:
-            platform = self.get_platform()
-
-            # Prepare fax request
-            files = {
-                'attachment': (file_path, open(file_path, 'rb'), 'application/pdf')
-            }
-
-            data = {
-                'to': [{'phoneNumber': to_number}],
-                'faxResolution': 'High',
-                'coverPageText': cover_text or 'Fax from NextScript EMR'
-            }
+            body = MultipartBody(
+                json_parts=[('request', {
+                    'to': [{'phoneNumber': to_number}],
+                    'faxResolution': 'High',
+                    'coverPageText': cover_text or 'Fax from NextScript EMR'
+                })],
+                files=[('attachment', path) for path in paths],
+                chunk_size=self.TRANSFER_CHUNK
+            )
 
             # Send fax
-            response = platform.post('/restapi/v1.0/account/~/extension/~/fax', files, data)
+            start = time.perf_counter()
+            with EXTERNAL_LATENCY.labels('ringcentral', 'send_fax').time():
+                with self.http.post(self.server_url + self.FAX_PATH, data=body, timeout=(10, 120), headers={
+                    'Authorization': f'Bearer {self.get_access_token()}',
+                    'Content-Type': body.content_type
+                }) as response:
+                    response.raise_for_status()
+                    fax_id = response.json().get('id')
+
+            elapsed = time.perf_counter() - start
+            FAX_TRANSFER_BYTES.labels('outbound').observe(len(body))
+            if elapsed > 0:
+                FAX_TRANSFER_RATE.labels('outbound').observe(len(body) / elapsed)
 
-            logger.info(f"✅ Fax sent to {to_number}, ID: {response.json().get('id')}")
+            logger.info(f"✅ Fax sent to {to_number}, ID: {fax_id}")
             return {
                 'success': True,
-                'fax_id': response.json().get('id'),
+                'fax_id': fax_id,
                 'status': 'queued'
             }
 
         except Exception as e:
             logger.error(f"❌ Failed to send fax: {e}")
-            return {
+            result = {
                 'success': False,
                 'error': str(e)
             }
+            retry_after = self.rate_limit_retry_after(e)
+            if retry_after is not None:
+                result.update({'rate_limited': True, 'retry_after': retry_after})
+            return result
 
-    def get_inbound_faxes(self, date_from=None):
+        finally:
+            if body is not None:
+                body.close()
+
+    def iter_inbound_faxes(self, date_from=None, date_to=None, page_size=100):
         """
-        Retrieve inbound faxes
+        Yield inbound fax records one page at a time (newest first)
+
+        Follows the message store's navigation links until the last page; errors
+        are raised to the caller.
         """
-        try:
-            platform = self.get_platform()
+        params = {
+            'messageType': 'Fax',
+            'direction': 'Inbound',
+            'readStatus': 'Unread',
+            'perPage': page_size
+        }
 
-            params = {
-                'messageType': 'Fax',
-                'direction': 'Inbound',
-                'readStatus': 'Unread'
-            }
+        if date_from:
+            params['dateFrom'] = date_from
+        if date_to:
+            params['dateTo'] = date_to
 
-            if date_from:
-                params['dateFrom'] = date_from
+        uri = self.MESSAGE_STORE_PATH
+        while uri:
+            platform = self.get_platform()
+            with EXTERNAL_LATENCY.labels('ringcentral', 'list_messages').time():
+                response = platform.get(uri, params)
+            body = response.json()
+            faxes = body.get('records', [])
+            logger.info(f"Retrieved {len(faxes)} inbound faxes (page {(body.get('paging') or {}).get('page', '?')})")
+            yield faxes
 
-            response = platform.get('/restapi/v1.0/account/~/extension/~/message-store', params)
-            faxes = response.json().get('records', [])
+            # The next page link carries the query
+            uri = ((body.get('navigation') or {}).get('nextPage') or {}).get('uri')
+            params = None
 
-            logger.info(f"Retrieved {len(faxes)} inbound faxes")
-            return faxes
+    def get_inbound_faxes(self, date_from=None):
+        """
+        Retrieve inbound faxes (all pages)
+        """
+        try:
+            return [fax for page in self.iter_inbound_faxes(date_from=date_from) for fax in page]
 
         except Exception as e:
             logger.error(f"❌ Failed to get inbound faxes: {e}")
             return []
 
-    def download_fax(self, message_id, save_path):
+    def download_fax(self, message_id, save_path, attachment_uri=None):
         """
         Download a fax attachment
+
+        Streams the attachment to a temporary file next to save_path in
+        TRANSFER_CHUNK-sized pieces (hashing as it goes), fsyncs it and renames it
+        into place, so memory use does not grow with the fax and save_path never
+        holds a partial file.
+
+        attachment_uri: URI of the attachment if the caller already has the message
+        record (from iter_inbound_faxes); saves fetching the message details
         """
         try:
             platform = self.get_platform()
 
-            # Get message details
-            response = platform.get(f'/restapi/v1.0/account/~/extension/~/message-store/{message_id}')
-            message = response.json()
+            if not attachment_uri:
+                # Get message details
+                with EXTERNAL_LATENCY.labels('ringcentral', 'get_message').time():
+                    response = platform.get(f'{self.MESSAGE_STORE_PATH}/{message_id}')
+                attachments = response.json().get('attachments') or []
+                attachment_uri = attachments[0]['uri'] if attachments else None
 
             # Download first attachment
-            if message.get('attachments'):
-                attachment = message['attachments'][0]
-                attachment_url = attachment['uri']
-
-                # Download
-                attachment_response = platform.get(attachment_url)
+            if attachment_uri:
+                result = self._stream_to_file(attachment_uri, save_path)
+                logger.info(f"✅ Downloaded fax {message_id} to {save_path} "
+                            f"({result['bytes']} bytes, sha256 {result['sha256'][:12]})")
+                return {'success': True, 'path': save_path, **result}
 
-                with open(save_path, 'wb') as f:
-                    f.write(attachment_response.content)
-
-                logger.info(f"✅ Downloaded fax {message_id} to {save_path}")
-                return {'success': True, 'path': save_path}
+            return {'success': False, 'error': f'Fax {message_id} has no attachment'}
 
         except Exception as e:
             logger.error(f"❌ Failed to download fax: {e}")
             return {'success': False, 'error': str(e)}
 
+    def _stream_to_file(self, uri, save_path):
+        """GET uri into save_path via temp file + fsync + rename; returns bytes and sha256"""
+        if not uri.startswith('http'):
+            uri = self.server_url + uri
+        directory = os.path.dirname(save_path) or '.'
+        digest = hashlib.sha256()
+        size = 0
+
+        start = time.perf_counter()
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.download-', suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                with EXTERNAL_LATENCY.labels('ringcentral', 'download_attachment').time():
+                    with self.http.get(uri, headers={'Authorization': f'Bearer {self.get_access_token()}'},
+                                       stream=True, timeout=(10, 60)) as response:
+                        response.raise_for_status()
+                        for chunk in response.iter_content(self.TRANSFER_CHUNK):
+                            f.write(chunk)
+                            digest.update(chunk)
+                            size += len(chunk)
+
+                        # iter_content undoes any Content-Encoding, so only plain bodies can be checked
+                        expected = response.headers.get('Content-Length')
+                        if expected and not response.headers.get('Content-Encoding') and int(expected) != size:
+                            raise IOError(f"Download truncated: {size} of {expected} bytes")
+                f.flush()
+                os.fchmod(f.fileno(), FILE_MODE)
+                os.fsync(f.fileno())
+
+            os.replace(temp_path, save_path)
+        except BaseException:
+            try:
+                os.unlink(temp_path)
+            except OSError:
+                pass
+            raise
+
+        # Make the rename itself durable
+        dir_fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+        elapsed = time.perf_counter() - start
+        FAX_TRANSFER_BYTES.labels('inbound').observe(size)
+        if elapsed > 0:
+            FAX_TRANSFER_RATE.labels('inbound').observe(size / elapsed)
+        return {'bytes': size, 'sha256': digest.hexdigest()}
+
     def send_sms(self, to_number, message):
         """
         Send an SMS via RingCentral
@@ -138,13 +311,10 @@ class RingCentralService:
         try:
             platform = self.get_platform()
 
-            data = {
-                'from': {'phoneNumber': self.config.get('sms_number')},
-                'to': [{'phoneNumber': to_number}],
-                'text': message
-            }
+            data = self.sms_payload(to_number, message)
 
-            response = platform.post('/restapi/v1.0/account/~/extension/~/sms', data)
+            with EXTERNAL_LATENCY.labels('ringcentral', 'send_sms').time():
+                response = platform.post(self.SMS_PATH, data)
 
             logger.info(f"✅ SMS sent to {to_number}, ID: {response.json().get('id')}")
             return {
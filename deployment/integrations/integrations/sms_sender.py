@@ -4,30 +4,81 @@ Handles SMS messaging via RingCentral for patient notifications
 """
 
 import logging
-import mysql.connector
 from datetime import datetime
 
+from integrations import dispatch
+from integrations.db_pool import insert_rows
+from integrations.metrics import QUEUE_LATENCY, SMS_FAILED, SMS_SENT
+from integrations.queue_lease import QueueLease
+from integrations.ringcentral_service import RingCentralService
+
 logger = logging.getLogger(__name__)
 
 class SMSSender:
-    def __init__(self, ringcentral_service, db_config):
+    # Shared with the asyncio variant (async_services.AsyncSMSSender)
+    LOG_SMS_SQL = """
+                INSERT INTO sms_log (
+                    external_id, to_number, message_text,
+                    patient_id, provider_id, status,
+                    sent_at, created_at
+                ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+            """
+
+    QUEUE_SMS_SQL = """
+                INSERT INTO sms_queue (
+                    to_number, message_text, patient_id, provider_id,
+                    scheduled_for, status, created_at
+                ) VALUES"""
+    QUEUE_SMS_ROW = "(%s, %s, %s, %s, %s, 'pending', %s)"
+
+    # Largest batch accepted by queue_sms_batch
+    MAX_BATCH_SIZE = 1000
+
+    # Seconds a failed message waits before its next attempt
+    RETRY_DELAY = 60
+    # Rows still 'sending' after this long were interrupted by a crash
+    SEND_STALE_AFTER = 10 * 60
+
+    def __init__(self, ringcentral_service, db_pool):
         self.rc = ringcentral_service
-        self.db_config = db_config
+        self.db_pool = db_pool
+        self.lease = QueueLease(
+            db_pool, 'sms_queue',
+            due_sql="AND (scheduled_for IS NULL OR scheduled_for <= NOW())",
+            order_by='scheduled_for ASC, created_at ASC'
+        )
 
     def get_db_connection(self):
-        """Get database connection"""
-        return mysql.connector.connect(**self.db_config)
+        """Borrow a connection from the shared pool (close() returns it)"""
+        return self.db_pool.get_connection()
+
+    # Validates as well as normalizes; raises ValueError for unusable numbers
+    normalize_number = staticmethod(RingCentralService.normalize_number)
+
+    @staticmethod
+    def log_params(result, to_number, message, patient_id, provider_id):
+        """sms_log row for a send result"""
+        return (
+            result.get('message_id'),
+            to_number,
+            message,
+            patient_id,
+            provider_id,
+            'sent' if result['success'] else 'failed',
+            datetime.now() if result['success'] else None,
+            datetime.now()
+        )
 
     def send_sms(self, to_number, message, patient_id=None, provider_id=None):
         """
         Send an SMS message
+
+        Raises ValueError for a number that cannot be normalized, before anything
+        is sent or logged.
         """
-        try:
-            # Validate phone number (basic)
-            if not to_number.startswith('+'):
-                # Assume North American number
-                to_number = '+1' + to_number.replace('-', '').replace('(', '').replace(')', '').replace(' ', '')
+        to_number = self.normalize_number(to_number)
 
+        try:
             # Send via RingCentral
             result = self.rc.send_sms(to_number, message)
 
@@ -35,32 +86,12 @@ class SMSSender:
             db = self.get_db_connection()
             cursor = db.cursor()
 
-            cursor.execute("""
-                INSERT INTO sms_log (
-                    external_id, to_number, message_text,
-                    patient_id, provider_id, status,
-                    sent_at, created_at
-                ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-            """, (
-                result.get('message_id'),
-                to_number,
-                message,
-                patient_id,
-                provider_id,
-                'sent' if result['success'] else 'failed',
-                datetime.now() if result['success'] else None,
-                datetime.now()
-            ))
+            self._log_result(cursor, result, to_number, message, patient_id, provider_id)
 
             db.commit()
             cursor.close()
             db.close()
 
-            if result['success']:
-                logger.info(f"✅ SMS sent to {to_number}")
-            else:
-                logger.error(f"❌ SMS failed to {to_number}: {result.get('error')}")
-
             return result
 
         except Exception as e:
@@ -70,39 +101,44 @@ class SMSSender:
                 'error': str(e)
             }
 
+    def _log_result(self, cursor, result, to_number, message, patient_id, provider_id):
+        """Add the sms_log row for a send on cursor (the caller commits) and count it"""
+        cursor.execute(self.LOG_SMS_SQL, self.log_params(result, to_number, message, patient_id, provider_id))
+
+        if result['success']:
+            SMS_SENT.inc()
+            logger.info(f"✅ SMS sent to {to_number}")
+        else:
+            SMS_FAILED.inc()
+            logger.error(f"❌ SMS failed to {to_number}: {result.get('error')}")
+
     def process_queue(self):
-        """Process queued SMS messages"""
+        """
+        Process queued SMS messages
+
+        Rows are claimed under a lease (queue_lease.QueueLease), so several service
+        instances can share the queue, and each row is marked 'sending' before the
+        RingCentral call, so a crash cannot send a message twice.
+        """
         logger.info("Processing SMS queue...")
 
         try:
-            db = self.get_db_connection()
-            cursor = db.cursor(dictionary=True)
+            interrupted = self.lease.fail_interrupted(self.SEND_STALE_AFTER)
+            if interrupted:
+                SMS_FAILED.inc(interrupted)
+                logger.error(f"❌ {interrupted} SMS messages were interrupted mid-send and marked failed for review")
 
-            # Get pending messages
-            cursor.execute("""
-                SELECT * FROM sms_queue
-                WHERE status = 'pending'
-                AND (retry_count < 3 OR retry_count IS NULL)
-                AND (scheduled_for IS NULL OR scheduled_for <= %s)
-                ORDER BY scheduled_for ASC, created_at ASC
-                LIMIT 20
-            """, (datetime.now(),))
-
-            pending = cursor.fetchall()
+            pending = self.lease.claim(20)
             logger.info(f"Found {len(pending)} pending SMS messages")
 
             for sms in pending:
-                self._send_queued_sms(sms, cursor)
-
-            db.commit()
-            cursor.close()
-            db.close()
+                self._send_queued_sms(sms)
 
         except Exception as e:
             logger.error(f"Error processing SMS queue: {e}")
 
-    def _send_queued_sms(self, sms, cursor):
-        """Send a queued SMS"""
+    def _send_queued_sms(self, sms):
+        """Send a claimed SMS"""
         try:
             sms_id = sms['id']
             to_number = sms['to_number']
@@ -110,35 +146,65 @@ class SMSSender:
             patient_id = sms.get('patient_id')
             provider_id = sms.get('provider_id')
 
-            logger.info(f"Sending SMS {sms_id} to {to_number}")
-
-            # Send
-            result = self.send_sms(to_number, message, patient_id, provider_id)
-
-            if result['success']:
-                # Update queue status
-                cursor.execute("""
-                    UPDATE sms_queue
-                    SET status = 'sent',
-                        external_id = %s,
-                        sent_at = %s
-                    WHERE id = %s
-                """, (result['message_id'], datetime.now(), sms_id))
-
-                logger.info(f"✅ Sent SMS {sms_id}")
-
-            else:
-                # Update retry count
-                retry_count = (sms.get('retry_count') or 0) + 1
-                cursor.execute("""
-                    UPDATE sms_queue
-                    SET retry_count = %s,
-                        last_error = %s,
-                        status = CASE WHEN %s >= 3 THEN 'failed' ELSE 'pending' END
-                    WHERE id = %s
-                """, (retry_count, result.get('error'), retry_count, sms_id))
-
-                logger.error(f"❌ Failed to send SMS {sms_id}: {result.get('error')}")
+            db = self.get_db_connection()
+            try:
+                cursor = db.cursor()
+
+                # Committed before sending so a crash cannot resend it
+                started = self.lease.start_send(cursor, sms)
+                db.commit()
+                if not started:
+                    logger.warning(f"Lease on SMS {sms_id} expired and was reclaimed; skipping")
+                    return
+
+                logger.info(f"Sending SMS {sms_id} to {to_number}")
+
+                # Send and log on this connection; send_sms would borrow a second
+                # one from the pool while this one is held
+                try:
+                    to_number = self.normalize_number(to_number)
+                except ValueError as e:
+                    result = {'success': False, 'error': str(e)}
+                else:
+                    result = self.rc.send_sms(to_number, message)
+                    self._log_result(cursor, result, to_number, message, patient_id, provider_id)
+
+                if result['success']:
+                    # Update queue status
+                    cursor.execute("""
+                        UPDATE sms_queue
+                        SET status = 'sent',
+                            external_id = %s,
+                            sent_at = %s,
+                            claimed_by = NULL,
+                            lease_expires_at = NULL
+                        WHERE id = %s
+                    """, (result['message_id'], datetime.now(), sms_id))
+                    db.commit()
+
+                    queued_at = max(filter(None, (sms.get('created_at'), sms.get('scheduled_for'))), default=None)
+                    if queued_at:
+                        QUEUE_LATENCY.labels('sms').observe(max(0.0, (datetime.now() - queued_at).total_seconds()))
+                    logger.info(f"✅ Sent SMS {sms_id}")
+
+                else:
+                    # Update retry count; the lease doubles as the retry delay
+                    retry_count = (sms.get('retry_count') or 0) + 1
+                    cursor.execute("""
+                        UPDATE sms_queue
+                        SET retry_count = %s,
+                            last_error = %s,
+                            status = CASE WHEN %s >= 3 THEN 'failed' ELSE 'pending' END,
+                            claimed_by = NULL,
+                            lease_expires_at = DATE_ADD(NOW(), INTERVAL %s SECOND)
+                        WHERE id = %s
+                    """, (retry_count, result.get('error'), retry_count, self.RETRY_DELAY, sms_id))
+                    db.commit()
+
+                    logger.error(f"❌ Failed to send SMS {sms_id}: {result.get('error')}")
+
+            finally:
+                db.close()
 
         except Exception as e:
             logger.error(f"Error sending queued SMS: {e}")
@@ -151,12 +217,8 @@ class SMSSender:
             db = self.get_db_connection()
             cursor = db.cursor()
 
-            cursor.execute("""
-                INSERT INTO sms_queue (
-                    to_number, message_text, patient_id, provider_id,
-                    scheduled_for, status, created_at
-                ) VALUES (%s, %s, %s, %s, %s, 'pending', %s)
-            """, (to_number, message, patient_id, provider_id, scheduled_for, datetime.now()))
+            cursor.execute(f"{self.QUEUE_SMS_SQL} {self.QUEUE_SMS_ROW}",
+                           (to_number, message, patient_id, provider_id, scheduled_for, datetime.now()))
 
             sms_id = cursor.lastrowid
 
@@ -165,6 +227,7 @@ class SMSSender:
             db.close()
 
             logger.info(f"Queued SMS {sms_id} to {to_number}")
+            dispatch.notify('sms')
 
             return {
                 'success': True,
@@ -179,6 +242,70 @@ class SMSSender:
                 'error': str(e)
             }
 
+    def queue_sms_batch(self, messages):
+        """
+        Queue many SMS messages in one transaction
+
+        messages: list of {'to', 'message', optional 'patient_id', 'provider_id',
+        'scheduled_for' (ISO 8601)}. Numbers are normalized; invalid entries are
+        skipped and reported by index in 'rejected'. The rest are inserted with
+        multi-row INSERTs and one commit, and their queue ids returned in order.
+        """
+        if not isinstance(messages, list) or not messages:
+            return {'success': False, 'error': 'messages must be a non-empty list'}
+        if len(messages) > self.MAX_BATCH_SIZE:
+            return {'success': False, 'error': f'At most {self.MAX_BATCH_SIZE} messages per batch'}
+
+        rows, indexes, rejected = [], [], []
+        now = datetime.now()
+        for index, item in enumerate(messages):
+            try:
+                if not isinstance(item, dict):
+                    raise ValueError('Entry must be an object')
+                message = item.get('message')
+                if not isinstance(message, str) or not message.strip():
+                    raise ValueError('message is required')
+                scheduled_for = item.get('scheduled_for')
+                if scheduled_for:
+                    scheduled_for = datetime.fromisoformat(scheduled_for)
+                rows.append((self.normalize_number(item.get('to')), message, item.get('patient_id'),
+                             item.get('provider_id'), scheduled_for or None, now))
+                indexes.append(index)
+            except (TypeError, ValueError) as e:
+                rejected.append({'index': index, 'error': str(e)})
+
+        try:
+            ids = []
+            if rows:
+                db = self.get_db_connection()
+                try:
+                    # The pool's connections autocommit; make all chunks one transaction
+                    db.start_transaction()
+                    cursor = db.cursor()
+                    ids = insert_rows(cursor, self.QUEUE_SMS_SQL, self.QUEUE_SMS_ROW, rows)
+                    db.commit()
+                    cursor.close()
+                finally:
+                    db.close()
+
+            logger.info(f"Queued {len(ids)} SMS messages ({len(rejected)} rejected)")
+            if ids:
+                dispatch.notify('sms')
+
+            return {
+                'success': True,
+                'queued': [{'index': index, 'sms_id': sms_id} for index, sms_id in zip(indexes, ids)],
+                'rejected': rejected,
+                'status': 'queued'
+            }
+
+        except Exception as e:
+            logger.error(f"Error queuing SMS batch: {e}")
+            return {
+                'success': False,
+                'error': str(e)
+            }
+
     def send_appointment_reminder(self, patient_id, appointment_date, provider_name):
         """
         Send appointment reminder SMS
@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+"""
+Integration API Load Test
+Compares request latency of the Flask server (app.py) and the ASGI server (asgi.py)
+under concurrent load, with stubbed backends so no MySQL, RingCentral or Ocean
+account is needed:
+
+- A stub HTTP backend answers the RingCentral SMS and Ocean referral calls after
+  --backend-latency seconds
+- The database is replaced with an in-process stub that sleeps --db-latency per query
+  (threads for Flask, asyncio for ASGI), behind the usual pool size limits
+- Enqueues do not wake the queue senders: the load test measures the request
+  path, and the stub database cannot answer the senders' queries
+
+Usage:
+    python loadtest.py --requests 2000 --concurrency 200
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import asynccontextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ENDPOINTS = {
+    'sms': ('/api/sms/send', {'to': '7785551234', 'message': 'Your appointment is tomorrow at 2pm'}),
+    'fax': ('/api/fax/send', {'to': '+17785551234', 'document_path': '/tmp/referral.pdf'}),
+    'referral': ('/api/ocean/refer', {'patient_id': 1, 'specialist_id': 2, 'reason': 'Cardiology consultation'}),
+}
+
+PATIENT_ROW = {
+    'first_name': 'Test', 'last_name': 'Patient', 'hin': '9876543210', 'ver': 'AB', 'sex': 'F',
+    'year_of_birth': '1980', 'month_of_birth': 1, 'date_of_birth': 2, 'phone': '7785551234',
+    'email': 'test@example.com', 'practitioner_no': '12345', 'specialty': 'Cardiology', 'fax_number': '7785550000'
+}
+
+
+# ===== Stub backends =====
+
+def serve_backend(port, latency):
+    """Stub RingCentral/Ocean API: every POST returns {"id": ...} after latency seconds"""
+    counter = itertools.count(1)
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get('Content-Length') or 0))
+            time.sleep(latency)
+            body = json.dumps({'id': str(next(counter))}).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    class Server(ThreadingHTTPServer):
+        daemon_threads = True
+        request_queue_size = 1024  # listen() backlog; the default of 5 drops connections under load
+
+    Server(('127.0.0.1', port), Handler).serve_forever()
+
+
+class StubCursor:
+    _ids = itertools.count(1)
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.lastrowid = None
+
+    def execute(self, sql, params=None):
+        time.sleep(self.latency)
+        self.lastrowid = next(self._ids)
+
+    def fetchone(self):
+        return dict(PATIENT_ROW)
+
+    def fetchall(self):
+        return []
+
+    def close(self):
+        pass
+
+
+class StubConnection:
+    in_transaction = False
+
+    def __init__(self, latency):
+        self.latency = latency
+
+    def cursor(self, **kwargs):
+        return StubCursor(self.latency)
+
+    def commit(self):
+        pass
+
+    def ping(self, **kwargs):
+        pass
+
+    def close(self):
+        pass
+
+
+class StubAsyncCursor:
+    _ids = itertools.count(1)
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.lastrowid = None
+
+    async def execute(self, sql, params=None):
+        await asyncio.sleep(self.latency)
+        self.lastrowid = next(self._ids)
+
+    async def fetchone(self):
+        return dict(PATIENT_ROW)
+
+
+def install_stubs(backend_url, db_latency):
+    """Replace the database and RingCentral in app.py with stubs and register the services"""
+    import requests
+    import app as service
+    from integrations import dispatch
+    from integrations.fax_processor import FaxProcessor
+    from integrations.ocean_service import OceanService
+    from integrations.ringcentral_service import RingCentralService
+    from integrations.sms_sender import SMSSender
+
+    class StubRingCentral(RingCentralService):
+        """RingCentralService without the SDK login; SMS goes to the stub backend"""
+
+        def __init__(self, config):
+            self.config = config
+            self.server_url = config['server_url']
+            self.session = requests.Session()
+            self.session.mount('http://', requests.adapters.HTTPAdapter(pool_maxsize=100))
+
+        def get_access_token(self):
+            return 'stub-token'
+
+        def send_sms(self, to_number, message):
+            response = self.session.post(self.server_url + self.SMS_PATH, json=self.sms_payload(to_number, message),
+                                         headers={'Authorization': f'Bearer {self.get_access_token()}'}, timeout=30)
+            response.raise_for_status()
+            return {'success': True, 'message_id': response.json().get('id'), 'status': 'sent'}
+
+    service.db_pool._connect = lambda **kwargs: StubConnection(db_latency)
+    # Every fax/SMS request would otherwise trigger process_queue against the stub database
+    dispatch.DISPATCHER._subscribers.clear()
+    rc = StubRingCentral({'server_url': backend_url, 'sms_number': '+17785550000',
+                          'fax_dir': tempfile.mkdtemp(prefix='loadtest-fax-')})
+    service.services.update({
+        'ringcentral': rc,
+        'fax': FaxProcessor(rc, service.db_pool),
+        'sms': SMSSender(rc, service.db_pool),
+        'ocean': OceanService({'site_id': 'stub', 'api_key': 'stub', 'api_base': backend_url}, service.db_pool),
+    })
+    return service
+
+
+def serve_flask(port, backend_url, db_latency):
+    service = install_stubs(backend_url, db_latency)
+    service.app.run(host='127.0.0.1', port=port, debug=False, threaded=True)
+
+
+def serve_asgi(port, backend_url, db_latency):
+    import uvicorn
+    service = install_stubs(backend_url, db_latency)
+    import asgi
+    from integrations.async_services import AsyncDatabase
+
+    class StubAsyncDatabase(AsyncDatabase):
+        """AsyncDatabase whose queries are asyncio.sleep(db_latency), limited to max_size connections"""
+
+        async def start(self):
+            self._slots = asyncio.Semaphore(self.max_size)
+
+        async def close(self):
+            pass
+
+        @asynccontextmanager
+        async def transaction(self):
+            start = time.monotonic()
+            async with self._slots:
+                waited = time.monotonic() - start
+                self._stats['borrows'] += 1
+                self._stats['wait_seconds_total'] += waited
+                self._stats['wait_seconds_max'] = max(self._stats['wait_seconds_max'], waited)
+                yield StubAsyncCursor(db_latency)
+
+    db = StubAsyncDatabase(service.db_config, max_size=int(os.getenv('ASYNC_DB_POOL_SIZE', '20')))
+    uvicorn.run(asgi.create_app(db=db, start_background=False), host='127.0.0.1', port=port, log_level='warning')
+
+
+# ===== Load generator =====
+
+async def wait_until_up(client, base_url, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            async with client.get(base_url + '/health'):
+                return
+        except Exception:
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"Server at {base_url} did not start")
+
+
+async def run_load(base_url, endpoint, total, concurrency):
+    """Send total requests with at most concurrency in flight; returns (latencies, errors, elapsed)"""
+    import aiohttp
+
+    path, payload = ENDPOINTS[endpoint]
+    latencies = []
+    errors = 0
+    remaining = itertools.count()
+    connector = aiohttp.TCPConnector(limit=concurrency)
+
+    async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=120)) as client:
+        await wait_until_up(client, base_url)
+
+        async def worker():
+            nonlocal errors
+            while next(remaining) < total:
+                start = time.perf_counter()
+                try:
+                    async with client.post(base_url + path, json=payload) as response:
+                        ok = response.status == 200 and (await response.json()).get('success')
+                except Exception:
+                    ok = False
+                latencies.append(time.perf_counter() - start)
+                if not ok:
+                    errors += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return latencies, errors, time.perf_counter() - start
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def spawn(mode, port, args):
+    return subprocess.Popen([
+        sys.executable, os.path.abspath(__file__), '--serve', mode, '--port', str(port),
+        '--backend-url', f'http://127.0.0.1:{args.backend_port}',
+        '--backend-latency', str(args.backend_latency), '--db-latency', str(args.db_latency)
+    ], cwd=os.path.dirname(os.path.abspath(__file__)))
+
+
+def main(args):
+    backend = spawn('backend', args.backend_port, args)
+    servers = {'flask': (spawn('flask', args.flask_port, args), args.flask_port),
+               'asgi': (spawn('asgi', args.asgi_port, args), args.asgi_port)}
+    results = []
+    try:
+        for endpoint in args.endpoints:
+            for mode, (_, port) in servers.items():
+                latencies, errors, elapsed = asyncio.run(
+                    run_load(f'http://127.0.0.1:{port}', endpoint, args.requests, args.concurrency))
+                results.append((endpoint, mode, latencies, errors, elapsed))
+    finally:
+        for process in [backend] + [process for process, _ in servers.values()]:
+            process.terminate()
+            process.wait()
+
+    print(f"\n{args.requests} requests per run, {args.concurrency} concurrent, "
+          f"backend latency {args.backend_latency * 1000:.0f}ms, DB latency {args.db_latency * 1000:.0f}ms/query")
+    print(f"  {'endpoint':<10} {'server':<7} {'p50 ms':>9} {'p99 ms':>9} {'mean ms':>9} {'req/s':>8} {'errors':>7}")
+    for endpoint, mode, latencies, errors, elapsed in results:
+        print(f"  {endpoint:<10} {mode:<7} {percentile(latencies, 50) * 1000:9.1f} {percentile(latencies, 99) * 1000:9.1f} "
+              f"{statistics.mean(latencies) * 1000:9.1f} {len(latencies) / elapsed:8.0f} {errors:7d}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Load test the Flask and ASGI integration servers with stubbed backends.")
+    parser.add_argument('--requests', type=int, default=1000, help="Requests per endpoint and server")
+    parser.add_argument('--concurrency', type=int, default=100, help="Requests in flight at once")
+    parser.add_argument('--endpoints', nargs='+', choices=sorted(ENDPOINTS), default=['sms', 'referral', 'fax'])
+    parser.add_argument('--backend-latency', type=float, default=0.2, help="Stub RingCentral/Ocean response time (s)")
+    parser.add_argument('--db-latency', type=float, default=0.002, help="Stub time per DB query (s)")
+    parser.add_argument('--flask-port', type=int, default=18080)
+    parser.add_argument('--asgi-port', type=int, default=18081)
+    parser.add_argument('--backend-port', type=int, default=18082)
+    # Internal: run one of the servers (used by the subprocesses this script spawns)
+    parser.add_argument('--serve', choices=['backend', 'flask', 'asgi'], help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--backend-url', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve == 'backend':
+        serve_backend(args.port, args.backend_latency)
+    elif args.serve == 'flask':
+        serve_flask(args.port, args.backend_url, args.db_latency)
+    elif args.serve == 'asgi':
+        serve_asgi(args.port, args.backend_url, args.db_latency)
+    else:
+        main(args)
@@ -0,0 +1,434 @@
+#!/usr/bin/env python3
+"""
+Queue Claim Verification
+Runs several worker processes against the same fax_queue and sms_queue and checks
+that the claim/lease protocol (integrations/queue_lease.py) never sends a row twice
+
+Each worker process has its own connection pool, FaxProcessor and SMSSender (with
+a stub RingCentral that records every send) and drains both queues concurrently.
+Before the workers start, two misbehaving claimers are added:
+
+- a "crashed" worker claims rows and never sends them; its leases must expire and
+  the rows be sent by the others
+- a "stalled" worker claims rows, sleeps past its lease, then tries to send; every
+  one of its start_send() calls must fail because the rows were reclaimed
+
+Checks: every row ends 'sent' or 'failed', no row is sent more than once, and each
+row was attempted exactly retry_count (+1 if sent) times.
+
+By default the database is a SQLite stand-in (MySQL-only SQL such as NOW(),
+DATE_ADD and FOR UPDATE SKIP LOCKED is translated, and a claim transaction takes
+SQLite's write lock), run once for each claim strategy. With --mysql it runs
+against a real server from the DB_* environment variables, using --database,
+which must be a scratch database; the queue tables are created there and must
+start empty.
+
+Usage:
+    python verify_queue_claims.py --workers 4 --rows 300
+    DB_HOST=127.0.0.1 DB_USER=root DB_PASSWORD=... python verify_queue_claims.py --mysql --database queue_scratch
+"""
+
+import argparse
+import logging
+import multiprocessing
+import os
+import random
+import re
+import sqlite3
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from integrations.db_pool import ConnectionPool
+from integrations.fax_processor import FaxProcessor
+from integrations.queue_lease import QueueLease
+from integrations.sms_sender import SMSSender
+
+SERVER_VERSIONS = {
+    'skip-locked': '8.0.36',
+    'update-limit': '10.5.23-MariaDB',
+}
+
+TABLES = {
+    'fax_queue': """
+        CREATE TABLE IF NOT EXISTS fax_queue (
+            id INTEGER PRIMARY KEY {autoincrement},
+            to_number VARCHAR(20) NOT NULL,
+            document_path VARCHAR(500) NOT NULL,
+            cover_page TEXT,
+            status VARCHAR(10) DEFAULT 'pending',
+            external_id VARCHAR(100),
+            retry_count INT DEFAULT 0,
+            last_error TEXT,
+            created_at TIMESTAMP NULL,
+            send_started_at TIMESTAMP NULL,
+            sent_at TIMESTAMP NULL,
+            claimed_by VARCHAR(100) NULL,
+            lease_expires_at TIMESTAMP NULL
+        )""",
+    'sms_queue': """
+        CREATE TABLE IF NOT EXISTS sms_queue (
+            id INTEGER PRIMARY KEY {autoincrement},
+            to_number VARCHAR(20) NOT NULL,
+            message_text TEXT NOT NULL,
+            patient_id INT,
+            provider_id VARCHAR(6),
+            scheduled_for TIMESTAMP NULL,
+            status VARCHAR(10) DEFAULT 'pending',
+            external_id VARCHAR(100),
+            retry_count INT DEFAULT 0,
+            last_error TEXT,
+            created_at TIMESTAMP NULL,
+            send_started_at TIMESTAMP NULL,
+            sent_at TIMESTAMP NULL,
+            claimed_by VARCHAR(100) NULL,
+            lease_expires_at TIMESTAMP NULL
+        )""",
+    'fax_log': """
+        CREATE TABLE IF NOT EXISTS fax_log (
+            id INTEGER PRIMARY KEY {autoincrement},
+            external_id VARCHAR(100), direction VARCHAR(10), from_number VARCHAR(20),
+            to_number VARCHAR(20), file_path VARCHAR(500), status VARCHAR(20), created_at TIMESTAMP NULL
+        )""",
+    'rate_limits': """
+        CREATE TABLE IF NOT EXISTS rate_limits (
+            name VARCHAR(50) PRIMARY KEY, tokens DOUBLE NOT NULL, updated_at DOUBLE NOT NULL
+        )""",
+    'sms_log': """
+        CREATE TABLE IF NOT EXISTS sms_log (
+            id INTEGER PRIMARY KEY {autoincrement},
+            external_id VARCHAR(100), to_number VARCHAR(20), message_text TEXT, patient_id INT,
+            provider_id VARCHAR(6), status VARCHAR(20), sent_at TIMESTAMP NULL, created_at TIMESTAMP NULL
+        )""",
+}
+
+
+# ===== SQLite stand-in for MySQL =====
+
+sqlite3.register_adapter(datetime, lambda value: value.isoformat(' '))
+
+MYSQL_TO_SQLITE = [
+    (re.compile(r"DATE_ADD\(NOW\(\), INTERVAL \? SECOND\)"), "datetime('now', 'localtime', printf('+%d seconds', ?))"),
+    (re.compile(r"DATE_SUB\(NOW\(\), INTERVAL \? SECOND\)"), "datetime('now', 'localtime', printf('-%d seconds', ?))"),
+    (re.compile(r"NOW\(\)"), "datetime('now', 'localtime')"),
+    (re.compile(r"FOR UPDATE( SKIP LOCKED)?"), ""),
+    (re.compile(r"UNIX_TIMESTAMP\(NOW\(6\)\)"), "((julianday('now') - 2440587.5) * 86400.0)"),
+    (re.compile(r"INSERT IGNORE"), "INSERT OR IGNORE"),
+    (re.compile(r"@@auto_increment_increment"), "1"),
+    (re.compile(r"@@innodb_autoinc_lock_mode"), "1"),
+]
+
+
+class SQLiteCursor:
+    def __init__(self, cursor, dictionary, version):
+        self._cursor = cursor
+        self._dictionary = dictionary
+        self._version = version
+
+    def execute(self, operation, params=()):
+        if operation.strip() == 'SELECT VERSION()':
+            operation, params = 'SELECT ?', (self._version,)
+        operation = operation.replace('%s', '?')
+        for pattern, replacement in MYSQL_TO_SQLITE:
+            operation = pattern.sub(replacement, operation)
+        self._cursor.execute(operation, tuple(params or ()))
+
+    def _row(self, row):
+        if row is None or not self._dictionary:
+            return row
+        return dict(zip([column[0] for column in self._cursor.description], row))
+
+    def fetchone(self):
+        return self._row(self._cursor.fetchone())
+
+    def fetchall(self):
+        return [self._row(row) for row in self._cursor.fetchall()]
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    @property
+    def lastrowid(self):
+        # MySQL reports the first id of a multi-row INSERT, SQLite the last
+        if self._cursor.rowcount > 1:
+            return self._cursor.lastrowid - self._cursor.rowcount + 1
+        return self._cursor.lastrowid
+
+    def close(self):
+        self._cursor.close()
+
+
+class SQLiteConnection:
+    """mysql.connector-like connection (autocommit on) over a SQLite file"""
+
+    def __init__(self, path, version):
+        self._conn = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False,
+                                     detect_types=sqlite3.PARSE_DECLTYPES)
+        self._version = version
+
+    def cursor(self, dictionary=False):
+        return SQLiteCursor(self._conn.cursor(), dictionary, self._version)
+
+    @property
+    def in_transaction(self):
+        return self._conn.in_transaction
+
+    def start_transaction(self):
+        # Stands in for the row locks of SELECT ... FOR UPDATE
+        self._conn.execute('BEGIN IMMEDIATE')
+
+    def commit(self):
+        if self._conn.in_transaction:
+            self._conn.execute('COMMIT')
+
+    def rollback(self):
+        if self._conn.in_transaction:
+            self._conn.execute('ROLLBACK')
+
+    def ping(self, reconnect=False):
+        self._conn.execute('SELECT 1')
+
+    def close(self):
+        self._conn.close()
+
+
+def make_pool(target):
+    if target['kind'] == 'sqlite':
+        return ConnectionPool({'path': target['path'], 'version': target['version']}, max_size=8,
+                              connect=SQLiteConnection)
+    return ConnectionPool(target['db_config'], max_size=8)
+
+
+# ===== Stub RingCentral =====
+
+class StubRingCentral:
+    """Records every send (in a per-process file) and fails a fraction of them"""
+
+    def __init__(self, log_path, failure_rate, fax_dir):
+        self.log = open(log_path, 'a', buffering=1)
+        self.failure_rate = failure_rate
+        self.config = {
+            'fax_dir': fax_dir,
+            'fax_number': '+16045550000',
+            'fax_rate_per_minute': 60000,
+            'fax_send_concurrency': 4,
+            'fax_max_batch': 25,
+            'fax_send_time_budget': 10,
+            'fax_retry_delay': 1,
+        }
+
+    normalize_number = staticmethod(lambda number: number)
+
+    def _send(self, kind, to_number):
+        time.sleep(random.uniform(0.001, 0.01))
+        success = random.random() >= self.failure_rate
+        self.log.write(f"{kind} {to_number} {'ok' if success else 'fail'}\n")
+        return success
+
+    def send_fax(self, to_number, file_path, cover_text=None):
+        if self._send('fax', to_number):
+            return {'success': True, 'fax_id': f'rc-{to_number}', 'status': 'queued'}
+        return {'success': False, 'error': 'stub failure'}
+
+    def send_sms(self, to_number, message):
+        if self._send('sms', to_number):
+            return {'success': True, 'message_id': f'rc-{to_number}', 'status': 'sent'}
+        return {'success': False, 'error': 'stub failure'}
+
+
+# ===== Scenario =====
+
+def unfinished(pool):
+    db = pool.get_connection()
+    try:
+        cursor = db.cursor()
+        cursor.execute("""
+            SELECT (SELECT COUNT(*) FROM fax_queue WHERE status IN ('pending', 'sending'))
+                 + (SELECT COUNT(*) FROM sms_queue WHERE status IN ('pending', 'sending'))
+        """)
+        return cursor.fetchone()[0]
+    finally:
+        db.close()
+
+
+def run_worker(target, log_path, failure_rate, timeout):
+    """One service instance: drain both queues until nothing is left"""
+    pool = make_pool(target)
+    rc = StubRingCentral(log_path, failure_rate, tempfile.mkdtemp())
+    fax = FaxProcessor(rc, pool)
+    sms = SMSSender(rc, pool)
+    sms.RETRY_DELAY = 1
+
+    deadline = time.monotonic() + timeout
+    while unfinished(pool) and time.monotonic() < deadline:
+        fax.process_queue()
+        sms.process_queue()
+        time.sleep(0.05)
+
+
+def stalled_worker(target, lease_seconds, stall_seconds, result):
+    """Claims rows, stalls past its lease, then tries to send them"""
+    pool = make_pool(target)
+    lease = QueueLease(pool, 'fax_queue', lease_seconds=lease_seconds, worker_id='stalled-worker')
+    claimed = lease.claim(10)
+    time.sleep(stall_seconds)
+
+    db = pool.get_connection()
+    try:
+        cursor = db.cursor()
+        started = sum(lease.start_send(cursor, row) for row in claimed)
+        db.commit()
+    finally:
+        db.close()
+    result.put((len(claimed), started))
+
+
+def seed(pool, rows):
+    db = pool.get_connection()
+    try:
+        db.start_transaction()
+        cursor = db.cursor()
+        for index in range(rows):
+            cursor.execute("""
+                INSERT INTO fax_queue (to_number, document_path, cover_page, status, created_at)
+                VALUES (%s, %s, '', 'pending', NOW())
+            """, (f'+1604555{index:04d}', f'/tmp/fax-{index}.pdf'))
+            cursor.execute("""
+                INSERT INTO sms_queue (to_number, message_text, status, created_at)
+                VALUES (%s, %s, 'pending', NOW())
+            """, (f'+1778555{index:04d}', f'Message {index}'))
+        db.commit()
+    finally:
+        db.close()
+
+    # A worker that claims rows and then dies: its leases must expire
+    for table in ('fax_queue', 'sms_queue'):
+        QueueLease(pool, table, lease_seconds=2, worker_id='crashed-worker').claim(15)
+
+
+def create_tables(pool, autoincrement):
+    db = pool.get_connection()
+    try:
+        cursor = db.cursor()
+        for ddl in TABLES.values():
+            cursor.execute(ddl.format(autoincrement=autoincrement))
+        cursor.execute("SELECT (SELECT COUNT(*) FROM fax_queue) + (SELECT COUNT(*) FROM sms_queue)")
+        if cursor.fetchone()[0]:
+            sys.exit("The queue tables already contain rows; use an empty scratch database")
+        db.commit()
+    finally:
+        db.close()
+
+
+def check(pool, log_dir):
+    sends = Counter()
+    successes = Counter()
+    for name in os.listdir(log_dir):
+        with open(os.path.join(log_dir, name)) as log:
+            for line in log:
+                kind, number, outcome = line.split()
+                sends[(kind, number)] += 1
+                if outcome == 'ok':
+                    successes[(kind, number)] += 1
+
+    problems = []
+    db = pool.get_connection()
+    try:
+        cursor = db.cursor(dictionary=True)
+        for kind, table in (('fax', 'fax_queue'), ('sms', 'sms_queue')):
+            cursor.execute(f"SELECT to_number, status, retry_count FROM {table}")
+            for row in cursor.fetchall():
+                key = (kind, row['to_number'])
+                sent = 1 if row['status'] == 'sent' else 0
+                if row['status'] not in ('sent', 'failed'):
+                    problems.append(f"{key} left {row['status']}")
+                if successes[key] != sent:
+                    problems.append(f"{key} delivered {successes[key]} times, status {row['status']}")
+                if sends[key] != (row['retry_count'] or 0) + sent:
+                    problems.append(f"{key} attempted {sends[key]} times, retry_count {row['retry_count']}")
+    finally:
+        db.close()
+
+    return sum(sends.values()), sum(successes.values()), problems
+
+
+def run(target, args):
+    pool = make_pool(target)
+    create_tables(pool, 'AUTO_INCREMENT' if target['kind'] == 'mysql' else 'AUTOINCREMENT')
+    seed(pool, args.rows)
+
+    log_dir = tempfile.mkdtemp()
+    result = multiprocessing.Queue()
+    stalled = multiprocessing.Process(target=stalled_worker, args=(target, 1, 3, result))
+    stalled.start()
+    time.sleep(0.5)  # let it claim first
+
+    start = time.monotonic()
+    workers = [multiprocessing.Process(target=run_worker,
+                                       args=(target, os.path.join(log_dir, f'worker-{index}.log'),
+                                             args.failure_rate, args.timeout))
+               for index in range(args.workers)]
+    for process in workers:
+        process.start()
+    for process in workers + [stalled]:
+        process.join()
+    elapsed = time.monotonic() - start
+
+    stalled_claimed, stalled_started = result.get()
+    attempts, delivered, problems = check(pool, log_dir)
+    if stalled_started:
+        problems.append(f"stalled worker started {stalled_started} of {stalled_claimed} sends after losing its lease")
+
+    print(f"  {target['label']:<28} {attempts:>8} {delivered:>9} {stalled_claimed:>7}/{stalled_started:<2} "
+          f"{elapsed:7.1f}s  {'OK' if not problems else f'{len(problems)} PROBLEMS'}")
+    for problem in problems[:20]:
+        print(f"    {problem}")
+    return not problems
+
+
+def main(args):
+    if args.mysql:
+        db_config = {
+            'host': os.getenv('DB_HOST', '127.0.0.1'),
+            'port': int(os.getenv('DB_PORT', '3306')),
+            'user': os.getenv('DB_USER', 'root'),
+            'password': os.getenv('DB_PASSWORD', ''),
+            'database': args.database,
+            'autocommit': True,
+        }
+        targets = [{'kind': 'mysql', 'label': f"mysql {db_config['host']}/{args.database}", 'db_config': db_config}]
+    else:
+        targets = [{'kind': 'sqlite', 'label': f'sqlite ({strategy})', 'version': version,
+                    'path': os.path.join(tempfile.mkdtemp(), 'queue.db')}
+                   for strategy, version in SERVER_VERSIONS.items()]
+        for target in targets:
+            conn = sqlite3.connect(target['path'])
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.close()
+
+    print(f"{args.workers} workers, {args.rows} faxes + {args.rows} SMS, "
+          f"{args.failure_rate:.0%} stub send failures")
+    print(f"  {'database':<28} {'attempts':>8} {'delivered':>9} {'stalled':>10} {'time':>8}")
+    ok = all([run(target, args) for target in targets])
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Check that concurrent queue workers never send a row twice.")
+    parser.add_argument('--workers', type=int, default=4, help="Worker processes")
+    parser.add_argument('--rows', type=int, default=300, help="Faxes and SMS messages to queue (each)")
+    parser.add_argument('--failure-rate', type=float, default=0.05, help="Fraction of stub sends that fail")
+    parser.add_argument('--timeout', type=float, default=120, help="Seconds each worker may run")
+    parser.add_argument('--mysql', action='store_true', help="Use a MySQL server from DB_* instead of SQLite")
+    parser.add_argument('--database', help="Scratch database for --mysql")
+    parser.add_argument('--verbose', action='store_true', help="Show the services' log output")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.CRITICAL)
+    if args.mysql and not args.database:
+        parser.error("--mysql needs --database (a scratch database)")
+    main(args)
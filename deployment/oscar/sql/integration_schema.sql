@@ -30,14 +30,18 @@ CREATE TABLE IF NOT EXISTS fax_queue (
     to_number VARCHAR(20) NOT NULL,
     document_path VARCHAR(500) NOT NULL,
     cover_page TEXT,
-    status ENUM('pending', 'sent', 'failed') DEFAULT 'pending',
+    status ENUM('pending', 'sending', 'sent', 'failed') DEFAULT 'pending',
     external_id VARCHAR(100),
     retry_count INT DEFAULT 0,
     last_error TEXT,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    send_started_at TIMESTAMP NULL,
     sent_at TIMESTAMP NULL,
+    claimed_by VARCHAR(100) NULL,
+    lease_expires_at TIMESTAMP NULL,
     INDEX idx_status (status),
-    INDEX idx_created (created_at)
+    INDEX idx_created (created_at),
+    INDEX idx_claim (status, lease_expires_at)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
 
 -- Fax log table
@@ -65,14 +69,18 @@ CREATE TABLE IF NOT EXISTS sms_queue (
     patient_id INT,
     provider_id VARCHAR(6),
     scheduled_for TIMESTAMP NULL,
-    status ENUM('pending', 'sent', 'failed') DEFAULT 'pending',
+    status ENUM('pending', 'sending', 'sent', 'failed') DEFAULT 'pending',
     external_id VARCHAR(100),
     retry_count INT DEFAULT 0,
     last_error TEXT,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    send_started_at TIMESTAMP NULL,
     sent_at TIMESTAMP NULL,
+    claimed_by VARCHAR(100) NULL,
+    lease_expires_at TIMESTAMP NULL,
     INDEX idx_status (status),
     INDEX idx_scheduled (scheduled_for),
+    INDEX idx_claim (status, lease_expires_at),
     INDEX idx_patient (patient_id),
     FOREIGN KEY (patient_id) REFERENCES demographic(demographic_no) ON DELETE CASCADE
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
@@ -165,9 +173,64 @@ CREATE TABLE IF NOT EXISTS appointment_reminders (
     FOREIGN KEY (appointment_id) REFERENCES appointment(appointment_no) ON DELETE CASCADE
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
 
+-- Shared rate limits (token buckets) for external APIs, used by every worker
+CREATE TABLE IF NOT EXISTS rate_limits (
+    name VARCHAR(50) PRIMARY KEY,
+    tokens DOUBLE NOT NULL,
+    updated_at DOUBLE NOT NULL COMMENT 'UNIX time (database clock) of the last refill'
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
 -- Insert default configuration
 INSERT IGNORE INTO system_config (config_key, config_value) VALUES
     ('setup_complete', 'false'),
     ('clinic_timezone', 'America/Vancouver'),
     ('enable_sms_reminders', 'true'),
     ('enable_patient_portal', 'true');
+
+-- Upgrades for databases created by earlier versions of this file (safe to re-run)
+-- ADD COLUMN/INDEX IF NOT EXISTS is MariaDB-only, so the guards check
+-- information_schema instead; this runs on MariaDB and MySQL 8 alike
+DROP PROCEDURE IF EXISTS integration_add_column;
+DROP PROCEDURE IF EXISTS integration_add_index;
+DELIMITER //
+CREATE PROCEDURE integration_add_column(IN table_name_in VARCHAR(64), IN column_name_in VARCHAR(64),
+                                        IN definition TEXT)
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM information_schema.COLUMNS
+                   WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = table_name_in
+                   AND COLUMN_NAME = column_name_in) THEN
+        SET @integration_ddl = CONCAT('ALTER TABLE `', table_name_in, '` ADD COLUMN `', column_name_in, '` ', definition);
+        PREPARE integration_stmt FROM @integration_ddl;
+        EXECUTE integration_stmt;
+        DEALLOCATE PREPARE integration_stmt;
+    END IF;
+END //
+CREATE PROCEDURE integration_add_index(IN table_name_in VARCHAR(64), IN index_name_in VARCHAR(64),
+                                       IN columns_in TEXT)
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM information_schema.STATISTICS
+                   WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = table_name_in
+                   AND INDEX_NAME = index_name_in) THEN
+        SET @integration_ddl = CONCAT('ALTER TABLE `', table_name_in, '` ADD INDEX `', index_name_in, '` (', columns_in, ')');
+        PREPARE integration_stmt FROM @integration_ddl;
+        EXECUTE integration_stmt;
+        DEALLOCATE PREPARE integration_stmt;
+    END IF;
+END //
+DELIMITER ;
+
+-- Outbound faxes are marked 'sending' while their upload is in flight
+ALTER TABLE fax_queue MODIFY status ENUM('pending', 'sending', 'sent', 'failed') DEFAULT 'pending';
+CALL integration_add_column('fax_queue', 'send_started_at', 'TIMESTAMP NULL AFTER created_at');
+-- Queue rows are claimed by a worker under a lease so several instances can send
+CALL integration_add_column('fax_queue', 'claimed_by', 'VARCHAR(100) NULL');
+CALL integration_add_column('fax_queue', 'lease_expires_at', 'TIMESTAMP NULL');
+CALL integration_add_index('fax_queue', 'idx_claim', 'status, lease_expires_at');
+ALTER TABLE sms_queue MODIFY status ENUM('pending', 'sending', 'sent', 'failed') DEFAULT 'pending';
+CALL integration_add_column('sms_queue', 'send_started_at', 'TIMESTAMP NULL AFTER created_at');
+CALL integration_add_column('sms_queue', 'claimed_by', 'VARCHAR(100) NULL');
+CALL integration_add_column('sms_queue', 'lease_expires_at', 'TIMESTAMP NULL');
+CALL integration_add_index('sms_queue', 'idx_claim', 'status, lease_expires_at');
+
+DROP PROCEDURE integration_add_column;
+DROP PROCEDURE integration_add_index;
@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+"""
+Columnar Drug Data
+Compact binary form of compiled_drug_data.json that can be memory-mapped and
+queried by drug_code without decoding the rest of the file.
+
+Layout (all integers little-endian uint32, every section 4-byte aligned):
+    header          magic, format version, counts and section offsets
+    string offsets  string_count + 1 offsets into the string blob
+    string blob     UTF-8 bytes of every distinct string (names, units, forms, ...)
+    index           (drug_code, row) pairs sorted by drug_code for binary search
+    rows            one fixed-width record per product, in compiled order
+    ingredients     (name, strength, unit) string ids, referenced by row ranges
+    forms           form string ids, referenced by row ranges
+    restricted      bitset with one bit per row
+"""
+import bisect
+import mmap
+import struct
+import time
+
+MAGIC = b'CSDRUG\x00\x01'
+FORMAT_VERSION = 1
+
+_HEADER = struct.Struct('<8s12I')
+# drug_code, brand_name, descriptor, schedule, restriction_reason, status, history_date,
+# first ingredient, ingredient count, first form, form count
+_ROW = struct.Struct('<11I')
+_INGREDIENT = struct.Struct('<3I')
+_PAIR = struct.Struct('<2I')
+_U32 = struct.Struct('<I')
+
+
+def _pad4(buffer):
+    """Pads a bytearray with zeros to the next 4-byte boundary."""
+    buffer.extend(b'\x00' * (-len(buffer) % 4))
+
+
+def _pack_u32s(values):
+    return struct.pack(f'<{len(values)}I', *values)
+
+
+def write_columnar(entries, output_file):
+    """
+    Writes compiled drug entries to the columnar binary format
+
+    Args:
+        entries: Compiled entries as produced by build_compiled_drug_data
+        output_file: Destination path
+
+    Returns:
+        Number of bytes written
+    """
+    strings = {}
+
+    def intern(text):
+        string_id = strings.get(text)
+        if string_id is None:
+            string_id = strings[text] = len(strings)
+        return string_id
+
+    intern('') # Empty string is always id 0
+    rows = []
+    ingredients = []
+    forms = []
+    restricted = bytearray((len(entries) + 7) // 8)
+    for row_id, entry in enumerate(entries):
+        first_ingredient = len(ingredients) // 3
+        for ingredient in entry['active_ingredients']:
+            ingredients.extend((intern(ingredient['name']), intern(ingredient['strength']),
+                                intern(ingredient['unit'])))
+        first_form = len(forms)
+        forms.extend(intern(form) for form in entry['forms'])
+        rows.extend((
+            entry['drug_code'], intern(entry['brand_name']), intern(entry['descriptor']),
+            intern(entry['schedule']), intern(entry['restriction_reason']),
+            intern(entry['status']), intern(entry['history_date']),
+            first_ingredient, len(entry['active_ingredients']), first_form, len(entry['forms']),
+        ))
+        if entry['is_restricted']:
+            restricted[row_id >> 3] |= 1 << (row_id & 7)
+
+    blob = bytearray()
+    string_offsets = []
+    for text in strings: # dicts keep insertion order, which is the id order
+        string_offsets.append(len(blob))
+        blob.extend(text.encode('utf-8'))
+    string_offsets.append(len(blob))
+
+    index = []
+    for row_id, drug_code in sorted(enumerate(rows[0::_ROW.size // 4]), key=lambda pair: pair[1]):
+        index.extend((drug_code, row_id))
+
+    body = bytearray(_HEADER.size)
+    offsets = []
+    for section in (_pack_u32s(string_offsets), blob, _pack_u32s(index), _pack_u32s(rows),
+                    _pack_u32s(ingredients), _pack_u32s(forms), restricted):
+        offsets.append(len(body))
+        body.extend(section)
+        _pad4(body)
+    _HEADER.pack_into(body, 0, MAGIC, FORMAT_VERSION, len(entries), len(strings),
+                      len(ingredients) // 3, len(forms), *offsets)
+
+    with open(output_file, 'wb') as f:
+        f.write(body)
+    return len(body)
+
+
+class ColumnarDrugData:
+    """
+    Memory-mapped reader for the columnar drug data file
+
+    Only the header is parsed on open; rows and strings are decoded on demand.
+    Use as a context manager or call close() when done.
+    """
+
+    def __init__(self, path):
+        self._file = open(path, 'rb')
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, self.row_count, self.string_count, self.ingredient_count, self.form_count,
+         self._string_offsets, self._string_blob, self._index, self._rows, self._ingredients,
+         self._forms, self._restricted) = _HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            self.close()
+            raise ValueError(f"{path} is not a columnar drug data file (version {FORMAT_VERSION})")
+
+    def close(self):
+        self._mm.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return self.row_count
+
+    def string(self, string_id):
+        """Decodes one interned string."""
+        start, end = _PAIR.unpack_from(self._mm, self._string_offsets + 4 * string_id)
+        return self._mm[self._string_blob + start:self._string_blob + end].decode('utf-8')
+
+    def _index_code(self, position):
+        return _U32.unpack_from(self._mm, self._index + _PAIR.size * position)[0]
+
+    def row_of(self, drug_code):
+        """Returns the row id for a drug_code by binary search over the index, or None."""
+        codes = _IndexView(self)
+        position = bisect.bisect_left(codes, drug_code)
+        if position < self.row_count and codes[position] == drug_code:
+            return _PAIR.unpack_from(self._mm, self._index + _PAIR.size * position)[1]
+        return None
+
+    def is_restricted_row(self, row_id):
+        """Reads a row's restricted bit without decoding anything else."""
+        return bool(self._mm[self._restricted + (row_id >> 3)] & (1 << (row_id & 7)))
+
+    def is_restricted(self, drug_code):
+        """Returns whether a drug_code is restricted, or None if it is unknown."""
+        row_id = self.row_of(drug_code)
+        return None if row_id is None else self.is_restricted_row(row_id)
+
+    def entry(self, row_id):
+        """Decodes one row into the same dict shape as compiled_drug_data.json."""
+        (drug_code, brand_name, descriptor, schedule, reason, status, history_date,
+         first_ingredient, ingredient_count, first_form, form_count) = _ROW.unpack_from(
+            self._mm, self._rows + _ROW.size * row_id)
+        string = self.string
+        active_ingredients = []
+        for i in range(first_ingredient, first_ingredient + ingredient_count):
+            name, strength, unit = _INGREDIENT.unpack_from(self._mm, self._ingredients + _INGREDIENT.size * i)
+            active_ingredients.append({"name": string(name), "strength": string(strength), "unit": string(unit)})
+        form_ids = struct.unpack_from(f'<{form_count}I', self._mm, self._forms + 4 * first_form)
+        return {
+            "drug_code": drug_code,
+            "brand_name": string(brand_name),
+            "descriptor": string(descriptor),
+            "active_ingredients": active_ingredients,
+            "forms": [string(form_id) for form_id in form_ids],
+            "schedule": string(schedule),
+            "is_restricted": self.is_restricted_row(row_id),
+            "restriction_reason": string(reason),
+            "status": string(status),
+            "history_date": string(history_date),
+        }
+
+    def lookup(self, drug_code):
+        """Returns the entry for a drug_code, or None if it is unknown."""
+        row_id = self.row_of(drug_code)
+        return None if row_id is None else self.entry(row_id)
+
+    def __iter__(self):
+        for row_id in range(self.row_count):
+            yield self.entry(row_id)
+
+
+class _IndexView:
+    """Sequence view over the sorted drug_code index, so bisect can search it in place."""
+
+    def __init__(self, data):
+        self._data = data
+
+    def __len__(self):
+        return self._data.row_count
+
+    def __getitem__(self, position):
+        return self._data._index_code(position)
+
+
+# --- Size and load-time comparison ---
+def compare(json_gz_path, columnar_path=None, sample_size=1000):
+    """Prints size and load/lookup times of the columnar file against the .json.gz it was built from.
+
+    The columnar file is rebuilt from the .json.gz for the comparison. It goes to
+    a temp file that is removed afterwards, unless columnar_path asks for it to be
+    written (and kept) somewhere.
+    """
+    import gzip
+    import json
+    import os
+    import random
+    import tempfile
+
+    start = time.perf_counter()
+    with gzip.open(json_gz_path, 'rt', encoding='utf-8') as f:
+        entries = json.load(f)
+    json_load = time.perf_counter() - start
+    by_code = {entry['drug_code']: entry for entry in entries}
+
+    keep = columnar_path is not None
+    if not keep:
+        fd, columnar_path = tempfile.mkstemp(suffix='.bin')
+        os.close(fd)
+    try:
+        write_columnar(entries, columnar_path)
+        columnar_size = os.path.getsize(columnar_path)
+        with open(columnar_path, 'rb') as f:
+            columnar_gz_size = len(gzip.compress(f.read(), 9))
+
+        sample = random.Random(0).sample(list(by_code), min(sample_size, len(by_code)))
+        start = time.perf_counter()
+        with ColumnarDrugData(columnar_path) as data:
+            open_time = time.perf_counter() - start
+            start = time.perf_counter()
+            found = [data.lookup(code) for code in sample]
+            lookup_time = time.perf_counter() - start
+            if found != [by_code[code] for code in sample]:
+                print("❌ Columnar lookups do not match the JSON entries")
+                return False
+    finally:
+        if not keep:
+            os.remove(columnar_path)
+
+    print(f"  {len(entries):,} entries")
+    print(f"  .json.gz size:         {os.path.getsize(json_gz_path) / 1024 / 1024:8.2f} MB")
+    print(f"  columnar size:         {columnar_size / 1024 / 1024:8.2f} MB "
+          f"({columnar_gz_size / 1024 / 1024:.2f} MB gzipped)")
+    print(f"  .json.gz full load:    {json_load * 1000:8.1f} ms")
+    print(f"  columnar open (mmap):  {open_time * 1000:8.3f} ms")
+    print(f"  columnar lookup:       {lookup_time / len(sample) * 1e6:8.1f} µs per drug_code "
+          f"({len(sample):,} sampled, all match)")
+    return True
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description="Compare the columnar drug data file with the .json.gz.")
+    parser.add_argument('json_gz_path', nargs='?', default='compiled_drug_data.json.gz')
+    parser.add_argument('columnar_path', nargs='?',
+                        help="Also write the columnar file here (default: a temp file, removed afterwards)")
+    args = parser.parse_args()
+    sys.exit(0 if compare(args.json_gz_path, args.columnar_path) else 1)
@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+"""
+Drug Search Index
+Prebuilt autocomplete index over brand names and active ingredient names of the
+compiled drug data, so consumers do not have to scan every entry per keystroke.
+
+The index holds three tables, all keyed to row ids (positions in
+compiled_drug_data.json, which are also the rows of compiled_drug_data.bin):
+    names     sorted distinct normalized names, each with its row ids
+    words     sorted word-start suffixes of those names ("extra strength" for
+              "tylenol extra strength"), each with its row ids
+    trigrams  trigram -> ids in the names table, for substring matches
+
+search() ranks whole-name prefix matches first, then word prefix matches, then
+substring matches; ties are broken alphabetically and then by row id.
+"""
+import bisect
+import gzip
+import json
+import time
+
+SEARCH_INDEX_FORMAT = 1
+
+PREFIX, WORD, SUBSTRING = 'prefix', 'word', 'substring'
+
+
+def normalize(txt):
+    """Converts text to lowercase and strips whitespace (same as the compiler's normalize_text)."""
+    return str(txt).strip().lower() if txt is not None else ""
+
+
+def _searchable_names(entry):
+    """Yields the normalized names an entry can be found by."""
+    yield normalize(entry['brand_name'])
+    for ingredient in entry['active_ingredients']:
+        yield normalize(ingredient['name'])
+
+
+def _word_suffixes(name):
+    """Yields the suffixes of name that start at a word boundary, excluding the name itself."""
+    for i in range(1, len(name)):
+        if name[i].isalnum() and not name[i - 1].isalnum():
+            yield name[i:]
+
+
+def _trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class SearchIndex:
+    """Prefix and trigram index over drug names; build with build_search_index() or load()."""
+
+    def __init__(self, names, name_rows, words, word_rows, trigrams):
+        self.names = names
+        self.name_rows = name_rows
+        self.words = words
+        self.word_rows = word_rows
+        self.trigrams = trigrams
+
+    def save(self, path):
+        """Writes the index as gzip'd JSON."""
+        payload = {
+            "format": SEARCH_INDEX_FORMAT,
+            "names": self.names,
+            "name_rows": self.name_rows,
+            "words": self.words,
+            "word_rows": self.word_rows,
+            "trigrams": self.trigrams,
+        }
+        with gzip.open(path, 'wt', encoding='utf-8') as f:
+            json.dump(payload, f, ensure_ascii=False, separators=(',', ':'))
+
+    @classmethod
+    def load(cls, path):
+        """Reads an index written by save()."""
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            payload = json.load(f)
+        if payload.get("format") != SEARCH_INDEX_FORMAT:
+            raise ValueError(f"Unsupported search index format: {payload.get('format')}")
+        return cls(payload["names"], payload["name_rows"], payload["words"],
+                   payload["word_rows"], payload["trigrams"])
+
+    def search(self, prefix, limit=10):
+        """
+        Finds drugs whose brand or ingredient name matches a typed prefix
+
+        Returns:
+            Up to limit (row_id, matched_name, match_type) tuples, one per row, best first.
+            match_type is 'prefix', 'word' or 'substring'.
+        """
+        query = normalize(prefix)
+        if not query or limit <= 0:
+            return []
+        results = []
+        seen = set()
+
+        def collect(rows, name, match_type):
+            for row in rows:
+                if row not in seen:
+                    seen.add(row)
+                    results.append((row, name, match_type))
+                    if len(results) >= limit:
+                        return True
+            return False
+
+        # Whole-name prefix, then word prefix: contiguous ranges of the sorted tables
+        for keys, key_rows, match_type in ((self.names, self.name_rows, PREFIX),
+                                           (self.words, self.word_rows, WORD)):
+            position = bisect.bisect_left(keys, query)
+            while position < len(keys) and keys[position].startswith(query):
+                if collect(key_rows[position], keys[position], match_type):
+                    return results
+                position += 1
+
+        # Substring anywhere in the name, via the rarest trigram's postings
+        if len(query) >= 3:
+            postings = [self.trigrams.get(trigram) for trigram in _trigrams(query)]
+            if all(postings):
+                postings.sort(key=len)
+                others = [set(posting) for posting in postings[1:]]
+                for name_id in postings[0]:
+                    if all(name_id in other for other in others):
+                        name = self.names[name_id]
+                        if query in name and collect(self.name_rows[name_id], name, SUBSTRING):
+                            return results
+        return results
+
+
+def build_search_index(entries):
+    """Builds a SearchIndex over the brand and ingredient names of compiled entries."""
+    rows_by_name = {}
+    for row, entry in enumerate(entries):
+        for name in _searchable_names(entry):
+            if name:
+                rows = rows_by_name.setdefault(name, [])
+                if not rows or rows[-1] != row:
+                    rows.append(row)
+
+    names = sorted(rows_by_name)
+    name_rows = [rows_by_name[name] for name in names]
+
+    rows_by_word = {}
+    trigrams = {}
+    for name_id, name in enumerate(names):
+        for suffix in _word_suffixes(name):
+            rows_by_word.setdefault(suffix, set()).update(name_rows[name_id])
+        for trigram in _trigrams(name):
+            trigrams.setdefault(trigram, []).append(name_id)
+
+    words = sorted(rows_by_word)
+    word_rows = [sorted(rows_by_word[word]) for word in words]
+    return SearchIndex(names, name_rows, words, word_rows, trigrams)
+
+
+# --- Benchmark ---
+def linear_search(entries, prefix, limit=10):
+    """Reference implementation: scans every entry's names with the same ranking as SearchIndex.search()."""
+    query = normalize(prefix)
+    if not query or limit <= 0:
+        return []
+    best = {}
+    for row, entry in enumerate(entries):
+        for name in _searchable_names(entry):
+            if name.startswith(query):
+                candidate = (0, name, row, PREFIX)
+            else:
+                word = min((suffix for suffix in _word_suffixes(name) if suffix.startswith(query)), default=None)
+                if word is not None:
+                    candidate = (1, word, row, WORD)
+                elif len(query) >= 3 and query in name:
+                    candidate = (2, name, row, SUBSTRING)
+                else:
+                    continue
+            if row not in best or candidate < best[row]:
+                best[row] = candidate
+    ranked = sorted(best.values())[:limit]
+    return [(row, name, match_type) for _, name, row, match_type in ranked]
+
+
+def run_benchmark(compiled_path, queries=None, limit=10, repeat=20):
+    """Times SearchIndex.search() against linear_search() over a compiled data file."""
+    opener = gzip.open if compiled_path.endswith('.gz') else open
+    with opener(compiled_path, 'rt', encoding='utf-8') as f:
+        entries = json.load(f)
+    queries = queries or ['a', 'ty', 'acet', 'amox', 'morph', 'hydrochlor', 'olol', 'zzz']
+
+    start = time.perf_counter()
+    index = build_search_index(entries)
+    print(f"Built index over {len(entries):,} entries in {time.perf_counter() - start:.2f}s "
+          f"({len(index.names):,} names, {len(index.words):,} word keys, {len(index.trigrams):,} trigrams)")
+
+    ok = True
+    print(f"  {'query':<12} {'index':>10} {'linear scan':>12} {'speed-up':>9}")
+    for query in queries:
+        start = time.perf_counter()
+        for _ in range(repeat):
+            indexed = index.search(query, limit)
+        index_time = (time.perf_counter() - start) / repeat
+        start = time.perf_counter()
+        scanned = linear_search(entries, query, limit)
+        scan_time = time.perf_counter() - start
+        if indexed != scanned:
+            print(f"❌ Results differ for {query!r}")
+            ok = False
+        print(f"  {query:<12} {index_time * 1000:8.3f}ms {scan_time * 1000:10.1f}ms {scan_time / index_time:8.0f}x")
+    return ok
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description="Benchmark the drug search index against a linear scan.")
+    parser.add_argument('compiled_path', nargs='?', default='compiled_drug_data.json.gz')
+    parser.add_argument('queries', nargs='*', help="Queries to time (default: a built-in sample)")
+    parser.add_argument('--limit', type=int, default=10)
+    args = parser.parse_args()
+    sys.exit(0 if run_benchmark(args.compiled_path, args.queries, args.limit) else 1)
@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+"""
+Restriction Classifier
+Decides whether a drug product is restricted (controlled/narcotic/targeted) from its
+schedule, brand name and active ingredient names.
+
+All substring patterns are compiled once into a single trie-shaped regular expression,
+so each string is scanned in one pass instead of being tested against every pattern
+in turn. Exact name and alias matches use one merged set.
+"""
+import re
+import time
+
+
+def _trie_pattern(terms):
+    """Builds a regex alternation with shared prefixes factored out, e.g. ab|ac -> a(?:b|c)."""
+    trie = {}
+    for term in terms:
+        node = trie
+        for char in term:
+            node = node.setdefault(char, {})
+        node[''] = {} # End-of-term marker
+
+    def emit(node):
+        branches = []
+        optional = False
+        for char in sorted(node):
+            if char == '':
+                optional = True
+            else:
+                branches.append(re.escape(char) + emit(node[char]))
+        if not branches:
+            return ''
+        body = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+        if optional:
+            # A shorter term ends here; the longer continuations remain optional
+            body = '(?:' + body + ')?' if len(branches) == 1 else body + '?'
+        return body
+
+    return emit(trie)
+
+
+def compile_terms(terms):
+    """Compiles substring terms into one regex, or None if there are no terms."""
+    terms = [term for term in terms if term]
+    if not terms:
+        return None
+    return re.compile(_trie_pattern(terms))
+
+
+class RestrictionClassifier:
+    """
+    Classifies products using precompiled restriction rules
+
+    Args:
+        schedule_terms: Substrings that mark a normalized schedule name as controlled
+        restricted_names: Normalized product/ingredient names and aliases matched exactly
+        ingredient_terms: Substrings that mark a normalized ingredient name as controlled
+    """
+
+    def __init__(self, schedule_terms=(), restricted_names=(), ingredient_terms=()):
+        self.restricted_names = frozenset(restricted_names)
+        self._schedule_regex = compile_terms(schedule_terms)
+        self._ingredient_regex = compile_terms(ingredient_terms)
+        # Ingredient names repeat across thousands of products, so cache their verdicts
+        self._ingredient_cache = {}
+
+    def schedule_term(self, normalized_schedule):
+        """Returns the first controlled term found in a normalized schedule name, or None."""
+        if not normalized_schedule or self._schedule_regex is None:
+            return None
+        match = self._schedule_regex.search(normalized_schedule)
+        return match.group(0) if match else None
+
+    def is_restricted_name(self, normalized_name):
+        """Returns True if a normalized name exactly matches a restricted name or alias."""
+        return normalized_name in self.restricted_names
+
+    def ingredient_term(self, normalized_name):
+        """Returns the first always-restricted term found in a normalized ingredient name, or None."""
+        try:
+            return self._ingredient_cache[normalized_name]
+        except KeyError:
+            pass
+        term = None
+        if normalized_name and self._ingredient_regex is not None:
+            match = self._ingredient_regex.search(normalized_name)
+            term = match.group(0) if match else None
+        self._ingredient_cache[normalized_name] = term
+        return term
+
+    def classify(self, brand_name, schedule, ingredient_names):
+        """
+        Classifies one product
+
+        Checks run in priority order (schedule, product name, exact ingredient name,
+        always-restricted ingredient substring) and stop at the first hit.
+
+        Returns:
+            A list of restriction reasons, empty if the product is not restricted
+        """
+        if schedule and self.schedule_term(_normalize(schedule)):
+            return [f"Schedule ({schedule})"]
+
+        if self.is_restricted_name(_normalize(brand_name)):
+            return ["Restricted Product Name"]
+
+        normalized_ingredients = [_normalize(name) for name in ingredient_names]
+        for name, normalized in zip(ingredient_names, normalized_ingredients):
+            if self.is_restricted_name(normalized):
+                return [f"Restricted Ingredient ({name})"]
+
+        for name, normalized in zip(ingredient_names, normalized_ingredients):
+            if self.ingredient_term(normalized):
+                return [f"Common Controlled Ingredient ({name})"]
+
+        return []
+
+
+def _normalize(txt):
+    """Converts text to lowercase and strips whitespace (same as the compiler's normalize_text)."""
+    return str(txt).strip().lower() if txt is not None else ""
+
+
+# --- Micro-benchmark ---
+def _classify_nested_loops(brand_name, schedule, ingredient_names, schedule_terms,
+                           restricted_names, ingredient_terms):
+    """Reference implementation: the original per-pattern loops from the combine stage."""
+    normalized_schedule = _normalize(schedule)
+    if schedule:
+        for prefix in schedule_terms:
+            if prefix in normalized_schedule:
+                return [f"Schedule ({schedule})"]
+    if _normalize(brand_name) in restricted_names:
+        return ["Restricted Product Name"]
+    for name in ingredient_names:
+        if _normalize(name) in restricted_names:
+            return [f"Restricted Ingredient ({name})"]
+    for name in ingredient_names:
+        normalized = _normalize(name)
+        for term in ingredient_terms:
+            if term in normalized:
+                return [f"Common Controlled Ingredient ({name})"]
+    return []
+
+
+def run_benchmark(compiled_path, repeat=3):
+    """Compares the classifier against the nested loops over an existing compiled data file."""
+    import gzip
+    import json
+    import os
+    from build_compiled_drug_data import (
+        ALWAYS_RESTRICTED_INGREDIENTS, CONTROLLED_SCHEDULE_PREFIXES, RESTRICTED_JSON,
+        load_restricted_names,
+    )
+
+    opener = gzip.open if compiled_path.endswith('.gz') else open
+    with opener(compiled_path, 'rt', encoding='utf-8') as f:
+        products = [
+            (entry['brand_name'], entry['schedule'], [i['name'] for i in entry['active_ingredients']])
+            for entry in json.load(f)
+        ]
+    restricted_names, restricted_aliases = load_restricted_names(
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), RESTRICTED_JSON))
+    names = restricted_names | restricted_aliases
+    print(f"Benchmarking {len(products):,} products, {len(names):,} names/aliases, "
+          f"{len(CONTROLLED_SCHEDULE_PREFIXES)} schedule terms, {len(ALWAYS_RESTRICTED_INGREDIENTS)} ingredient terms")
+
+    def best_of(func):
+        best = float('inf')
+        for _ in range(repeat):
+            start = time.perf_counter()
+            results = func()
+            best = min(best, time.perf_counter() - start)
+        return best, results
+
+    loop_time, loop_results = best_of(lambda: [
+        _classify_nested_loops(b, s, i, CONTROLLED_SCHEDULE_PREFIXES, names, ALWAYS_RESTRICTED_INGREDIENTS)
+        for b, s, i in products
+    ])
+
+    def classify_all():
+        # Build inside the timed region so compilation cost is included
+        classifier = RestrictionClassifier(CONTROLLED_SCHEDULE_PREFIXES, names, ALWAYS_RESTRICTED_INGREDIENTS)
+        return [classifier.classify(b, s, i) for b, s, i in products]
+
+    classifier_time, classifier_results = best_of(classify_all)
+
+    if classifier_results != loop_results:
+        mismatches = sum(a != b for a, b in zip(classifier_results, loop_results))
+        print(f"❌ Results differ for {mismatches:,} products")
+        return False
+    print(f"  Nested loops: {loop_time * 1000:8.1f} ms ({len(products) / loop_time:,.0f} products/s)")
+    print(f"  Classifier:   {classifier_time * 1000:8.1f} ms ({len(products) / classifier_time:,.0f} products/s)")
+    print(f"  Speed-up:     {loop_time / classifier_time:.1f}x, identical results")
+    return True
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description="Benchmark the restriction classifier against the nested loops.")
+    parser.add_argument('compiled_path', nargs='?', default='compiled_drug_data.json.gz',
+                        help="Compiled drug data (.json or .json.gz) to classify")
+    parser.add_argument('--repeat', type=int, default=3, help="Runs per implementation; the best is reported")
+    args = parser.parse_args()
+    sys.exit(0 if run_benchmark(args.compiled_path, args.repeat) else 1)
@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+"""
+Fetch Verification
+Serves canned Health Canada payloads from a local HTTP server and checks that every
+fetch path returns what a plain json.loads() of the payload gives:
+
+- fetch_all() concurrently over the pooled session and one endpoint at a time; a
+  failing endpoint comes back as None without affecting the others
+- fetch_all() with streaming (lookup endpoints compared with their LOOKUP_BUILDERS
+  tables built from the parsed payload)
+- both modes again through a ResponseCache, where the second run gets 304 Not
+  Modified and replays the cached copy
+- fetch_cached() (--from-cache), returning lists and streaming into the builders
+- iter_json_array() over each payload cut into chunks of several sizes
+
+It also feeds iter_json_array() malformed and edge-case arrays ("[,,1]", "[1,]",
+"[1]x", ...) and checks that it rejects exactly what json.loads() rejects, and
+that a malformed endpoint payload fails both fetch modes the same way.
+
+Usage:
+    python verify_fetch.py --records 5000
+"""
+import argparse
+import contextlib
+import io
+import json
+import random
+import sys
+import tempfile
+import threading
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import build_compiled_drug_data as compiler
+
+# Array syntax edge cases; each must be accepted or rejected exactly as json.loads() does
+EDGE_CASES = [
+    '[,,1]', '[,]', '[1,,2]', '[1,]', '[1 2]', '["a" "b"]', '[{"a": 1}{"b": 2}]',
+    '[1]x', '[1, 2] [3]', '[1', '[', '[1e]', '[1.]', '[-]', '{}', '"text"',
+    '', ' ', 'null', '[]', ' [ ] ', '[[], [[]], {}]', '[1e5, -0.5, 2E-3, 0]',
+    '["a,b]", "\\"]", "\\u00e9\\u20ac", "é€😀"]', '[true, false, null]\n',
+]
+CHUNK_SIZES = [3, 7, 4096, compiler.STREAM_CHUNK_SIZE]
+
+
+def make_payloads(records, seed):
+    """Canned endpoint payloads with multi-byte text and numbers that straddle chunk edges"""
+    rng = random.Random(seed)
+    names = ['acétaminophène', 'ibuprofen', 'morphine sulfate', '5-fluorouracil', 'naloxone hcl', 'ß-carotene 😀']
+    forms = ['TABLET', 'CAPSULE', 'SOLUTION', 'CRÈME', '']
+    schedules = ['Prescription', 'Narcotic (CDSA I)', 'OTC', 'Schedule G (CDSA III)']
+    codes = list(range(1, records + 1))
+    return {
+        'drugproduct': [{
+            'drug_code': code,
+            'brand_name': f"{rng.choice(names).upper()} {rng.randint(1, 500)}",
+            'descriptor': rng.choice(['', 'extended release', 'élixir']),
+            'number_of_ais': rng.randint(1, 4),
+            'ai_group_no': f"{rng.randint(0, 10 ** 10):010d}",
+            'class_name': rng.choice(['Human', 'Veterinary']),
+            'last_update_date': '2024-01-01',
+            'ratio': rng.random() * 10 ** rng.randint(-8, 8),
+        } for code in codes],
+        'activeingredient': [{
+            'drug_code': code,
+            'ingredient_name': rng.choice(names),
+            'strength': f"{rng.uniform(0.1, 1000):.3f}",
+            'strength_unit': rng.choice(['MG', 'µG', 'UNIT']),
+        } for code in codes for _ in range(rng.randint(1, 3))],
+        'form': [{'drug_code': code, 'pharmaceutical_form_name': rng.choice(forms)} for code in codes],
+        'schedule': [{'drug_code': code, 'schedule_name': rng.choice(schedules)} for code in codes],
+    }
+
+
+def serve(bodies):
+    """Local stand-in for the Health Canada API: GET /<name>/ answers bodies[name], honouring If-None-Match"""
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            name = self.path.strip('/').split('/')[0]
+            if name not in bodies:
+                self.send_response(404)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            body = bodies[name]
+            etag = f'"{zlib.crc32(body):08x}"'
+            if self.headers.get('If-None-Match') == etag:
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.send_header('ETag', etag)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def expected_results(payloads, stream):
+    """What fetch_all() should return: the payload lists, or the lookups built from them when streaming"""
+    if not stream:
+        return payloads
+    return {name: compiler.LOOKUP_BUILDERS.get(name, list)(records) for name, records in payloads.items()}
+
+
+def quietly(fn, *args, **kwargs):
+    """Calls fn with its progress output suppressed"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        return fn(*args, **kwargs)
+
+
+class Checks:
+    """Prints each check as it runs and counts the failures"""
+
+    def __init__(self):
+        self.failed = 0
+
+    def check(self, label, ok, detail=''):
+        print(f"  {'ok' if ok else 'FAIL':<5} {label}{f' ({detail})' if detail and not ok else ''}")
+        self.failed += not ok
+
+
+def check_fetch_all(checks, payloads, endpoints):
+    data, stats = quietly(compiler.fetch_all, endpoints)
+    checks.check("fetch_all concurrent", data == payloads)
+    checks.check("fetch_all stats", all(stats[name]['records'] == len(payloads[name]) for name in endpoints),
+                 "record counts differ")
+
+    data, _ = quietly(compiler.fetch_all, endpoints, max_workers=1)
+    checks.check("fetch_all one at a time", data == payloads)
+
+    data, _ = quietly(compiler.fetch_all, endpoints, stream=True)
+    checks.check("fetch_all streamed", data == expected_results(payloads, True))
+
+
+def check_failed_endpoint(checks, payloads, endpoints):
+    """An endpoint that fails is None; the others still arrive"""
+    with_missing = dict(endpoints, missing='/missing/?lang=en&type=json')
+    data, _ = quietly(compiler.fetch_all, with_missing)
+    checks.check("fetch_all 404 endpoint is None, others intact",
+                 data.pop('missing') is None and data == payloads)
+
+
+def check_cache(checks, payloads, endpoints):
+    cache_dir = tempfile.mkdtemp(prefix='hc-cache-')
+    for stream in (False, True):
+        expected = expected_results(payloads, stream)
+        mode = 'streamed' if stream else 'buffered'
+        cache = compiler.ResponseCache(f"{cache_dir}/{mode}")
+        first, _ = quietly(compiler.fetch_all, endpoints, stream=stream, cache=cache)
+        second, stats = quietly(compiler.fetch_all, endpoints, stream=stream, cache=cache)
+        checks.check(f"fetch_all {mode}, cache filled", first == expected)
+        checks.check(f"fetch_all {mode}, 304 from cache", second == expected
+                     and all(stats[name]['cached'] for name in endpoints), "not every endpoint came from the cache")
+
+        offline, _ = quietly(compiler.fetch_all, endpoints, stream=stream, cache=cache, offline=True)
+        checks.check(f"fetch_all {mode}, offline (fetch_cached)", offline == expected)
+
+
+def check_iter_json_array(checks, bodies):
+    for name, body in bodies.items():
+        text = body.decode('utf-8')
+        expected = json.loads(text)
+        for size in CHUNK_SIZES:
+            byte_chunks = [body[i:i + size] for i in range(0, len(body), size)]
+            records = list(compiler.iter_json_array(compiler.iter_text(byte_chunks)))
+            if records != expected:
+                checks.check(f"iter_json_array {name}, {size}-byte chunks", False, "records differ")
+                break
+        else:
+            checks.check(f"iter_json_array {name}, chunk sizes {CHUNK_SIZES}", True)
+
+
+def parse_all(text, chunk_size):
+    """('ok', records) or ('error', None) from iter_json_array over text cut into chunk_size pieces"""
+    chunks = [text[i:i + chunk_size] for i in range(0, len(text), chunk_size)]
+    try:
+        return 'ok', list(compiler.iter_json_array(chunks))
+    except ValueError:
+        return 'error', None
+
+
+def parse_whole(text):
+    """The same for json.loads(), with a top-level null or empty body read as no records"""
+    try:
+        value = json.loads(text) if text.strip() else None
+    except ValueError:
+        return 'error', None
+    if value is None:
+        return 'ok', []
+    return ('ok', value) if isinstance(value, list) else ('error', None)
+
+
+def check_edge_cases(checks):
+    for text in EDGE_CASES:
+        expected = parse_whole(text)
+        results = {size: parse_all(text, size) for size in (1, 2, 3, len(text) or 1)}
+        wrong = [size for size, result in results.items() if result != expected]
+        checks.check(f"iter_json_array {text!r} -> {expected[0]}", not wrong, f"differs for chunk sizes {wrong}")
+
+
+def check_malformed_endpoint(checks, bodies):
+    """A malformed payload is a critical failure (None) in both fetch modes"""
+    bodies['broken'] = b'[{"drug_code": 1},,{"drug_code": 2}]'
+    broken = {'broken': '/broken/?lang=en&type=json'}
+    for stream in (False, True):
+        data, _ = quietly(compiler.fetch_all, broken, stream=stream)
+        checks.check(f"fetch_all {'streamed' if stream else 'buffered'} rejects '[...,,...]'", data['broken'] is None)
+    del bodies['broken']
+
+
+def main(args):
+    payloads = make_payloads(args.records, args.seed)
+    bodies = {name: json.dumps(records, ensure_ascii=False).encode('utf-8') for name, records in payloads.items()}
+    server = serve(bodies)
+    compiler.HC_API_BASE_URI = f"http://127.0.0.1:{server.server_address[1]}"
+    endpoints = {name: compiler.ENDPOINTS[name] for name in payloads}
+
+    size_mb = sum(len(body) for body in bodies.values()) / 1024 / 1024
+    print(f"{args.records:,} products, {size_mb:.1f} MB of canned payloads at {compiler.HC_API_BASE_URI}")
+    checks = Checks()
+    try:
+        check_fetch_all(checks, payloads, endpoints)
+        check_failed_endpoint(checks, payloads, endpoints)
+        check_cache(checks, payloads, endpoints)
+        check_iter_json_array(checks, bodies)
+        check_edge_cases(checks)
+        check_malformed_endpoint(checks, bodies)
+    finally:
+        server.shutdown()
+
+    print(f"{checks.failed} check(s) failed" if checks.failed else "All checks passed")
+    sys.exit(1 if checks.failed else 0)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check endpoint fetches against json.loads() of canned payloads.")
+    parser.add_argument('--records', type=int, default=5000, help="Products in the canned drugproduct payload")
+    parser.add_argument('--seed', type=int, default=1, help="Random seed for the canned payloads")
+    main(parser.parse_args())